@@ -0,0 +1,173 @@
+"""
+动图逐帧流式处理
+
+Pillow 的 save_all 会先把全部帧保存在内存中 (GIF 写入前会收集所有帧做差分，WebP 会把 append_images 转成列表)，
+内存随帧数线性增长。这里的写入方式每次只保留一两帧:
+- write_gif: 逐帧量化、裁剪、编码后立即写出 (使用 GifImagePlugin 的 getheader / getdata)
+- FrameSequence: 把帧迭代器包装成可 seek 的图片，交给 WebP 编码器按顺序逐帧拉取
+"""
+from collections import deque
+
+from PIL import Image, ImageChops, GifImagePlugin
+
+# GIF 透明度二值化查找表: alpha > 128 为不透明，其余全透 (与逐像素判断等价，直接在 C 层查表)
+GIF_ALPHA_LUT = [0] * 129 + [255] * 127
+
+
+def ordered_map(func, items, workers=1):
+    """
+    按输入顺序产出 func(item) 的结果 (生成器)
+    workers > 1 时使用线程池，同时处理的元素不超过 workers * 2 个，内存占用不随元素总数增长
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        window = deque()
+        for item in items:
+            window.append(pool.submit(func, item))
+            if len(window) >= workers * 2:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+def _to_palette(frame, optimize=True):
+    """
+    转换为 GIF 可写入的 P 模式，optimize 时去掉调色板中未使用的颜色 (局部调色板更小)
+    :return: (图片, 透明色索引或 None)
+    """
+    if frame.mode == 'P':
+        p = frame
+        transparency = frame.info.get('transparency')
+    else:
+        if frame.mode not in ('RGB', 'RGBA'):
+            frame = frame.convert('RGB')
+        p = frame.convert('P', palette=Image.Palette.ADAPTIVE)
+        transparency = None
+        if p.palette.mode == 'RGBA':
+            for rgba, index in p.palette.colors.items():
+                if rgba[3] == 0:
+                    transparency = index
+                    break
+
+    if not optimize:
+        return p, transparency
+
+    used = [i for i, count in enumerate(p.histogram()) if count]
+    palette_size = len(p.palette.palette) // len(p.palette.mode)
+    if used and (max(used) >= len(used) or len(used) < palette_size):
+        p = p.remap_palette(used)
+        if transparency is not None:
+            transparency = used.index(transparency) if transparency in used else None
+    return p, transparency
+
+
+def write_gif(fp, frames, loop=0, disposal=2, optimize=True):
+    """
+    逐帧写出 GIF 动画
+    - 与上一帧完全相同的帧合并为一帧 (时长累加)
+    - 带透明色时只写出不透明区域的外接矩形 (配合 disposal=2)
+    :param fp: 可写的二进制文件对象
+    :param frames: 帧迭代器 (RGB / RGBA / P / L，透明度需已二值化)，帧的 info['duration'] 为时长
+    :param loop: 循环次数 (0 为无限)
+    :param disposal: 帧处理方式 (2: 播放完后恢复背景)
+    :param optimize: 去掉调色板中未使用的颜色、只写出不透明区域 (False 时省去逐帧统计，文件稍大)
+    :return: 写出的帧数
+    """
+    pending = None      # 尚未写出的帧: (P 图片, 偏移, 参数)。下一帧相同时还需要修改它的时长
+    previous = None     # 上一帧原图，用于判断相同帧
+    written = 0
+
+    for frame in frames:
+        duration = frame.info.get('duration', 0)
+
+        if previous is not None and previous.size == frame.size and previous.mode == frame.mode \
+                and ImageChops.difference(previous, frame).getbbox() is None:
+            pending[2]['duration'] = pending[2].get('duration', 0) + duration
+            continue
+
+        p, transparency = _to_palette(frame, optimize)
+        params = {'disposal': disposal}
+        if duration:
+            params['duration'] = duration
+        if transparency is not None:
+            params['transparency'] = transparency
+
+        if pending is None:
+            # 文件头 + 全局调色板 (第一帧的调色板)
+            header, _ = GifImagePlugin.getheader(p, None, dict(params, loop=loop))
+            for chunk in header:
+                fp.write(chunk)
+            offset = (0, 0)
+        else:
+            # 之后的帧使用各自的局部调色板
+            params['include_color_table'] = True
+            offset = (0, 0)
+            if optimize and transparency is not None and 'A' in frame.getbands():
+                bbox = frame.getchannel('A').getbbox()
+                if bbox and bbox != (0, 0) + frame.size:
+                    p = p.crop(bbox)
+                    offset = bbox[:2]
+
+        if pending is not None:
+            _write_frame(fp, pending)
+            written += 1
+        pending = (p, offset, params)
+        previous = frame
+
+    if pending is not None:
+        _write_frame(fp, pending)
+        written += 1
+    fp.write(b';') # GIF 结束标记
+    return written
+
+
+def _write_frame(fp, frame):
+    p, offset, params = frame
+    for chunk in GifImagePlugin.getdata(p, offset, **params):
+        fp.write(chunk)
+
+
+class FrameSequence(Image.Image):
+    """
+    把帧迭代器包装成多帧图片，用于 save(save_all=True)。编码器 seek 到下一帧时才从迭代器取出该帧，
+    内存中始终只有当前帧。只支持从前往后顺序读取 (编码结束时 Pillow 回到起始帧的 seek 会被忽略)。
+    保存时应传入 duration=sequence.durations 保留每帧的时长 (否则全部使用第一帧的时长)
+    """
+
+    def __init__(self, frames, n_frames):
+        """
+        :param frames: 帧迭代器 (RGB / RGBA)
+        :param n_frames: 帧数
+        """
+        super().__init__()
+        self._frames = iter(frames)
+        self.n_frames = n_frames
+        self.is_animated = n_frames > 1
+        self._index = -1
+        # 已取出各帧的时长。编码器 seek 到某一帧之后才按帧序号读取它的时长，列表随读取增长
+        self.durations = []
+        self.seek(0)
+
+    def seek(self, frame):
+        if frame <= self._index:
+            return
+        if frame != self._index + 1:
+            raise EOFError("frames can only be read in order")
+
+        current = next(self._frames, None)
+        if current is None:
+            raise EOFError("no more frames")
+        current.load()
+        # 接管当前帧的图像数据与属性 (im / 模式 / 尺寸 / info)
+        self.__dict__.update(current.__dict__)
+        self.durations.append(current.info.get('duration', 0))
+        self._index = frame
+
+    def tell(self):
+        return self._index
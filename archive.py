@@ -0,0 +1,197 @@
+"""
+压缩包 (zip / tar) 直接输入输出
+
+客户发来的图片集通常是 zip 压缩包。以前需要先解压到磁盘、压缩到 _compressed 文件夹、再重新打包，
+相当于三遍完整的磁盘读写。BatchEngine.run_archive 直接从压缩包中逐个读出成员交给工作进程，
+结果直接写入输出压缩包，中间不产生任何临时文件:
+- read_archive 顺序读取成员 (tar 以流模式读取，.tar.gz 等无需随机访问)，一次只在内存中保留正在处理的成员
+- ArchiveWriter 按原压缩包中的顺序写入成员 (先完成的成员由 run_archive 暂存)，图片以不压缩 (STORED) 方式存入 zip，
+  其它成员保持原来的压缩方式
+- 非图片成员 (文档、目录等) 原样写入输出压缩包；压缩失败的图片也原样保留
+输出先写入同目录下的临时文件，全部完成后原子替换；中途出错或取消时删除临时文件。
+"""
+import os
+import time
+import tarfile
+import zipfile
+from io import BytesIO
+from contextlib import ExitStack
+
+from pipeline import atomic_output
+
+# tar 的压缩方式: 扩展名 -> tarfile 模式后缀
+TAR_COMPRESSIONS = {
+    '.tar': '',
+    '.tar.gz': 'gz', '.tgz': 'gz',
+    '.tar.bz2': 'bz2', '.tbz2': 'bz2',
+    '.tar.xz': 'xz', '.txz': 'xz',
+}
+
+# 支持的压缩包扩展名
+ARCHIVE_EXTENSIONS = ('.zip',) + tuple(TAR_COMPRESSIONS)
+
+# zip 能表示的最早修改时间 (1980-01-02，留出时区余量)
+ZIP_MIN_MTIME = 315619200
+
+
+def archive_extension(path):
+    """压缩包的扩展名 (如 '.tar.gz')，不是支持的压缩包时返回 None"""
+    lower = path.lower()
+    for ext in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True):
+        if lower.endswith(ext):
+            return ext
+    return None
+
+
+def is_archive(path):
+    return archive_extension(path) is not None
+
+
+def archive_output_path(path, output_dir=None, overwrite=False):
+    """
+    输出压缩包路径: 源压缩包旁 (或 output_dir 中) 的 <名称>_compressed<扩展名>
+    :param overwrite: 覆盖源压缩包
+    """
+    if overwrite and output_dir is None:
+        return path
+    ext_len = len(archive_extension(path))
+    directory, filename = os.path.split(path)
+    name, ext = filename[:-ext_len], filename[-ext_len:]
+    if not overwrite:
+        name += '_compressed'
+    return os.path.join(output_dir if output_dir is not None else directory, name + ext)
+
+
+class ArchiveMember:
+    """
+    压缩包中的一个成员
+    - kind: 'file' 普通文件 (data 为内容)、'dir' 目录、'other' 其它 tar 成员 (链接、设备等，只能写入 tar)
+    - mtime / mode: 修改时间 (秒) 与权限位 (None 表示未知)
+    - compress_type: zip 成员原来的压缩方式 (tar 成员为 None)
+    """
+
+    def __init__(self, name, kind='file', data=None, mtime=None, mode=None, compress_type=None, info=None):
+        self.name = name
+        self.kind = kind
+        self.data = data
+        self.mtime = mtime if mtime is not None else time.time()
+        self.mode = mode
+        self.compress_type = compress_type
+        self.info = info
+
+
+def _read_zip(path):
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            mtime = time.mktime(info.date_time + (0, 0, -1))
+            mode = (info.external_attr >> 16) & 0o7777 or None
+            if info.is_dir():
+                yield ArchiveMember(info.filename, 'dir', mtime=mtime, mode=mode)
+            else:
+                yield ArchiveMember(info.filename, data=zf.read(info), mtime=mtime, mode=mode,
+                                    compress_type=info.compress_type)
+
+
+def _read_tar(path):
+    # 流模式: 按顺序解压，不需要随机访问 (.tar.gz 不必先解压一遍建立索引)
+    with tarfile.open(path, 'r|*') as tf:
+        for info in tf:
+            if info.isreg():
+                yield ArchiveMember(info.name, data=tf.extractfile(info).read(), mtime=info.mtime, mode=info.mode)
+            elif info.isdir():
+                yield ArchiveMember(info.name, 'dir', mtime=info.mtime, mode=info.mode)
+            else:
+                yield ArchiveMember(info.name, 'other', mtime=info.mtime, mode=info.mode, info=info)
+
+
+def read_archive(path):
+    """按顺序逐个产出压缩包的成员 (ArchiveMember)，成员内容在产出时才读入内存"""
+    if archive_extension(path) == '.zip':
+        return _read_zip(path)
+    return _read_tar(path)
+
+
+class ArchiveWriter:
+    """
+    输出压缩包 (格式由扩展名决定，只在调用方线程中写入)
+    with ArchiveWriter(path) as writer: 正常结束时原子替换为 path，出错时删除临时文件
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.ext = archive_extension(path)
+        if self.ext is None:
+            raise ValueError(f"Unsupported archive: {path}")
+        self.written = 0    # 已写入的成员数
+        self.skipped = 0    # 无法写入的成员数 (zip 不支持的链接等)
+        self._stack = ExitStack()
+        self._archive = None
+
+    def __enter__(self):
+        tmp_path = self._stack.enter_context(atomic_output(self.path))
+        if self.ext == '.zip':
+            self._archive = zipfile.ZipFile(tmp_path, 'w')
+        else:
+            self._archive = tarfile.open(tmp_path, 'w:' + TAR_COMPRESSIONS[self.ext])
+        return self
+
+    def __exit__(self, *exc_info):
+        # 先关闭压缩包 (写入 zip 目录 / tar 结尾)，再替换或删除临时文件
+        self._archive.close()
+        return self._stack.__exit__(*exc_info)
+
+    def add(self, member, name=None, data=None, compressed=False):
+        """
+        写入一个成员
+        :param member: 源成员 (ArchiveMember)，提供修改时间、权限等
+        :param name: 成员名，None 表示与源成员相同
+        :param data: 内容 (bytes-like)，None 表示源成员的内容
+        :param compressed: 内容本身已是压缩格式 (压缩后的图片)，zip 中不再压缩
+        """
+        name = member.name if name is None else name
+        data = member.data if data is None else data
+        if self.ext == '.zip':
+            self._add_zip(member, name, data, compressed)
+        else:
+            self._add_tar(member, name, data)
+
+    def _add_zip(self, member, name, data, compressed):
+        if member.kind == 'other':
+            self.skipped += 1
+            return
+        # zip 不能表示 1980 年以前的时间
+        info = zipfile.ZipInfo(name.rstrip('/') + '/' if member.kind == 'dir' else name,
+                               time.localtime(max(member.mtime, ZIP_MIN_MTIME))[:6])
+        if member.mode is not None:
+            info.external_attr = member.mode << 16
+        if member.kind == 'dir':
+            info.external_attr |= 0x10
+            self._archive.writestr(info, b'')
+        else:
+            if compressed:
+                info.compress_type = zipfile.ZIP_STORED
+            elif member.compress_type is not None:
+                info.compress_type = member.compress_type
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            self._archive.writestr(info, data)
+        self.written += 1
+
+    def _add_tar(self, member, name, data):
+        if member.kind == 'other':
+            self._archive.addfile(member.info)
+            self.written += 1
+            return
+        info = tarfile.TarInfo(name)
+        info.mtime = int(member.mtime)
+        if member.mode is not None:
+            info.mode = member.mode
+        if member.kind == 'dir':
+            info.type = tarfile.DIRTYPE
+            if member.mode is None:
+                info.mode = 0o755
+            self._archive.addfile(info)
+        else:
+            info.size = len(data)
+            self._archive.addfile(info, BytesIO(data))
+        self.written += 1
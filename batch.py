@@ -0,0 +1,818 @@
+import os
+import time
+import shutil
+import tempfile
+from io import BytesIO
+from collections import deque
+from compressor import ImageCompressor, DEFAULT_EFFORT
+from search import QualityPrior
+from pipeline import PipelineStats, read_source, write_atomic, DEFAULT_IO_WORKERS
+from dedup import DedupStats, PixelIndex, link_output, file_digest, data_digest
+from renditions import applies as renditions_apply, primary_output
+from formats import output_extension
+
+# 输出子目录名 (不覆盖源文件时使用)
+OUTPUT_DIR_NAME = "_compressed"
+
+# 每个工作进程/线程内复用的压缩器实例
+_worker_compressor = None
+
+
+def resolve_output_path(file_path, params, output_dir=None):
+    """
+    根据参数确定输出文件路径 (GUI 与库共用的命名规则)
+    :param file_path: 源文件路径
+    :param params: 压缩参数字典 (使用 to_webp / overwrite)
+    :param output_dir: 统一输出目录；None 表示源文件夹下的 _compressed (覆盖模式下为源文件夹)
+    :return: 输出文件路径
+    """
+    src_dir, filename = os.path.split(file_path)
+    name, ext = os.path.splitext(filename)
+    out_ext = output_extension(ext, params)
+
+    if output_dir is None:
+        if params.get('overwrite', False):
+            output_dir = src_dir
+        else:
+            output_dir = os.path.join(src_dir, OUTPUT_DIR_NAME)
+
+    return os.path.join(output_dir, f"{name}{out_ext}")
+
+
+def _init_worker(search_workers=1):
+    global _worker_compressor
+    _worker_compressor = ImageCompressor(search_workers=search_workers)
+
+
+def _get_compressor():
+    if _worker_compressor is None:
+        _init_worker()
+    return _worker_compressor
+
+
+def _new_result(index, file_path, output_path):
+    return {
+        'index': index,
+        'file': file_path,
+        'output': output_path,
+        'name': os.path.basename(file_path),
+        'success': False,
+        'message': '',
+        'size_kb': 0,
+        'cached': False,
+        'resumed': False,
+        'duplicate': None,
+        'elapsed_ms': 0,
+        'metrics': None,
+    }
+
+
+def _cache_output(cache, data_path, output_path, params, message, digest):
+    """覆盖模式: 输出会成为下次运行的源文件，把输出内容本身也登记为结果，下次直接跳过"""
+    cache.put(cache.make_key(digest, output_path, params), data_path, message, digest)
+
+
+def _compress(file_path, output_path, params, source=None, sink=None):
+    """按参数字典调用 compress_image，返回 CompressionResult"""
+    return _get_compressor().compress_image(
+        file_path, output_path,
+        target_size_kb=params.get('target_size_kb'),
+        max_width=params.get('max_width'),
+        to_webp=params.get('to_webp', False),
+        quality=params.get('quality', 95),
+        fixed_quality=params.get('fixed_quality', False),
+        resample=params.get('resample', 'exact'),
+        tiled=params.get('tiled'),
+        smart_search=params.get('smart_search', 'exact'),
+        quality_hints=params.get('quality_hints'),
+        target_ssim=params.get('target_ssim'),
+        pixel_index=params.get('pixel_index'),
+        effort=params.get('effort', DEFAULT_EFFORT),
+        renditions=params.get('renditions'),
+        source=source,
+        sink=sink,
+        detailed=True
+    )
+
+
+def read_job(file_path, digest=False):
+    """
+    读取阶段: 预读文件内容，并按需计算内容哈希 (用于去重)
+    :return: (文件内容或 None, 内容哈希或 None)
+    """
+    data = read_source(file_path)
+    if not digest:
+        return data, None
+    if data is not None:
+        return data, data_digest(data)
+    try:
+        return None, file_digest(file_path)
+    except OSError:
+        return None, None # 读取失败，由压缩阶段报告错误
+
+
+def duplicate_job(index, file_path, output_path, leader, link='copy'):
+    """
+    重复文件: 复制 leader (内容相同、已完成的文件的结果字典) 的输出，不再压缩
+    :param link: 复制方式 (见 dedup.link_output)
+    """
+    start = time.perf_counter()
+    result = _new_result(index, file_path, output_path)
+    if not leader['success']:
+        result['message'] = f"Duplicate of {leader['name']}: {leader['message']}"
+        return result
+    try:
+        out_dir = os.path.dirname(output_path)
+        if out_dir and not os.path.exists(out_dir):
+            os.makedirs(out_dir, exist_ok=True)
+        method = link_output(leader['output'], output_path, link)
+        result.update(success=True, message=f"Duplicate of {leader['name']}", size_kb=leader['size_kb'],
+                      duplicate={'of': leader['file'], 'link': method, 'pixels': False})
+    except Exception as e:
+        result['message'] = f"Duplicate Error: {e}"
+    result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def compress_job(index, file_path, output_path, params, cache=None, source=None, deferred=False):
+    """
+    执行单个文件的压缩任务。所有异常都在这里被捕获，保证单个文件出错不影响整批任务。
+    :param cache: ResultCache，命中时直接复用缓存结果，不解码图片
+    :param source: 预读的文件内容 (bytes)，None 表示按路径读取
+    :param deferred: True 时不写出文件，编码结果放在 result['pending'] 中，由 finish_job 写出 (写出阶段)
+    :return: 结果字典 (index, file, output, name, success, message, size_kb, cached, resumed, duplicate, elapsed_ms, metrics)
+             metrics 为 CompressionResult.to_dict() (各阶段耗时、质量/颜色数、尝试次数等)，缓存命中时为 None；
+             duplicate 为重复文件的去重信息 {'of': 内容相同的文件, 'link': 复制方式, 'pixels': 是否按像素判断}
+    """
+    if params.get('renditions') and renditions_apply(file_path):
+        return renditions_job(index, file_path, output_path, params, source)
+
+    start = time.perf_counter()
+    result = _new_result(index, file_path, output_path)
+
+    try:
+        out_dir = os.path.dirname(output_path)
+        if out_dir and not os.path.exists(out_dir):
+            os.makedirs(out_dir, exist_ok=True)
+
+        # 覆盖源文件时先写入临时文件，成功后再替换，防止文件占用/写坏原图
+        is_same_file = (os.path.normpath(file_path) == os.path.normpath(output_path))
+        target_path = output_path + ".tmp" if is_same_file and not deferred else output_path
+
+        cache_key = None
+        if cache is not None:
+            if source is not None:
+                source_digest, source_size = data_digest(source), len(source)
+            else:
+                source_digest, source_size = file_digest(file_path), os.path.getsize(file_path)
+            cache_key = cache.make_key(source_digest, output_path, params)
+            hit = cache.get(cache_key, source_size)
+            if hit:
+                blob_path, size, digest, msg = hit
+                # 覆盖模式下源文件就是上次的输出，无需任何写入
+                if not (is_same_file and digest == source_digest):
+                    shutil.copyfile(blob_path, target_path)
+                    if is_same_file:
+                        os.replace(target_path, output_path)
+                        _cache_output(cache, output_path, output_path, params, msg, digest)
+                result.update(success=True, message=f"Cached: {msg}", size_kb=size / 1024, cached=True)
+                result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+                return result
+
+        sink = BytesIO() if deferred else None
+        detail = _compress(file_path, target_path, params, source, sink)
+        ok, msg, size = detail.as_tuple()
+        result['metrics'] = detail.to_dict()
+
+        if detail.duplicate_of:
+            # 像素与已完成的图片相同: 直接复制其输出 (覆盖模式下源文件此时已关闭)
+            method = link_output(detail.duplicate_of['output'], output_path, params.get('dedup_link', 'copy'))
+            result.update(success=True, message=msg, size_kb=os.path.getsize(output_path) / 1024,
+                          duplicate={'of': detail.duplicate_of['file'], 'link': method, 'pixels': True})
+            result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+            return result
+
+        if deferred:
+            result.update(success=ok, message=msg, size_kb=size)
+            if ok:
+                result['pending'] = {'buffer': sink, 'cache_key': cache_key, 'same_file': is_same_file}
+            result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+            return result
+
+        if ok and cache_key:
+            # 缓存写入失败不影响本次压缩结果
+            try:
+                output_digest = file_digest(target_path)
+                cache.put(cache_key, target_path, msg, output_digest)
+                if is_same_file:
+                    _cache_output(cache, target_path, output_path, params, msg, output_digest)
+            except Exception as e:
+                print(f"Cache Error: {e}")
+
+        if is_same_file:
+            if ok:
+                try:
+                    os.replace(target_path, output_path)
+                except Exception as e:
+                    ok = False
+                    msg = f"Error replacing: {e}"
+            if not ok and os.path.exists(target_path):
+                os.remove(target_path)
+
+        result.update(success=ok, message=msg, size_kb=size)
+    except Exception as e:
+        result['message'] = str(e)
+
+    result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def renditions_job(index, file_path, output_path, params, source=None):
+    """
+    多尺寸输出的压缩任务 (见 renditions.py): 各尺寸的输出由压缩器直接原子写出，不使用缓存与后台写出
+    :param output_path: 普通输出路径，各尺寸的路径由它派生
+    :return: 结果字典，output 为最大尺寸的输出 (代表整组)，各尺寸的结果在 metrics['renditions'] 中
+    """
+    start = time.perf_counter()
+    result = _new_result(index, file_path, primary_output(output_path, params['renditions']))
+    try:
+        detail = _compress(file_path, output_path, params, source)
+        ok, msg, size = detail.as_tuple()
+        result.update(success=ok, message=msg, size_kb=size, metrics=detail.to_dict())
+        if detail.renditions:
+            # 原图较窄时最大的输出以原图宽度命名
+            result['output'] = detail.renditions[0]['output']
+    except Exception as e:
+        result['message'] = str(e)
+    result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def compress_member(index, name, output_name, data, params):
+    """
+    压缩包成员的压缩任务: 内容在内存中，结果 (BytesIO) 放在 result['data'] 中，由调用方写入输出压缩包
+    :param name: 成员名 (决定输入格式)
+    :param output_name: 输出成员名 (决定输出格式)
+    """
+    start = time.perf_counter()
+    result = _new_result(index, name, output_name)
+    try:
+        sink = BytesIO()
+        detail = _compress(name, output_name, params, data, sink)
+        ok, msg, size = detail.as_tuple()
+        result.update(success=ok, message=msg, size_kb=size, metrics=detail.to_dict())
+        if ok:
+            result['data'] = sink
+    except Exception as e:
+        result['message'] = str(e)
+    result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def finish_job(result, params, cache=None):
+    """
+    写出阶段: 把 compress_job(deferred=True) 的编码结果原子写出，并登记缓存
+    写出失败时结果标记为失败。耗时计入 elapsed_ms 与 metrics 的 write 阶段
+    """
+    pending = result.pop('pending', None)
+    if not pending:
+        return result
+
+    start = time.perf_counter()
+    output_path = result['output']
+    buffer = pending['buffer']
+    try:
+        # 覆盖模式下源文件此时已读完并关闭，直接原子替换
+        write_atomic(output_path, buffer)
+    except Exception as e:
+        result.update(success=False, message=f"Write Error: {e}", size_kb=0)
+    else:
+        cache_key = pending['cache_key']
+        if cache_key:
+            # 缓存写入失败不影响本次压缩结果
+            try:
+                with buffer.getbuffer() as view:
+                    output_digest = data_digest(view)
+                cache.put(cache_key, output_path, result['message'], output_digest)
+                if pending['same_file']:
+                    _cache_output(cache, output_path, output_path, params, result['message'], output_digest)
+            except Exception as e:
+                print(f"Cache Error: {e}")
+
+    elapsed = time.perf_counter() - start
+    result['elapsed_ms'] += elapsed * 1000
+    if result['metrics']:
+        timings = result['metrics']['timings_ms']
+        timings['write'] = round(timings.get('write', 0) + elapsed * 1000, 3)
+    return result
+
+
+class BatchEngine:
+    """
+    并行批量压缩引擎 (GUI 与 process_queue 共用)
+    - 默认使用进程池，可切换为线程池 (Pillow 编码时会释放 GIL)
+    - 结果按完成顺序逐个产出，便于实时更新进度
+    - 并行时按内存预算提交任务，大图优先 (见 scheduler.MemoryScheduler)
+    - 流水线: I/O 线程预读后续文件、写出已完成的结果，与压缩同时进行 (见 pipeline.py)，
+      各阶段排队数量见 stats
+    - 质量先验 (warm start): 智能模式 / 画质模式下记录本批已完成图片的质量 (search.QualityPrior)，
+      提交新任务时附带当前的预测质量，相似图片的质量搜索从预测值附近开始
+    - 断点续传: 提供任务日志 (journal.BatchJournal) 时记录每个文件的状态，日志中已完成的文件直接跳过
+    - 去重: 内容相同 (可选像素相同) 的文件只压缩一次，其余复制其输出 (见 dedup.py)，节省的工作量见 dedup_stats
+    - 压缩包: run_archive 直接读写 zip / tar 中的图片，不解压到磁盘 (见 archive.py)
+    - 多尺寸输出: params['renditions'] 指定时每个文件解码一次，输出多个宽度 / 格式 (见 renditions.py)
+    """
+
+    def __init__(self, max_workers=None, use_threads=False, cache=None, metrics_hook=None,
+                 memory_budget_mb=None, pipeline=True, readahead=None, io_workers=DEFAULT_IO_WORKERS,
+                 warm_start=True, dedup=None, dedup_link='copy'):
+        """
+        :param max_workers: 并行数，None 表示使用全部 CPU 核心
+        :param use_threads: True 使用线程池，False 使用进程池
+        :param cache: ResultCache，None 表示不使用缓存
+        :param metrics_hook: 回调 (result)，每个文件完成后在调用方进程中执行，可用于上报监控指标
+        :param memory_budget_mb: 同时处理的文件估算内存总量上限 (MB)，None 表示物理内存的一半，0 表示不限制
+        :param pipeline: 是否使用预读 / 后台写出流水线
+        :param readahead: 除正在压缩的文件外，最多预读 (或等待写出) 的文件数，None 表示与并行数相同
+        :param io_workers: 读取与写出共用的 I/O 线程数
+        :param warm_start: 智能模式 / 画质模式下是否用本批已完成图片的质量预测后续图片的搜索起点 (不影响最终结果)
+        :param dedup: 去重方式。None 不去重；'bytes' 内容相同的文件只压缩一次；'pixels' 另外在解码后按像素判断
+        :param dedup_link: 重复文件输出的复制方式 'copy' / 'hardlink' / 'reflink' (不支持时退回普通复制)
+        """
+        self.max_workers = max(1, max_workers or os.cpu_count() or 1)
+        self.use_threads = use_threads
+        self.cache = cache
+        self.metrics_hook = metrics_hook
+        self.pipeline = pipeline
+        self.readahead = self.max_workers if readahead is None else max(0, readahead)
+        self.io_workers = max(1, io_workers)
+        self.warm_start = warm_start
+        self.dedup = dedup
+        self.dedup_link = dedup_link
+        self.stats = PipelineStats()
+        self.dedup_stats = DedupStats()
+        self.archive_stats = {}
+        if memory_budget_mb is None:
+            from scheduler import default_memory_budget
+            self.memory_budget = default_memory_budget()
+        else:
+            self.memory_budget = memory_budget_mb * 1024 * 1024 or None
+        # 并行数小于核心数时，剩余核心留给单个文件内的候选并发编码
+        self.search_workers = max(1, (os.cpu_count() or 1) // self.max_workers)
+
+    def _report(self, result):
+        # 指标上报失败不影响批处理
+        if self.metrics_hook:
+            try:
+                self.metrics_hook(result)
+            except Exception as e:
+                print(f"Metrics Hook Error: {e}")
+
+    def _create_executor(self):
+        # 只有一个工作者时不必启动子进程
+        if self.use_threads or self.max_workers == 1:
+            from concurrent.futures import ThreadPoolExecutor
+            return ThreadPoolExecutor(max_workers=self.max_workers)
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                       initargs=(self.search_workers,))
+        # fork 方式下工作进程在第一次提交时才一次性创建。若此时 I/O 线程正在导入模块 (如估算 PDF 内存时导入 PyMuPDF)，
+        # 子进程会继承被占用的模块锁而卡死，因此在启动 I/O 线程之前先创建工作进程
+        executor.submit(int).result()
+        return executor
+
+    def _new_prior(self, params):
+        """本批任务的质量先验 (只在智能模式 / 画质模式下使用)"""
+        if self.warm_start and (params.get('target_size_kb') or params.get('target_ssim')) \
+                and not params.get('fixed_quality'):
+            return QualityPrior()
+        return None
+
+    def run(self, file_list, params, output_dir=None, progress_callback=None, journal=None):
+        """
+        批量处理，逐个产出结果 (生成器)
+        :param file_list: 文件路径列表或任意可迭代对象
+        :param params: 压缩参数字典
+        :param output_dir: 统一输出目录，None 表示按 resolve_output_path 的默认规则
+        :param progress_callback: 回调 (done, total, filename)，total 未知时为 None
+        :param journal: BatchJournal，None 表示不记录。日志中已完成的文件不再压缩，产出 resumed=True 的结果
+        多尺寸输出 (params['renditions']) 时不去重，每个文件的结果 output 为最大尺寸的输出
+        """
+        self.dedup_stats = DedupStats()
+        # 像素索引只在本批任务内有效，结束后删除
+        dedup = None if params.get('renditions') else self.dedup
+        index_dir = tempfile.mkdtemp(prefix='image_compressor_dedup_') if dedup == 'pixels' else None
+        try:
+            yield from self._run(file_list, params, output_dir, progress_callback, journal, dedup,
+                                 PixelIndex(index_dir) if index_dir else None)
+        finally:
+            if index_dir:
+                shutil.rmtree(index_dir, ignore_errors=True)
+
+    def _run(self, file_list, params, output_dir, progress_callback, journal, dedup, pixel_index):
+        total = len(file_list) if hasattr(file_list, '__len__') else None
+        renditions = params.get('renditions')
+        # 不需要压缩的文件 (日志中已完成的文件、重复文件): 结果在主循环中产出
+        resumed = deque()
+
+        def pending_jobs():
+            for i, file_path in enumerate(file_list):
+                output_path = resolve_output_path(file_path, params, output_dir)
+                if journal is not None:
+                    # 多尺寸输出以最大尺寸的输出代表整组 (与结果中的 output 一致)
+                    logged_output = output_path
+                    expected_output = output_path
+                    if renditions and renditions_apply(file_path):
+                        # 实际的最大输出取决于原图宽度 (见 renditions.primary_output)，按日志中记录的输出核对
+                        logged_output = primary_output(output_path, renditions)
+                        expected_output = None
+                    entry = journal.completed(file_path, expected_output)
+                    if entry:
+                        result = _new_result(i, file_path, entry['output'])
+                        result.update(success=True, message=f"Resumed: {entry['message']}",
+                                      size_kb=entry['size'] / 1024, resumed=True)
+                        resumed.append(result)
+                        continue
+                    journal.begin(file_path, logged_output)
+                yield i, file_path, output_path
+
+        jobs = pending_jobs()
+        done = 0
+        # 当前进程内执行 (单并发 / 线程池) 时使用的压缩器
+        _init_worker(self.search_workers)
+        self.stats = PipelineStats()
+
+        prior = self._new_prior(params)
+
+        def job_params():
+            """提交任务时的参数: 附带当前的质量预测与像素索引"""
+            extra = {}
+            if prior is not None:
+                extra['quality_hints'] = prior.hints()
+            if pixel_index is not None:
+                extra.update(pixel_index=pixel_index, dedup_link=self.dedup_link)
+            return dict(params, **extra) if extra else params
+
+        # 去重: (内容哈希, 输出扩展名) -> leader 状态 {'result', 'waiting'}
+        leaders = {}
+        leader_keys = {}    # 压缩中的 leader: 源文件路径 -> 去重键
+        leader_sizes = {}   # leader 的源文件大小: 源文件路径 -> 字节数
+        leader_ms = {}      # 已完成的文件的压缩耗时: 源文件路径 -> ms
+
+        def deduplicate(job, data, digest):
+            """
+            按内容去重: 返回 True 表示是重复文件 (不需要提交压缩)
+            leader 还在压缩时排队等待，已完成时立即复制其输出
+            """
+            if not dedup:
+                return False
+            i, file_path, output_path = job
+            try:
+                if digest is None:
+                    digest = file_digest(file_path)
+                size = len(data) if data is not None else os.path.getsize(file_path)
+            except OSError:
+                return False # 读取失败，由压缩阶段报告错误
+            key = (digest, os.path.splitext(output_path)[1])
+            state = leaders.get(key)
+            if state is None:
+                leaders[key] = {'result': None, 'waiting': []}
+                leader_keys[file_path] = key
+                leader_sizes[file_path] = size
+                return False
+            if state['result'] is None:
+                state['waiting'].append(job)
+            else:
+                resumed.append(duplicate_job(i, file_path, output_path, state['result'], self.dedup_link))
+            return True
+
+        def complete(result):
+            nonlocal done
+            metrics = result.get('metrics')
+            if prior is not None and result['success'] and metrics:
+                # 多尺寸输出: 每个尺寸各自属于一个分组
+                for observed in [metrics] + metrics.get('renditions', []):
+                    if observed['success'] and observed.get('prior_key'):
+                        prior.observe(observed['prior_key'], observed['quality'])
+            if dedup:
+                key = leader_keys.pop(result['file'], None)
+                if key is not None:
+                    # leader 已写出: 等待中的重复文件复制其输出
+                    state = leaders[key]
+                    state['result'] = result
+                    for i, file_path, output_path in state.pop('waiting'):
+                        resumed.append(duplicate_job(i, file_path, output_path, result, self.dedup_link))
+                duplicate = result['duplicate']
+                if duplicate and result['success']:
+                    source_bytes = 0 if duplicate['pixels'] else leader_sizes.get(duplicate['of'], 0)
+                    self.dedup_stats.add(result, source_bytes, leader_ms.get(duplicate['of'], 0))
+                elif result['success'] and not (result['cached'] or result['resumed']):
+                    leader_ms[result['file']] = result['elapsed_ms']
+                    if pixel_index is not None and metrics and metrics.get('pixel_key'):
+                        try:
+                            pixel_index.publish(metrics['pixel_key'], result['file'], result['output'])
+                        except OSError as e:
+                            print(f"Dedup Error: {e}")
+            if journal is not None and not result['resumed']:
+                journal.record(result)
+            self._report(result)
+            done += 1
+            if progress_callback:
+                progress_callback(done, total, result['name'])
+            return result
+
+        def drain():
+            """产出已跳过的文件与重复文件的结果"""
+            while resumed:
+                yield complete(resumed.popleft())
+
+        # 单并发且不需要流水线 (如只有一个文件) 时直接在当前线程执行，省去线程池开销
+        if self.max_workers == 1 and (not self.pipeline or total == 1):
+            for job in jobs:
+                yield from drain()
+                if not deduplicate(job, None, None):
+                    yield complete(compress_job(*job, job_params(), self.cache))
+            yield from drain()
+            return
+
+        # 延迟导入: 单文件/单并发调用 (如命令行) 无需加载 concurrent.futures 及 multiprocessing
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        if self.memory_budget:
+            from scheduler import MemoryScheduler, estimate_memory
+
+            def estimate(job):
+                return estimate_memory(job[1], job[2], params, self.search_workers)
+
+            # 已提交的任务都计入内存，不再预先排队 (排队的任务不占内存，但会占用预算)
+            scheduler = MemoryScheduler(self.memory_budget, max_skips=self.max_workers * 2)
+            max_pending = self.max_workers
+        else:
+            scheduler = None
+            # 限制同时提交的任务数，避免超大队列一次性占满内存
+            max_pending = self.max_workers * 2
+
+        # 同时在流水线中的文件数 (预读 + 等待 + 压缩 + 写出)
+        max_in_flight = max_pending + (self.readahead if self.pipeline else 0)
+
+        def take():
+            """取出下一个任务: (任务, 估算内存)；没有任务或内存预算已满时返回 None"""
+            nonlocal exhausted
+            if scheduler:
+                # 流水线模式下估算在 I/O 线程中进行 (见 1.)，否则在当前线程逐个估算
+                entry = scheduler.next_job() if io_pool else scheduler.fill(jobs, estimate)
+                exhausted = scheduler.exhausted
+                return entry
+            job = next(jobs, None)
+            if job is None:
+                exhausted = True
+                return None
+            return job, 0
+
+        executor = self._create_executor()
+        io_pool = ThreadPoolExecutor(max_workers=self.io_workers) if self.pipeline else None
+        estimating = {}     # 估算内存中: future -> 任务
+        jobs_done = False   # 任务迭代器已取完
+        reading = {}        # 预读中: future -> (任务, 估算内存)
+        ready = deque()     # 已读入，等待工作进程: ((任务, 估算内存), 文件内容, 内容哈希)
+        encoding = {}       # 压缩中: future -> (任务, 估算内存)
+        writing = {}        # 写出中: future -> 任务
+        exhausted = False
+        try:
+            while True:
+                # 1. 按内存预算调度时，先在 I/O 线程中读取文件头估算内存，估算完的任务排队等待提交
+                #    (同时估算的任务数不超过 I/O 线程数，不阻塞预读)
+                if scheduler and io_pool:
+                    while not jobs_done and len(estimating) < self.io_workers \
+                            and len(estimating) + scheduler.queued < scheduler.lookahead:
+                        job = next(jobs, None)
+                        if job is None:
+                            jobs_done = True
+                        else:
+                            estimating[io_pool.submit(estimate, job)] = job
+                    if jobs_done and not estimating:
+                        scheduler.close()
+
+                # 取新任务，流水线模式下先交给 I/O 线程预读
+                while not exhausted and len(reading) + len(ready) + len(encoding) + len(writing) < max_in_flight:
+                    entry = take()
+                    if entry is None:
+                        break # 没有更多任务，或内存预算已满
+                    if io_pool:
+                        reading[io_pool.submit(read_job, entry[0][1], bool(dedup))] = entry
+                    else:
+                        ready.append((entry, None, None))
+
+                # 2. 已读入的文件提交给工作进程
+                while ready and len(encoding) < max_pending:
+                    (job, cost), data, digest = ready.popleft()
+                    if deduplicate(job, data, digest):
+                        if scheduler:
+                            scheduler.release(cost)
+                        continue
+                    future = executor.submit(compress_job, job[0], job[1], job[2], job_params(), self.cache,
+                                             data, self.pipeline)
+                    encoding[future] = (job, cost)
+
+                for stage, queue in (('read', reading), ('ready', ready), ('encode', encoding), ('write', writing)):
+                    self.stats.set(stage, len(queue))
+
+                yield from drain()
+                if not (estimating or reading or encoding or writing):
+                    if exhausted or not scheduler or not io_pool:
+                        break
+                    continue # 任务迭代器刚取完 (或估算刚完成)，回到 1. 提交
+
+                finished, _ = wait(list(estimating) + list(reading) + list(encoding) + list(writing),
+                                   return_when=FIRST_COMPLETED)
+                for future in finished:
+                    if future in estimating:
+                        scheduler.add(estimating.pop(future), future.result())
+                    elif future in reading:
+                        data, digest = future.result()
+                        if data is not None:
+                            self.stats.add_prefetched(len(data))
+                        ready.append((reading.pop(future), data, digest))
+                    elif future in encoding:
+                        (i, file_path, output_path), cost = encoding.pop(future)
+                        if scheduler:
+                            scheduler.release(cost)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            # 进程崩溃等异常 (如 BrokenProcessPool)，记录为该文件失败
+                            result = _new_result(i, file_path, output_path)
+                            result['message'] = f"Worker Error: {e}"
+                        if result.get('pending'):
+                            # 3. 编码结果交给 I/O 线程写出
+                            writing[io_pool.submit(finish_job, result, params, self.cache)] = result
+                        else:
+                            yield complete(result)
+                    else:
+                        writing.pop(future)
+                        yield complete(future.result())
+        finally:
+            for future in list(estimating) + list(reading) + list(encoding):
+                future.cancel()
+            executor.shutdown(wait=True)
+            if io_pool:
+                # 已编码完成的结果仍会写出
+                io_pool.shutdown(wait=True)
+
+    def run_archive(self, archive_path, output_path, params, progress_callback=None):
+        """
+        压缩 zip / tar 压缩包中的图片，结果直接写入输出压缩包 (不解压到磁盘，见 archive.py)，逐个产出图片的结果 (生成器)
+        - 成员按顺序读出，同时在内存中的成员不超过 2 倍并行数，并按内存预算提交
+        - 输出压缩包中的成员保持原顺序 (先完成的成员暂存到前面的成员写出为止)
+        - 非图片成员原样写入输出压缩包；压缩失败的图片保留原内容，结果标记为失败
+        - 写入的成员数见 archive_stats
+        :param archive_path: 输入压缩包
+        :param output_path: 输出压缩包 (格式由扩展名决定，可与输入不同，也可以就是输入压缩包)
+        :param params: 压缩参数字典
+        :param progress_callback: 回调 (done, None, 成员名)
+        """
+        from archive import read_archive, ArchiveWriter
+        from discovery import SUPPORTED_EXTENSIONS
+        from concurrent.futures import FIRST_COMPLETED, wait
+
+        if params.get('renditions'):
+            raise ValueError("Renditions are not supported for archives")
+
+        _init_worker(self.search_workers)
+        self.archive_stats = {'members': 0, 'images': 0, 'passed_through': 0, 'skipped': 0}
+        prior = self._new_prior(params)
+        done = 0
+        max_pending = self.max_workers * 2
+
+        out_dir = os.path.dirname(output_path)
+        if out_dir and not os.path.exists(out_dir):
+            os.makedirs(out_dir, exist_ok=True)
+
+        with ArchiveWriter(output_path) as writer:
+            def pending_jobs():
+                """按顺序产出全部成员: (序号, 成员, 输出成员名)，非图片成员的输出成员名为 None (原样写入)"""
+                for seq, member in enumerate(read_archive(archive_path)):
+                    self.archive_stats['members'] += 1
+                    stem, ext = os.path.splitext(member.name)
+                    if member.kind == 'file' and ext.lower() in SUPPORTED_EXTENSIONS:
+                        self.archive_stats['images'] += 1
+                        yield seq, member, stem + output_extension(ext, params)
+                    else:
+                        self.archive_stats['passed_through'] += 1
+                        yield seq, member, None
+
+            jobs = pending_jobs()
+            if self.memory_budget:
+                from scheduler import MemoryScheduler, estimate_memory
+
+                def estimate(job):
+                    _, member, output_name = job
+                    size = len(member.data or b'')
+                    if output_name is None:
+                        return size
+                    return size + estimate_memory(member.name, output_name, params, self.search_workers,
+                                                  source=member.data)
+
+                # 预读窗口也限制为 max_pending: 排队中的成员内容同样占用内存
+                scheduler = MemoryScheduler(self.memory_budget, lookahead=max_pending, max_skips=max_pending)
+            else:
+                scheduler = None
+
+            def take():
+                if scheduler:
+                    return scheduler.fill(jobs, estimate)
+                job = next(jobs, None)
+                return None if job is None else (job, 0)
+
+            # 成员按原顺序写出: 先完成的成员暂存，等前面的成员都写出后再写 (序号 -> (成员, 输出成员名, 内容))
+            finished_members = {}
+            next_write = 0
+
+            def flush():
+                nonlocal next_write
+                while next_write in finished_members:
+                    member, output_name, buffer = finished_members.pop(next_write)
+                    if buffer is not None:
+                        with buffer.getbuffer() as view:
+                            writer.add(member, output_name, view, compressed=True)
+                    else:
+                        writer.add(member)
+                    next_write += 1
+
+            executor = self._create_executor()
+            encoding = {}   # 压缩中: future -> (序号, 图片序号, 成员, 输出成员名, 估算内存)
+            index = 0
+            try:
+                while True:
+                    # 暂存的成员同样占用内存，计入上限；没有压缩中的成员时总是提交 (最前面的成员可能还在排队)
+                    while not encoding or len(encoding) + len(finished_members) < max_pending:
+                        entry = take()
+                        if entry is None:
+                            break
+                        (seq, member, output_name), cost = entry
+                        if output_name is None:
+                            # 非图片成员原样写入
+                            if scheduler:
+                                scheduler.release(cost)
+                            finished_members[seq] = (member, None, None)
+                            flush()
+                            continue
+                        job_params = params if prior is None else dict(params, quality_hints=prior.hints())
+                        future = executor.submit(compress_member, index, member.name, output_name, member.data,
+                                                 job_params)
+                        encoding[future] = (seq, index, member, output_name, cost)
+                        index += 1
+                    if not encoding:
+                        break
+
+                    finished, _ = wait(list(encoding), return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        seq, i, member, output_name, cost = encoding.pop(future)
+                        if scheduler:
+                            scheduler.release(cost)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            result = _new_result(i, member.name, output_name)
+                            result['message'] = f"Worker Error: {e}"
+
+                        buffer = result.pop('data', None)
+                        if buffer is None:
+                            # 压缩失败: 保留原内容
+                            result['output'] = member.name
+                        finished_members[seq] = (member, output_name, buffer)
+                        flush()
+
+                        metrics = result.get('metrics')
+                        if prior is not None and result['success'] and metrics and metrics.get('prior_key'):
+                            prior.observe(metrics['prior_key'], metrics['quality'])
+                        self._report(result)
+                        done += 1
+                        if progress_callback:
+                            progress_callback(done, None, result['name'])
+                        yield result
+            finally:
+                for future in encoding:
+                    future.cancel()
+                executor.shutdown(wait=True)
+            self.archive_stats['skipped'] = writer.skipped
+
+
+def process_queue(file_list, output_dir, params, progress_callback=None, max_workers=None, use_threads=False,
+                  cache=None):
+    """
+    批量处理队列 (并行执行，结果按输入顺序返回)
+    :param max_workers: 并行数，None 表示使用全部 CPU 核心
+    :param use_threads: True 使用线程池，False 使用进程池
+    :param cache: ResultCache，源文件与参数都未变化时直接复用上次结果
+    :return: [(filename, success, msg, size_kb), ...]
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    engine = BatchEngine(max_workers=max_workers, use_threads=use_threads, cache=cache)
+    results = [None] * len(file_list)
+    for r in engine.run(file_list, params, output_dir=output_dir, progress_callback=progress_callback):
+        results[r['index']] = (r['name'], r['success'], r['message'], r['size_kb'])
+
+    return results
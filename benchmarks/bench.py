@@ -0,0 +1,236 @@
+"""
+压缩器热点路径基准测试
+
+对合成图片集运行 compress_image 的每个分支 (固定质量、智能 JPEG/WebP、智能 PNG 减色、GIF、PDF)，
+报告吞吐量 (张/秒、百万像素/秒)、峰值内存 (RSS) 和编码次数，结果可保存为 JSON 用于跨版本对比。
+每个用例在独立的子进程中运行，峰值内存互不影响。
+每个用例按每种编码强度 (--efforts) 各运行一次，表格中 time / bytes 为耗时与输出大小相对 balanced 的比例。
+balanced 的结果键为用例名 (与旧结果兼容)，其它强度为 "用例名@强度"。
+
+用法:
+    python -m benchmarks.bench --json bench_result.json
+    python -m benchmarks.bench --scale 0.25 --repeat 1 --cases smart_jpeg smart_png
+    python -m benchmarks.bench --compare old_result.json
+    python -m benchmarks.bench --efforts balanced      # 只测默认强度
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import statistics
+import tempfile
+import multiprocessing
+
+from benchmarks.corpus import generate
+from compressor import EFFORT_PRESETS, DEFAULT_EFFORT
+
+# 用例: 输入类别、输出扩展名、compress_image 参数
+CASES = {
+    'fixed_quality': {'kinds': ('photo',), 'ext': '.jpg', 'kwargs': {'fixed_quality': True, 'quality': 80}},
+    'smart_jpeg': {'kinds': ('photo', 'cmyk'), 'ext': '.jpg', 'kwargs': {'target_size_kb': 150}},
+    # 同上，按批处理的方式用已完成图片的质量预测后续图片的搜索起点 (BatchEngine 的 warm start)
+    'smart_jpeg_warm': {'kinds': ('photo', 'cmyk'), 'ext': '.jpg', 'kwargs': {'target_size_kb': 150},
+                        'warm_start': True},
+    'smart_webp': {'kinds': ('photo',), 'ext': '.webp', 'kwargs': {'target_size_kb': 150, 'to_webp': True}},
+    'smart_png': {'kinds': ('graphic', 'transparent', 'palette'), 'ext': '.png', 'kwargs': {'target_size_kb': 100}},
+    # 目标较小: 无损与 256 色都超出目标，走颜色数搜索
+    'smart_png_miss': {'kinds': ('graphic', 'transparent', 'palette'), 'ext': '.png', 'kwargs': {'target_size_kb': 30}},
+    'gif': {'kinds': ('animated',), 'ext': '.gif', 'kwargs': {'max_width': 320}},
+    # 指定目标大小与 DPI 上限，重新压缩内嵌图片 (只传路径时仅做无损整理)。compress_image 不接受 max_dpi，直接调用 compress_pdf
+    'pdf': {'kinds': ('pdf',), 'ext': '.pdf', 'kwargs': {'target_size_kb': 400, 'max_dpi': 100},
+            'method': 'compress_pdf'},
+}
+
+
+def _peak_rss_mb():
+    # Linux: VmHWM 只统计当前进程映像 (ru_maxrss 会继承 fork 前父进程的峰值)
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None # Windows 无 resource 模块
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def _megapixels(path):
+    """输入像素数 (GIF 按全部帧计算，PDF 不统计)"""
+    from PIL import Image
+
+    if path.lower().endswith('.pdf'):
+        return 0.0
+    with Image.open(path) as img:
+        frames = getattr(img, 'n_frames', 1)
+        return img.width * img.height * frames / 1e6
+
+
+def _result_key(name, effort):
+    return name if effort == DEFAULT_EFFORT else f"{name}@{effort}"
+
+
+def _run_case(name, files, out_dir, repeat, scale=1.0, effort=DEFAULT_EFFORT):
+    """在子进程中执行单个用例"""
+    from PIL import Image
+    from compressor import ImageCompressor
+    from search import QualityPrior
+
+    # 统计编码次数: 所有编码最终都经过 Image.save
+    counter = [0]
+    original_save = Image.Image.save
+
+    def counting_save(self, *args, **kwargs):
+        counter[0] += 1
+        return original_save(self, *args, **kwargs)
+
+    Image.Image.save = counting_save
+
+    case = CASES[name]
+    kwargs = dict(case['kwargs'], effort=effort)
+    if kwargs.get('target_size_kb'):
+        # 目标大小随图片面积缩放，保证小尺寸图片集也会走到搜索分支
+        kwargs['target_size_kb'] = max(5, int(kwargs['target_size_kb'] * scale * scale))
+
+    compressor = ImageCompressor()
+    compress = getattr(compressor, case.get('method', 'compress_image'))
+    megapixels = sum(_megapixels(f) for f in files)
+    pass_times = []
+    output_bytes = 0
+    failures = 0
+
+    for _ in range(repeat):
+        counter[0] = 0
+        output_bytes = 0
+        failures = 0
+        prior = QualityPrior() if case.get('warm_start') else None
+        start = time.perf_counter()
+        for i, path in enumerate(files):
+            out_path = os.path.join(out_dir, f"{name}_{effort}_{i:03d}{case['ext']}")
+            if prior is None:
+                ok, msg, size_kb = compress(path, out_path, **kwargs)
+            else:
+                detail = compressor.compress_image(path, out_path, quality_hints=prior.hints(),
+                                                   detailed=True, **kwargs)
+                ok = detail.success
+                if ok and detail.prior_key:
+                    prior.observe(detail.prior_key, detail.quality)
+            if ok:
+                output_bytes += os.path.getsize(out_path)
+            else:
+                failures += 1
+        pass_times.append(time.perf_counter() - start)
+
+    seconds = statistics.median(pass_times)
+    return {
+        'files': len(files),
+        'seconds': round(seconds, 4),
+        'images_per_s': round(len(files) / seconds, 3) if seconds else None,
+        'mp_per_s': round(megapixels / seconds, 3) if seconds and megapixels else None,
+        'peak_rss_mb': _peak_rss_mb(),
+        'encodes': counter[0],
+        'encodes_per_image': round(counter[0] / len(files), 2) if files else None,
+        'output_bytes': output_bytes,
+        'failures': failures,
+        'effort': effort,
+    }
+
+
+def run(cases, corpus, out_dir, repeat, scale=1.0, efforts=(DEFAULT_EFFORT,)):
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    for name in cases:
+        files = [f for kind in CASES[name]['kinds'] for f in corpus.get(kind, [])]
+        for effort in efforts:
+            with ctx.Pool(1) as pool:
+                results[_result_key(name, effort)] = pool.apply(_run_case, (name, files, out_dir, repeat, scale, effort))
+    return results
+
+
+def environment():
+    from PIL import __version__ as pillow_version
+
+    return {
+        'python': platform.python_version(),
+        'pillow': pillow_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def print_table(results, baseline=None):
+    header = (f"{'case':24s} {'img/s':>8s} {'MP/s':>8s} {'RSS MB':>8s} {'enc/img':>8s} {'out KB':>9s}"
+              f" {'time':>6s} {'bytes':>6s}")
+    if baseline:
+        header += f" {'speed':>7s}"
+    print(header)
+    for name, r in results.items():
+        line = (f"{name:24s} {r['images_per_s'] or 0:8.2f} {r['mp_per_s'] or 0:8.2f} "
+                f"{r['peak_rss_mb'] or 0:8.1f} {r['encodes_per_image'] or 0:8.2f} {r['output_bytes'] / 1024:9.1f}")
+        # 与同一用例 balanced 强度的耗时 / 输出大小之比
+        ref = results.get(name.split('@')[0])
+        if ref and ref['seconds'] and ref['output_bytes']:
+            line += f" {r['seconds'] / ref['seconds']:6.2f} {r['output_bytes'] / ref['output_bytes']:6.3f}"
+        else:
+            line += f" {'-':>6s} {'-':>6s}"
+        old = (baseline or {}).get(name)
+        if old and old.get('seconds') and r['seconds']:
+            line += f" {old['seconds'] / r['seconds']:6.2f}x"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="压缩器基准测试")
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=list(CASES))
+    parser.add_argument('--corpus', default=None, help="图片集目录 (默认生成到临时目录)")
+    parser.add_argument('--scale', type=float, default=1.0, help="图片集尺寸系数")
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--repeat', type=int, default=3, help="每个用例重复次数 (取中位数)")
+    parser.add_argument('--json', default=None, help="结果保存路径")
+    parser.add_argument('--compare', default=None, help="与之前保存的 JSON 结果对比")
+    parser.add_argument('--efforts', nargs='+', choices=list(EFFORT_PRESETS), default=list(EFFORT_PRESETS),
+                        help="要测试的编码强度 (默认全部)")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='imgbench_')
+    try:
+        corpus_dir = args.corpus or os.path.join(work_dir, 'corpus')
+        corpus = generate(corpus_dir, seed=args.seed, scale=args.scale)
+        out_dir = os.path.join(work_dir, 'out')
+        os.makedirs(out_dir)
+
+        results = run(args.cases, corpus, out_dir, args.repeat, args.scale, args.efforts)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'environment': environment(),
+        'settings': {'scale': args.scale, 'seed': args.seed, 'repeat': args.repeat, 'efforts': args.efforts},
+        'results': results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results')
+
+    print_table(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+可复现的合成测试图片集 (只依赖 Pillow)
+
+同一个 seed 总是生成完全相同的文件，便于在不同版本 / 不同 Pillow 之间对比性能。
+包含: 照片类、纯色图形、透明 PNG、P 模式 PNG、CMYK JPEG、GIF 动画、多页 PDF。
+
+用法:
+    python -m benchmarks.corpus bench_corpus/ --scale 1.0
+"""
+import os
+import random
+import argparse
+
+from PIL import Image, ImageDraw, ImageFilter
+
+# 各类别的文件数与基准尺寸 (scale=1.0 时)
+CORPUS_SPEC = {
+    'photo': {'count': 4, 'size': (3000, 2000)},
+    'graphic': {'count': 3, 'size': (1600, 1200)},
+    'transparent': {'count': 3, 'size': (1200, 1200)},
+    'palette': {'count': 3, 'size': (1200, 900)},
+    'cmyk': {'count': 2, 'size': (2400, 1600)},
+    'animated': {'count': 2, 'size': (480, 360), 'frames': 24},
+    'pdf': {'count': 2, 'size': (1654, 2339), 'pages': 4},
+}
+
+
+def _noise(rng, size, blur):
+    """确定性的平滑噪声纹理 (L 模式)"""
+    w, h = size
+    # 先生成小尺寸随机数据再放大，既快又能得到自然的纹理
+    sw, sh = max(1, w // 4), max(1, h // 4)
+    data = rng.getrandbits(8 * sw * sh).to_bytes(sw * sh, 'little')
+    small = Image.frombytes('L', (sw, sh), data)
+    return small.resize(size, Image.Resampling.BICUBIC).filter(ImageFilter.GaussianBlur(blur))
+
+
+def make_photo(rng, size):
+    """照片类: 渐变背景 + 噪声纹理 + 随机色块，细节丰富"""
+    w, h = size
+    base = Image.merge('RGB', (
+        Image.linear_gradient('L').resize(size),
+        Image.linear_gradient('L').rotate(90).resize(size),
+        Image.radial_gradient('L').resize(size),
+    ))
+    texture = _noise(rng, size, 1.5)
+    img = Image.blend(base, Image.merge('RGB', (texture, texture, texture)), 0.35)
+
+    draw = ImageDraw.Draw(img)
+    for _ in range(60):
+        x0, y0 = rng.randrange(w), rng.randrange(h)
+        x1, y1 = x0 + rng.randrange(20, w // 5), y0 + rng.randrange(20, h // 5)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse([x0, y0, x1, y1], fill=color)
+    return img.filter(ImageFilter.GaussianBlur(1.2))
+
+
+def make_graphic(rng, size):
+    """纯色图形: 大面积平涂色块和细线条 (类似截图 / 图表)"""
+    w, h = size
+    img = Image.new('RGB', size, (250, 250, 250))
+    draw = ImageDraw.Draw(img)
+    palette = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(12)]
+    for _ in range(80):
+        x0, y0 = rng.randrange(w), rng.randrange(h)
+        x1, y1 = x0 + rng.randrange(10, w // 3), y0 + rng.randrange(10, h // 6)
+        draw.rectangle([x0, y0, x1, y1], fill=rng.choice(palette))
+    for _ in range(200):
+        x0, y0 = rng.randrange(w), rng.randrange(h)
+        draw.line([x0, y0, x0 + rng.randrange(-200, 200), y0 + rng.randrange(-200, 200)],
+                  fill=rng.choice(palette), width=2)
+    return img
+
+
+def make_transparent(rng, size):
+    """带半透明边缘的 RGBA 图 (类似抠图 / 图标)"""
+    img = make_photo(rng, size).convert('RGBA')
+    mask = Image.new('L', size, 0)
+    draw = ImageDraw.Draw(mask)
+    w, h = size
+    for _ in range(8):
+        x0, y0 = rng.randrange(w), rng.randrange(h)
+        draw.ellipse([x0, y0, x0 + rng.randrange(100, w // 2), y0 + rng.randrange(100, h // 2)], fill=255)
+    img.putalpha(mask.filter(ImageFilter.GaussianBlur(6)))
+    return img
+
+
+def make_palette(rng, size):
+    """P 模式 (带透明色) PNG"""
+    img = make_graphic(rng, size).quantize(colors=64)
+    img.info['transparency'] = 0
+    return img
+
+
+def make_animation(rng, size, frames):
+    """GIF 动画: 移动的色块 (位置、速度、大小、颜色与形状随机)，带透明背景"""
+    w, h = size
+    shapes = []
+    for _ in range(rng.randrange(4, 9)):
+        shapes.append({
+            'x': rng.randrange(w), 'y': rng.randrange(h),
+            'dx': rng.randrange(-12, 13), 'dy': rng.randrange(-8, 9),
+            'r': rng.randrange(12, max(13, min(w, h) // 6)),
+            'fill': tuple(rng.randrange(256) for _ in range(3)) + (255,),
+            'ellipse': rng.random() < 0.6,
+        })
+
+    result = []
+    for i in range(frames):
+        frame = Image.new('RGBA', size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(frame)
+        for shape in shapes:
+            cx = (shape['x'] + i * shape['dx']) % w
+            cy = (shape['y'] + i * shape['dy']) % h
+            r = shape['r']
+            box = [cx - r, cy - r, cx + r, cy + r]
+            if shape['ellipse']:
+                draw.ellipse(box, fill=shape['fill'])
+            else:
+                draw.rectangle(box, fill=shape['fill'])
+        result.append(frame)
+    return result
+
+
+def generate(out_dir, seed=2024, scale=1.0):
+    """
+    生成测试图片集
+    :param out_dir: 输出目录
+    :param seed: 随机种子
+    :param scale: 尺寸缩放系数 (0.25 可快速冒烟测试)
+    :return: {类别: [文件路径, ...]}
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    corpus = {}
+
+    def scaled(size):
+        return (max(16, int(size[0] * scale)), max(16, int(size[1] * scale)))
+
+    for kind, spec in CORPUS_SPEC.items():
+        rng = random.Random(f"{seed}-{kind}")
+        size = scaled(spec['size'])
+        paths = []
+        for i in range(spec['count']):
+            if kind == 'photo':
+                path = os.path.join(out_dir, f"photo_{i:02d}.jpg")
+                make_photo(rng, size).save(path, quality=95)
+            elif kind == 'graphic':
+                path = os.path.join(out_dir, f"graphic_{i:02d}.png")
+                make_graphic(rng, size).save(path)
+            elif kind == 'transparent':
+                path = os.path.join(out_dir, f"transparent_{i:02d}.png")
+                make_transparent(rng, size).save(path)
+            elif kind == 'palette':
+                path = os.path.join(out_dir, f"palette_{i:02d}.png")
+                make_palette(rng, size).save(path)
+            elif kind == 'cmyk':
+                path = os.path.join(out_dir, f"cmyk_{i:02d}.jpg")
+                make_photo(rng, size).convert('CMYK').save(path, quality=95)
+            elif kind == 'animated':
+                path = os.path.join(out_dir, f"animated_{i:02d}.gif")
+                frames = make_animation(rng, size, spec['frames'])
+                frames[0].save(path, save_all=True, append_images=frames[1:], duration=40, loop=0, disposal=2)
+            else:
+                path = os.path.join(out_dir, f"document_{i:02d}.pdf")
+                pages = [make_photo(rng, size) for _ in range(spec['pages'])]
+                pages[0].save(path, save_all=True, append_images=pages[1:], resolution=200, quality=95)
+            paths.append(path)
+        corpus[kind] = paths
+
+    return corpus
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="生成基准测试用的合成图片集")
+    parser.add_argument('out_dir')
+    parser.add_argument('--seed', type=int, default=2024)
+    parser.add_argument('--scale', type=float, default=1.0)
+    args = parser.parse_args()
+
+    for kind, paths in generate(args.out_dir, args.seed, args.scale).items():
+        print(f"{kind:12s} {len(paths)} files")
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+from contextlib import contextmanager
+
+from pipeline import atomic_output
+# 内容哈希定义在 dedup 中 (批处理只用哈希时不必导入 sqlite3)
+from dedup import file_digest, data_digest
+
+# 默认缓存目录与容量
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.image_compressor', 'cache')
+DEFAULT_CACHE_SIZE_MB = 512
+
+# 参与缓存键计算的压缩参数 (任一不同都视为不同结果)
+CACHE_PARAM_KEYS = ('target_size_kb', 'quality', 'max_width', 'to_webp', 'fixed_quality', 'resample',
+                    'smart_search', 'target_ssim', 'effort')
+
+
+class ResultCache:
+    """
+    基于内容哈希的持久化结果缓存
+    - 键: 源文件内容哈希 + 输出格式 + 全部压缩参数
+    - 值: 压缩后的输出文件 (存放在 objects/ 下)，索引保存在 SQLite 中，多进程可同时访问
+    - 超过容量上限时按最近使用时间 (LRU) 淘汰
+    对象本身只保存路径和配置，可以直接传给进程池中的工作进程。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.db_path = os.path.join(cache_dir, 'index.db')
+        self.objects_dir = os.path.join(cache_dir, 'objects')
+
+    @contextmanager
+    def _connect(self):
+        """打开索引数据库 (退出时提交并关闭)"""
+        os.makedirs(self.objects_dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS entries ("
+                    "key TEXT PRIMARY KEY, size INTEGER, digest TEXT, message TEXT, last_used REAL)"
+                )
+                conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON entries (last_used)")
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, conn, name, value=1):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, value)
+        )
+
+    def _blob_path(self, key):
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def make_key(self, source_digest, output_path, params):
+        """根据源文件哈希、输出格式和压缩参数生成缓存键"""
+        out_ext = os.path.splitext(output_path)[1].lower()
+        relevant = {k: params.get(k) for k in CACHE_PARAM_KEYS}
+        raw = f"{source_digest}|{out_ext}|{json.dumps(relevant, sort_keys=True)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key, source_size=0):
+        """
+        查询缓存
+        :param source_size: 源文件大小 (字节)，命中时计入节省的字节数
+        :return: 命中时返回 (blob_path, size, digest, message)，否则 None
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT size, digest, message FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            blob_path = self._blob_path(key)
+            if row and os.path.exists(blob_path):
+                conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+                self._count(conn, 'hits')
+                self._count(conn, 'bytes_saved', source_size)
+                return blob_path, row[0], row[1], row[2]
+
+            if row:
+                # 索引存在但文件已丢失
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count(conn, 'misses')
+            return None
+
+    def put(self, key, output_path, message, digest=None):
+        """
+        将压缩结果存入缓存
+        :param output_path: 已生成的输出文件
+        :param digest: 输出文件内容哈希 (None 时自动计算)
+        """
+        blob_path = self._blob_path(key)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+
+        # 先复制到临时文件再原子替换，防止并发读取到半个文件 (临时文件名含线程号，同一进程的多个线程可同时写入)
+        with atomic_output(blob_path) as tmp_path:
+            shutil.copyfile(output_path, tmp_path)
+
+        size = os.path.getsize(blob_path)
+        if digest is None:
+            digest = file_digest(blob_path)
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, digest, message, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, size, digest, message, time.time())
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """超过容量上限时，按最近使用时间从旧到新淘汰"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            try:
+                os.remove(self._blob_path(key))
+            except OSError:
+                pass
+            total -= size
+            self._count(conn, 'evictions')
+
+    def stats(self):
+        """
+        缓存统计 (累计值)
+        :return: dict(hits, misses, bytes_saved, evictions, entries, size_bytes)
+                 bytes_saved 为命中时跳过处理的源文件字节数
+        """
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+        return {
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'bytes_saved': counters.get('bytes_saved', 0),
+            'evictions': counters.get('evictions', 0),
+            'entries': entries,
+            'size_bytes': size,
+        }
@@ -0,0 +1,367 @@
+"""
+命令行入口 (无界面，适合服务器 / 任务调度器批量调用)
+
+用法示例:
+    python -m cli photos/ --target-kb 150 --max-width 1080
+    python -m cli a.jpg b.png --fixed --quality 80 --webp --output-dir out/
+    python -m cli photos/ --target-ssim 0.98          (画质模式: SSIM 达到目标的最小输出)
+    python -m cli photos/ --renditions 1920 1280 800:80 400:30 --rendition-formats jpg webp   (响应式图片集)
+    python -m cli uploads/ --watch --target-kb 300     (常驻监视，只处理新增 / 修改的文件)
+
+每处理完一个文件，向标准输出写一行 JSON (NDJSON)；结束后向标准错误写一行汇总。
+启动时只加载 Pillow，不导入 tkinter；PyMuPDF 仅在遇到 PDF 时才加载。
+"""
+import time
+
+_START = time.perf_counter()
+
+import os
+import sys
+import json
+import argparse
+from itertools import chain
+
+from discovery import FileDiscovery, SUPPORTED_EXTENSIONS
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description="图片批量压缩 (命令行版)")
+    parser.add_argument('paths', nargs='+', help="图片文件或文件夹")
+
+    mode = parser.add_argument_group("压缩参数")
+    mode.add_argument('--target-kb', type=int, default=150, help="智能模式目标大小 KB (默认 150)")
+    mode.add_argument('--fixed', action='store_true', help="使用固定质量模式")
+    mode.add_argument('--target-ssim', type=float, default=None,
+                      help="画质模式: 输出与缩放后原图的 SSIM 不低于该值 (0~1，如 0.98)，指定后忽略 --target-kb")
+    mode.add_argument('--quality', type=int, default=None, help="固定质量模式的质量 / 智能模式与画质模式的最高质量")
+    mode.add_argument('--max-width', type=int, default=None, help="最大宽度 px")
+    mode.add_argument('--fast-resize', action='store_true', help="大图快速缩放 (JPEG draft 解码 + reduce)")
+    mode.add_argument('--fast-smart', action='store_true',
+                      help="智能模式快速搜索: 大图先在抽样代理图片上预测质量，再用少量整图编码确认")
+    mode.add_argument('--webp', action='store_true', help="转换为 WebP")
+    mode.add_argument('--effort', choices=('fast', 'balanced', 'max'), default='balanced',
+                      help="编码强度: fast 最快、balanced 默认、max 体积最小 (最终编码耗时约为 fast 的 3~6 倍)")
+
+    out = parser.add_argument_group("输出")
+    out.add_argument('--output-dir', default=None, help="统一输出目录 (默认: 源文件夹下的 _compressed)")
+    out.add_argument('--overwrite', action='store_true', help="覆盖源文件")
+    out.add_argument('--renditions', nargs='+', default=None, metavar='WIDTH[:KB]',
+                     help="多尺寸输出: 每个源文件解码一次，输出多个宽度 (如 1920 1280 800:80 400:30，"
+                          "KB 为该宽度的目标大小，默认 --target-kb)，文件名为 <名称>-<宽度>w.<扩展名>，忽略 --max-width")
+    out.add_argument('--rendition-formats', nargs='+', choices=('jpg', 'webp', 'png'), default=None,
+                     help="多尺寸输出的格式，每个宽度各输出一份 (默认与普通输出相同)")
+    out.add_argument('--dedup', choices=('off', 'bytes', 'pixels'), default='bytes',
+                     help="重复文件只压缩一次: bytes 按文件内容 (默认)，pixels 另外按解码后的像素，off 不去重")
+    out.add_argument('--dedup-link', choices=('copy', 'hardlink', 'reflink'), default='copy',
+                     help="重复文件输出的复制方式 (默认 copy；hardlink / reflink 不支持时退回复制)")
+
+    run = parser.add_argument_group("执行")
+    run.add_argument('--workers', type=int, default=None, help="并行数 (默认: CPU 核心数)")
+    run.add_argument('--threads', action='store_true', help="使用线程池代替进程池")
+    run.add_argument('--memory-mb', type=int, default=None,
+                     help="同时处理的文件估算内存上限 MB (默认: 物理内存的一半，0 表示不限制)")
+    run.add_argument('--readahead', type=int, default=None, help="预读的文件数 (默认与并行数相同)")
+    run.add_argument('--io-workers', type=int, default=4, help="读取 / 写出线程数 (默认 4)")
+    run.add_argument('--no-warm-start', action='store_true',
+                     help="智能模式不使用同一批图片的质量预测 (用于对比编码次数)")
+    run.add_argument('--no-pipeline', action='store_true', help="不预读、不在后台写出 (逐个文件读取-压缩-写出)")
+    run.add_argument('--cache', nargs='?', const='', default=None, metavar='DIR',
+                     help="启用结果缓存，可指定缓存目录")
+    run.add_argument('--cache-size-mb', type=int, default=None, help="缓存容量上限 MB")
+    run.add_argument('--resume', action='store_true',
+                     help="记录任务日志 (按输入路径与参数自动生成路径)，中断后加 --resume 重新运行同一命令会跳过已完成的文件")
+    run.add_argument('--journal', default=None, metavar='FILE', help="同 --resume，使用指定的任务日志路径")
+    # 旧版本默认记录任务日志，保留 --no-journal 以兼容已有脚本
+    run.add_argument('--no-journal', action='store_true', help=argparse.SUPPRESS)
+
+    watch = parser.add_argument_group("监视模式")
+    watch.add_argument('--watch', action='store_true', help="常驻监视文件夹，只处理新增或修改的文件 (Ctrl+C 退出)")
+    watch.add_argument('--settle', type=float, default=None, help="文件保持不变多少秒后才处理 (默认 2)")
+    watch.add_argument('--poll', action='store_true', help="使用轮询扫描代替 inotify (网络共享盘)")
+    watch.add_argument('--poll-interval', type=float, default=None, help="轮询间隔秒数 (默认 5)")
+    watch.add_argument('--state', default=None, metavar='FILE', help="已处理文件的状态索引路径")
+    return parser
+
+
+def collect_files(paths):
+    """展开文件夹并过滤支持的格式 (按路径去重，保持顺序)"""
+    return list(FileDiscovery(paths))
+
+
+def build_params(args):
+    if args.fixed:
+        quality = args.quality if args.quality is not None else 85
+    else:
+        quality = args.quality if args.quality is not None else 95
+
+    perceptual = args.target_ssim is not None and not args.fixed
+    renditions = None
+    if args.renditions:
+        from renditions import parse_renditions
+        renditions = parse_renditions(args.renditions, args.rendition_formats,
+                                      None if args.fixed or perceptual else args.target_kb)
+    return {
+        'target_size_kb': None if args.fixed or perceptual else args.target_kb,
+        'target_ssim': args.target_ssim if perceptual else None,
+        'quality': quality,
+        'fixed_quality': args.fixed,
+        'max_width': args.max_width,
+        'resample': 'fast' if args.fast_resize else 'exact',
+        'smart_search': 'fast' if args.fast_smart else 'exact',
+        'to_webp': args.webp,
+        'overwrite': args.overwrite,
+        'effort': args.effort,
+        'renditions': renditions,
+    }
+
+
+def dedup_mode(args):
+    return None if args.dedup == 'off' else args.dedup
+
+
+def to_record(result):
+    """批处理结果 -> NDJSON 记录"""
+    if not result['success']:
+        status = 'error'
+    elif result['cached']:
+        status = 'cached'
+    elif result['resumed']:
+        status = 'resumed'
+    elif result['duplicate']:
+        status = 'duplicate'
+    else:
+        status = 'ok'
+
+    # 各阶段耗时 (open/decode/resize/convert/flatten/encode/write...)，缓存命中时只有总耗时
+    metrics = result.get('metrics') or {}
+    timings = {f"{stage}_ms": ms for stage, ms in metrics.get('timings_ms', {}).items() if stage != 'total'}
+    timings['total_ms'] = round(result['elapsed_ms'], 2)
+
+    return {
+        'name': result['name'],
+        'file': result['file'],
+        'output': result['output'],
+        'status': status,
+        'message': result['message'],
+        'size_kb': round(result['size_kb'], 2),
+        'quality': metrics.get('quality'),
+        'predicted_quality': metrics.get('predicted_quality'),
+        'quality_hint': metrics.get('quality_hint'),
+        'colors': metrics.get('colors'),
+        'ssim': metrics.get('ssim'),
+        'effort': metrics.get('effort'),
+        'attempts': metrics.get('attempts'),
+        'duplicate_of': result['duplicate']['of'] if result['duplicate'] else None,
+        'archive': result.get('archive'),
+        'renditions': [{
+            'width': r['width'],
+            'format': r['format'],
+            'output': r['output'],
+            'success': r['success'],
+            'size_kb': round(r['size_kb'], 2),
+            'quality': r['quality'],
+            'colors': r['colors'],
+            'ssim': r['ssim'],
+            'message': r['message'],
+        } for r in metrics.get('renditions', [])] or None,
+        'timings': timings,
+    }
+
+
+def archive_results(engine, archives, params, args, summaries):
+    """依次压缩各个压缩包中的图片，逐个产出结果；每个压缩包完成后把成员统计追加到 summaries"""
+    from archive import archive_output_path
+    from batch import _new_result
+
+    for path in archives:
+        output_path = archive_output_path(path, args.output_dir, args.overwrite)
+        try:
+            for result in engine.run_archive(path, output_path, params):
+                result['archive'] = path
+                yield result
+        except Exception as e:
+            # 压缩包损坏等: 记为该压缩包失败 (不生成输出)，继续处理其它输入
+            result = _new_result(None, path, output_path)
+            result['message'] = f"Archive Error: {e}"
+            yield result
+            summaries.append({'path': path, 'output': None, 'images': 0, 'error': str(e)})
+        else:
+            summaries.append(dict(engine.archive_stats, path=path, output=output_path))
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.target_ssim is not None and not 0 < args.target_ssim < 1:
+        parser.error("--target-ssim must be between 0 and 1")
+
+    from batch import BatchEngine
+    startup_ms = (time.perf_counter() - _START) * 1000
+
+    try:
+        params = build_params(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if params['renditions'] and args.watch and args.overwrite and not args.output_dir:
+        # 输出写在监视的文件夹中，会被当作新文件再次处理
+        parser.error("--renditions with --watch requires --output-dir when using --overwrite")
+    if args.watch:
+        return watch_main(args, params)
+
+    # 直接指定的压缩包 (zip / tar) 不解压，结果写入输出压缩包
+    from archive import is_archive
+    archives = [p for p in args.paths if os.path.isfile(p) and is_archive(p)]
+    paths = [p for p in args.paths if p not in archives]
+    if archives and params['renditions']:
+        parser.error("--renditions cannot be used with archives")
+
+    # 边扫描边压缩: 文件夹中的文件一找到就交给工作进程
+    discovery = FileDiscovery(paths)
+    files = discovery
+
+    cache = None
+    if args.cache is not None:
+        from cache import ResultCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE_MB
+        cache = ResultCache(args.cache or DEFAULT_CACHE_DIR, args.cache_size_mb or DEFAULT_CACHE_SIZE_MB)
+
+    # 文件少于核心数时不必启动多余的进程
+    workers = args.workers or os.cpu_count() or 1
+    if not archives and all(os.path.isfile(p) for p in paths):
+        files = list(discovery)
+        workers = min(workers, max(1, len(files)))
+    engine = BatchEngine(max_workers=workers, use_threads=args.threads, cache=cache,
+                         memory_budget_mb=args.memory_mb, pipeline=not args.no_pipeline,
+                         readahead=args.readahead, io_workers=args.io_workers,
+                         warm_start=not args.no_warm_start, dedup=dedup_mode(args), dedup_link=args.dedup_link)
+
+    # 任务日志每个文件都要写入 (并定期 fsync)，并发运行同一命令时还会共用日志文件，因此只在明确要求时记录
+    journal = None
+    if paths and (args.resume or args.journal) and not args.no_journal:
+        from journal import BatchJournal, default_journal_path
+        journal = BatchJournal(args.journal or default_journal_path(args.paths, params, args.output_dir),
+                               params, args.output_dir)
+
+    run_start = time.perf_counter()
+    ok_count = 0
+    failed = 0
+    resumed = 0
+    # 快速智能模式的预测准确度: 预测次数、命中次数、预测与最终质量之差的总和
+    predicted = hits = error = 0
+    # 智能模式 (JPEG / WebP) 的编码次数: {'hinted' / 'cold': [图片数, 编码次数]}
+    searches = {'hinted': [0, 0], 'cold': [0, 0]}
+
+    archive_summaries = []
+    results = engine.run(files, params, output_dir=args.output_dir, journal=journal) if paths else iter(())
+    if archives:
+        results = chain(archive_results(engine, archives, params, args, archive_summaries), results)
+
+    for result in results:
+        if result['success']:
+            ok_count += 1
+        else:
+            failed += 1
+        resumed += result['resumed']
+        metrics = result.get('metrics') or {}
+        if metrics.get('predicted_quality') is not None and metrics.get('quality') is not None:
+            predicted += 1
+            hits += metrics['predicted_quality'] == metrics['quality']
+            error += abs(metrics['predicted_quality'] - metrics['quality'])
+        # 多尺寸输出时每个尺寸各算一次搜索
+        for searched in [metrics] + metrics.get('renditions', []):
+            if searched.get('prior_key'):
+                entry = searches['cold' if searched.get('quality_hint') is None else 'hinted']
+                entry[0] += 1
+                entry[1] += searched['attempts']
+        sys.stdout.write(json.dumps(to_record(result), ensure_ascii=False) + '\n')
+        sys.stdout.flush()
+
+    summary = {
+        'type': 'summary',
+        'files': discovery.discovered + sum(a['images'] for a in archive_summaries),
+        'ok': ok_count,
+        'failed': failed,
+        'startup_ms': round(startup_ms, 2),
+        'elapsed_ms': round((time.perf_counter() - run_start) * 1000, 2),
+    }
+    if engine.pipeline and paths:
+        # 各阶段的最大排队数量，用于调整 --workers / --readahead / --io-workers
+        summary['pipeline'] = engine.stats.snapshot()
+    if predicted:
+        summary['prediction'] = {
+            'files': predicted,
+            'exact_hits': hits,
+            'mean_abs_error': round(error / predicted, 2),
+        }
+    images = searches['hinted'][0] + searches['cold'][0]
+    if images:
+        # 有质量预测 (warm start) 与没有预测的图片各自的平均编码次数
+        summary['search'] = {
+            'images': images,
+            'avg_encodes': round((searches['hinted'][1] + searches['cold'][1]) / images, 2),
+            'warm_start': engine.warm_start,
+        }
+        for name, (count, encodes) in searches.items():
+            summary['search'][f'{name}_images'] = count
+            summary['search'][f'avg_encodes_{name}'] = round(encodes / count, 2) if count else None
+    if archives:
+        summary['archives'] = archive_summaries
+    if engine.dedup and paths:
+        # 重复文件数、省去的源文件读取与压缩耗时、硬链接 / reflink 节省的磁盘空间
+        summary['dedup'] = engine.dedup_stats.snapshot()
+    if cache:
+        summary['cache'] = cache.stats()
+    if journal:
+        # 全部成功时日志被删除，有失败时保留 (再次运行只重试失败的文件)
+        journal.close(finished=True)
+        summary['journal'] = {'path': journal.path, 'resumed': resumed, 'kept': os.path.exists(journal.path)}
+    sys.stderr.write(json.dumps(summary) + '\n')
+
+    return 1 if failed else 0
+
+
+def watch_main(args, params):
+    """监视模式: 常驻运行，每处理完一个文件写一行 NDJSON，退出时写汇总"""
+    from batch import BatchEngine
+    from watch import FolderWatcher, DEFAULT_SETTLE_SECONDS, DEFAULT_POLL_SECONDS
+
+    roots = [p for p in args.paths if os.path.isdir(p)]
+    if not roots:
+        sys.stderr.write("--watch requires at least one folder\n")
+        return 2
+
+    cache = None
+    if args.cache is not None:
+        from cache import ResultCache, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE_MB
+        cache = ResultCache(args.cache or DEFAULT_CACHE_DIR, args.cache_size_mb or DEFAULT_CACHE_SIZE_MB)
+
+    engine = BatchEngine(max_workers=args.workers, use_threads=args.threads, cache=cache,
+                         memory_budget_mb=args.memory_mb, pipeline=not args.no_pipeline,
+                         readahead=args.readahead, io_workers=args.io_workers,
+                         dedup=dedup_mode(args), dedup_link=args.dedup_link)
+    watcher = FolderWatcher(
+        roots, params, engine, SUPPORTED_EXTENSIONS, output_dir=args.output_dir, state_path=args.state,
+        settle_seconds=DEFAULT_SETTLE_SECONDS if args.settle is None else args.settle,
+        poll_seconds=args.poll_interval or DEFAULT_POLL_SECONDS,
+        use_inotify=False if args.poll else None,
+    )
+
+    ok_count = 0
+    failed = 0
+    try:
+        for result in watcher.run():
+            if result['success']:
+                ok_count += 1
+            else:
+                failed += 1
+            sys.stdout.write(json.dumps(to_record(result), ensure_ascii=False) + '\n')
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+
+    summary = {'type': 'summary', 'ok': ok_count, 'failed': failed, 'state': watcher.state.path}
+    sys.stderr.write(json.dumps(summary) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
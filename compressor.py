@@ -1,329 +1,1289 @@
 import os
-from PIL import Image, ImageFile, ImageSequence
-import fitz # PyMuPDF
+import math
+import time
+import threading
+from PIL import Image, ImageFile
 
 from io import BytesIO
+from contextlib import contextmanager
+
+from search import QualitySearch, ProxySearch, PaletteSearch, ScoreSearch, PALETTE_STEPS
+from animation import write_gif, ordered_map, FrameSequence, GIF_ALPHA_LUT
+from tiles import can_tile, decode_strips, TILED_MIN_PIXELS
+from pipeline import atomic_output
+from formats import output_extension
 
 # 防止 Pillow 报错 "Image file truncated"
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-class ImageCompressor:
+# 可以直接高质量插值缩放的颜色模式，其它模式需先转换
+RESIZE_MODES = ('RGB', 'RGBA', 'L', 'LA', 'CMYK')
+
+# 快速缩放时 reduce 之后保留给 LANCZOS 的倍数 (Pillow 推荐 2.0~3.0，效果与精确缩放几乎无差别)
+FAST_REDUCING_GAP = 2.0
+
+# PNG 快速预编码的 zlib 级别。最终 optimize 编码的体积不会小于快速编码的 PNG_FAST_RATIO 倍 (实测约 0.55~0.8)，
+# 快速编码已满足目标或远超目标时，无需 optimize 编码即可判断结果
+PNG_FAST_LEVEL = 1
+PNG_FAST_RATIO = 0.5
+
+# 快速智能模式: 不少于该像素数的图片才使用代理预测 (小图直接精确搜索)
+# 代理图片的像素数为原图的 1/PROXY_MIN_SCALE，最多 PROXY_PIXELS；PROXY_TILE 为抽样小块的边长
+PROXY_MIN_PIXELS = 4_000_000
+PROXY_MIN_SCALE = 16
+PROXY_PIXELS = 1024 * 1024
+PROXY_TILE = 64
+
+# PDF 内嵌图片的默认最高分辨率 (DPI)，以及不值得重新压缩的小图片 (像素数，图标等)
+PDF_MAX_DPI = 150
+PDF_MIN_IMAGE_PIXELS = 128 * 128
+# 智能模式为每张替换的图片预留的字节数 (图片对象字典中 Filter / ColorSpace 等键的变化)
+PDF_IMAGE_OVERHEAD = 256
+
+# 编码强度预设: 各格式在搜索试探 (probe) 与最终编码 (final) 时使用的编码器参数。
+# 搜索中的每次尝试只用于比较大小 / 评分，使用较快的参数；选定质量后用 final 参数重新编码一次 (取较小者)。
+# JPEG 的 optimize / progressive 只改变熵编码，像素与 probe 结果相同；WebP 的 method 会改变像素与体积，
+# 用不同的 method 试探会让选定的质量与最终体积不匹配 (最终结果远小于目标、质量偏低)，因此 probe 与 final 相同。
+# 实测 (200 万像素照片): JPEG optimize 编码耗时约 2 倍、体积 -5%，再加 progressive 约 4 倍、-6%；
+# WebP method 0 / 2 / 4 / 6 耗时约 1 : 1.5 : 4.5 : 6.5，体积依次小 1~2%；PNG optimize 耗时约为 compress_level=1 的 15 倍。
+# 动画不做质量搜索，只有 final: GIF optimize 为裁剪局部调色板与透明区域 (见 animation.write_gif)，WEBP_ANIMATION 为 WebP 动画的 method
+EFFORT_PRESETS = {
+    'fast': {
+        'JPEG': {'probe': {}, 'final': {}},
+        'WEBP': {'probe': {'method': 0}, 'final': {'method': 0}},
+        'PNG': {'probe': {'compress_level': PNG_FAST_LEVEL}, 'final': {'compress_level': 6}},
+        'GIF': {'final': {'optimize': False}},
+        'WEBP_ANIMATION': {'final': {'method': 2}},
+    },
+    'balanced': {
+        'JPEG': {'probe': {}, 'final': {'optimize': True}},
+        'WEBP': {'probe': {'method': 4}, 'final': {'method': 4}},
+        'PNG': {'probe': {'compress_level': PNG_FAST_LEVEL}, 'final': {'optimize': True}},
+        'GIF': {'final': {'optimize': True}},
+        'WEBP_ANIMATION': {'final': {'method': 4}},
+    },
+    'max': {
+        'JPEG': {'probe': {'optimize': True}, 'final': {'optimize': True, 'progressive': True}},
+        'WEBP': {'probe': {'method': 6}, 'final': {'method': 6}},
+        'PNG': {'probe': {'compress_level': PNG_FAST_LEVEL}, 'final': {'optimize': True}},
+        'GIF': {'final': {'optimize': True}},
+        'WEBP_ANIMATION': {'final': {'method': 6}},
+    },
+}
+DEFAULT_EFFORT = 'balanced'
+
+# 从 256 色结果继续减色时，按像素占比采样调色板的样本数
+PALETTE_SAMPLE_SIZE = 16384
+
+
+def _proxy_image(img, max_pixels=PROXY_PIXELS, tile=PROXY_TILE):
+    """
+    快速智能模式的代理图片: 把原图均匀分成网格，取每格中心 tile x tile 的小块拼成小图
+    小块保留原图的局部纹理 (整图缩小会让细节变密，体积-质量关系与原图不同)
+    :return: (代理图片, 原图与代理图片的像素数之比)
+    """
+    width, height = img.size
+    pixels = min(max_pixels, width * height // PROXY_MIN_SCALE)
+    count = max(1, pixels // (tile * tile))
+    cols = max(1, min(width // tile, round(math.sqrt(count * width / height))))
+    rows = max(1, min(height // tile, count // cols))
+
+    proxy = Image.new(img.mode, (cols * tile, rows * tile))
+    for r in range(rows):
+        y = min(max(0, int((r + 0.5) * height / rows) - tile // 2), height - tile)
+        for c in range(cols):
+            x = min(max(0, int((c + 0.5) * width / cols) - tile // 2), width - tile)
+            proxy.paste(img.crop((x, y, x + tile, y + tile)), (c * tile, r * tile))
+    return proxy, width * height / (proxy.width * proxy.height)
+
+
+def quality_prior_key(save_format, output_size, input_size, source_bytes):
+    """
+    质量先验的分组 (见 QualityPrior): 输出格式 + 输出像素数档位 (每档 2 倍) + 原图每像素比特数档位 (每档 √2 倍)
+    同一相机 / 同一来源的图片通常落在同一组，目标大小相同时最终质量也接近
+    """
+    pixels = max(1, output_size[0] * output_size[1])
+    bpp = max(source_bytes, 1) * 8 / max(1, input_size[0] * input_size[1])
+    return f"{save_format}:{round(math.log2(pixels))}:{round(math.log2(bpp) * 2)}"
+
+
+def import_pymupdf():
+    """
+    导入 PyMuPDF (导入较慢，只在真正处理 PDF 时调用)
+    新版本的模块名为 pymupdf；旧名 fitz 在新版本中导入时会向 stdout 打印弃用提示，破坏 NDJSON 输出，只作为旧版本的后备
+    """
+    try:
+        import pymupdf
+    except ImportError:
+        import fitz as pymupdf
+    return pymupdf
+
+
+def _shared_image(img):
+    """
+    与 img 共享像素数据的新图片对象 (不复制像素)
+    Image.save 会把编码参数暂存在图片对象上，同一个对象不能在多个线程中同时保存
+    """
+    img.load()
+    try:
+        return img._new(img.im)
+    except Exception:
+        return img.copy()
+
+
+def _reduce_palette(img, colors):
+    """
+    把已量化的 P 模式图片进一步减少到 colors 色 (复用 256 色的量化结果)
+    只对调色板 (按各颜色的像素占比加权) 重新量化，再用查表重映射像素，比对原图重新 quantize 快 4~5 倍
+    """
+    total = img.width * img.height
+    palette = img.getpalette('RGBA')
+
+    # 每种颜色按像素占比重复，作为量化样本
+    sample = bytearray()
+    repeats = []
+    for count, index in img.getcolors(256):
+        n = max(1, round(count * PALETTE_SAMPLE_SIZE / total))
+        sample += bytes(palette[index * 4:index * 4 + 4]) * n
+        repeats.append((index, n))
+
+    reduced = Image.frombytes('RGBA', (len(sample) // 4, 1), bytes(sample)).quantize(colors=colors, method=2)
+    pixels = reduced.load()
+
+    lut = list(range(256))
+    x = 0
+    for index, n in repeats:
+        lut[index] = pixels[x, 0]
+        x += n
+
+    out = img.point(lut)
+    out.putpalette(reduced.getpalette('RGBA'), rawmode='RGBA')
+    return out
+
+class CompressionResult:
+    """
+    单个文件的结构化压缩结果
+    - timings: 各阶段耗时 (秒)，包括 open / decode / dedup / resize / convert / flatten / quantize / encode / score / write / total
+    - encode_times: 每次编码尝试的耗时 (秒)
+    - quality / colors: 最终使用的质量或 PNG 颜色数
+    - ssim: 画质模式下最终结果与缩放后原图的 SSIM
+    - effort: 编码强度预设 (见 EFFORT_PRESETS)
+    - predicted_quality: 快速智能模式下代理图片预测的质量 (与 quality 对比可得预测准确度)
+    - prior_key / quality_hint: 智能模式 (JPEG / WebP) 的质量先验分组，以及从同一批图片得到的预测质量
+    - pixel_key / duplicate_of: 按像素去重时本图的像素哈希，以及像素相同的已完成图片 {'file', 'output'} (见 dedup.PixelIndex)
+    - attempts: 编码次数
+    - input_size / output_size: 输入 / 输出像素尺寸 (宽, 高)
+    - renditions: 多尺寸输出时每个 宽度 x 格式 组合的结果 [{'width', 'format', 'output', 'result'}] (result 为 CompressionResult)
+    """
+
     def __init__(self):
+        self.success = False
+        self.message = ""
+        self.size_kb = 0
+        self.format = None
+        self.quality = None
+        self.colors = None
+        self.ssim = None
+        self.effort = DEFAULT_EFFORT
+        self.predicted_quality = None
+        self.quality_hint = None
+        self.prior_key = None
+        self.pixel_key = None
+        self.duplicate_of = None
+        self.attempts = 0
+        self.input_size = None
+        self.output_size = None
+        self.renditions = []
+        self.timings = {}
+        self.encode_times = []
+        # 候选并发编码时多个线程会同时记录耗时
+        self._lock = threading.Lock()
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        """记录一个阶段的耗时 (同名阶段累加，并发时为各线程耗时之和)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def record_encode(self, seconds):
+        with self._lock:
+            self.attempts += 1
+            self.encode_times.append(seconds)
+        self.add_time('encode', seconds)
+
+    def as_tuple(self):
+        """兼容旧接口: (success, message, final_size_kb)"""
+        return self.success, self.message, self.size_kb
+
+    def to_dict(self):
+        return {
+            'success': self.success,
+            'message': self.message,
+            'size_kb': self.size_kb,
+            'format': self.format,
+            'quality': self.quality,
+            'colors': self.colors,
+            'ssim': self.ssim,
+            'effort': self.effort,
+            'predicted_quality': self.predicted_quality,
+            'prior_key': self.prior_key,
+            'quality_hint': self.quality_hint,
+            'pixel_key': self.pixel_key,
+            'duplicate_of': self.duplicate_of,
+            'attempts': self.attempts,
+            'input_size': self.input_size,
+            'output_size': self.output_size,
+            'renditions': [dict(r['result'].to_dict(), width=r['width'], output=r['output'])
+                           for r in self.renditions],
+            'timings_ms': {k: round(v * 1000, 3) for k, v in self.timings.items()},
+            'encode_ms': [round(t * 1000, 3) for t in self.encode_times],
+        }
+
+
+class ImageCompressor:
+    def __init__(self, metrics_hook=None, search_workers=1):
+        """
+        :param metrics_hook: 可选回调 hook(file_path, result)，每个文件处理完后调用，
+                             result 为 CompressionResult，可用于对接监控系统
+        :param search_workers: 单个文件内候选编码 (JPEG / WebP 质量搜索、PNG 颜色数搜索) 的并发线程数，1 表示逐个编码
+        """
         self.supported_formats = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.pdf')
+        self.metrics_hook = metrics_hook
+        self.search_workers = max(1, search_workers)
 
     def compress_image(self, file_path, output_path, target_size_kb=None, 
-                       max_width=None, to_webp=False, quality=95, fixed_quality=False):
+                       max_width=None, to_webp=False, quality=95, fixed_quality=False,
+                       resample='exact', detailed=False, tiled=None, source=None, sink=None,
+                       smart_search='exact', quality_hints=None, target_ssim=None, pixel_index=None,
+                       effort=DEFAULT_EFFORT, renditions=None):
         """
         压缩单个图片
         :param file_path: 原文件路径
         :param output_path: 输出文件路径
-        :param target_size_kb: 目标大小 (KB)。如果 fixed_quality=True，此参数被忽略。
+        :param target_size_kb: 目标大小 (KB)。如果 fixed_quality=True 或指定了 target_ssim，此参数被忽略。
         :param max_width: 最大宽度 (px)，None 表示不调整
         :param to_webp: 是否转换为 WebP 格式
         :param quality: 初始质量 (如果 fixed_quality=True，则直接使用此质量)
         :param fixed_quality: 是否使用固定质量模式
-        :return: (success, message, final_size_kb)
+        :param resample: 缩放方式。'exact' 全分辨率解码后 LANCZOS；'fast' 先用 JPEG draft 解码 / 整数倍 reduce 快速缩小，再做最终 LANCZOS
+        :param detailed: True 时返回 CompressionResult (含各阶段耗时等)
+        :param tiled: 分条处理 (见 tiles.py)。None 表示超大的未压缩图片 (BMP / TIFF 等) 自动使用，True 表示格式支持时总是使用，False 表示不使用
+        :param source: 已读入内存的文件内容 (bytes 或文件对象)，None 表示从 file_path 读取。file_path 仍用于判断文件类型
+        :param sink: 可写的文件对象，指定时结果写入其中而不写文件；output_path 仍用于决定输出格式。
+                     不指定时写入 output_path (先写临时文件再原子替换)
+        :param smart_search: 智能模式的质量搜索方式。'exact' 每次尝试都编码整张图片；
+                             'fast' 大图 (JPEG / WebP) 先在抽样小块拼成的代理图片上预测质量，通常只需 2 次整图编码
+        :param quality_hints: 质量先验 {分组: 预测质量} (QualityPrior.hints)，智能模式按本图的分组取预测质量作为搜索起点。
+                              分组记录在 CompressionResult.prior_key 中
+        :param target_ssim: 画质模式的目标 SSIM (如 0.98)。指定时寻找与缩放后原图的 SSIM 不低于该值的最小输出
+                            (JPEG / WebP 为最低质量，PNG 为最少颜色数)，quality 为允许的最高质量。PDF / GIF 不适用
+        :param pixel_index: 按像素去重的索引 (dedup.PixelIndex)。解码后的像素与已完成的图片相同时不再压缩，
+                            也不写出结果，CompressionResult.duplicate_of 为该图片，由调用方复制其输出。分条处理时不适用
+        :param effort: 编码强度 'fast' / 'balanced' / 'max' (见 EFFORT_PRESETS)。搜索中的尝试使用较快的编码参数，
+                       只有最终结果使用该强度的完整参数
+        :param renditions: 多尺寸输出 [{'width', 'format', 'target_size_kb'}] (见 renditions.py)。指定时原图只解码一次，
+                           按宽度级联缩放，每个 宽度 x 格式 组合各自搜索并写入 renditions.rendition_path(output_path, ...)，
+                           同时忽略 max_width / tiled / pixel_index。format / target_size_kb 为 None 时与普通输出相同。
+                           不支持 sink；GIF / PDF 不适用，仍输出一个文件
+        :return: (success, message, final_size_kb)，detailed=True 时为 CompressionResult
         """
+        if effort not in EFFORT_PRESETS:
+            raise ValueError(f"Unknown effort: {effort}")
+        result = CompressionResult()
+        result.effort = effort
+
         # 预检查文件类型
         ext = os.path.splitext(file_path)[1].lower()
-        
-        if ext == '.pdf':
-            return self.compress_pdf(file_path, output_path)
-            
-        if ext == '.gif':
-            return self.compress_gif(file_path, output_path, max_width, to_webp)
 
-        try:
-            # 打开图片
-            with Image.open(file_path) as img:
-                # 转换颜色模式 & 确定保存格式
-                out_ext = os.path.splitext(output_path)[1].lower()
-                
-                if to_webp:
-                    save_format = 'WEBP'
-                    # WebP 支持 RGBA，保留透明度
-                    if img.mode not in ('RGB', 'RGBA'):
-                        if img.mode == 'P':
-                            img = img.convert('RGBA')
-                        else:
-                            img = img.convert('RGBA')
-                elif out_ext == '.png':
-                    save_format = 'PNG'
-                    # 强制将 P 模式转为 RGBA，防止 Resize 或保存过程中透明度丢失变黑
-                    if img.mode == 'P' or img.mode not in ('RGB', 'RGBA'):
-                        img = img.convert('RGBA')
-                elif out_ext == '.webp': 
-                    save_format = 'WEBP'
-                    if img.mode not in ('RGB', 'RGBA'):
-                        img = img.convert('RGBA')
-                else:
-                    # Default/Fallback: JPEG (or BMP/TIFF which we treat as RGB)
-                    # 这些格式不支持透明度，必须处理背景色
-                    save_format = 'JPEG'
-                    
-                    # 检查是否有透明通道
-                    has_alpha = False
-                    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                        has_alpha = True
-                    
-                    if has_alpha:
-                        # 创建白色背景并将原图合成上去，防止透明变黑
-                        if img.mode != 'RGBA':
-                            img = img.convert('RGBA')
-                        
-                        background = Image.new('RGBA', img.size, (255, 255, 255, 255))
-                        # 使用 alpha_composite 合成 (前提是两个图都是 RGBA)
-                        img = Image.alpha_composite(background, img).convert('RGB')
-                    elif img.mode != 'RGB':
-                        # 如果没有透明通道但不是 RGB (例如 CMYK, L)，直接转 RGB
-                        img = img.convert('RGB')
-                
+        with result.stage('total'):
+            if ext == '.pdf':
+                # PDF 中的图片只能是 JPEG，to_webp 不适用
+                self._compress_pdf(result, file_path, output_path, target_size_kb,
+                                   max_width, quality, fixed_quality, resample=resample,
+                                   source=source, sink=sink)
+            elif ext == '.gif':
+                self._compress_gif(result, file_path, output_path, max_width, to_webp, source, sink)
+            elif renditions:
+                try:
+                    self._compress_renditions(result, file_path, output_path, renditions, target_size_kb, to_webp,
+                                              quality, fixed_quality, resample, source, sink, smart_search,
+                                              quality_hints, target_ssim)
+                except Exception as e:
+                    result.success, result.message, result.size_kb = False, str(e), 0
+            else:
+                try:
+                    self._compress_still(result, file_path, output_path, target_size_kb,
+                                         max_width, to_webp, quality, fixed_quality, resample, tiled,
+                                         source, sink, smart_search, quality_hints, target_ssim, pixel_index)
+                except Exception as e:
+                    result.success, result.message, result.size_kb = False, str(e), 0
+
+        if self.metrics_hook:
+            # 指标上报失败不影响压缩结果
+            try:
+                self.metrics_hook(file_path, result)
+            except Exception as e:
+                print(f"Metrics Hook Error: {e}")
+
+        return result if detailed else result.as_tuple()
+
+    def compress_bytes(self, data, input_format, output_format=None, **options):
+        """
+        内存中压缩 (bytes / 文件对象 -> bytes)，不读写任何文件，可直接在上传服务等场景中调用
+        :param data: 输入内容 (bytes-like 或可读的文件对象，不可 seek 的流会先全部读入)
+        :param input_format: 输入格式，扩展名或文件名 (如 'jpg'、'.png'、'photo.gif')，决定使用的处理分支
+        :param output_format: 输出格式扩展名 (如 'webp')，None 表示按批处理的规则
+                              (保持原格式，BMP / TIFF 等转为 JPG，to_webp 时为 WebP，PDF 保持 PDF)
+        :param options: 其它参数同 compress_image (target_size_kb / max_width / to_webp / quality / fixed_quality /
+                        target_ssim / effort ...)。renditions / pixel_index / tiled / source / sink 不适用
+        :return: (输出内容 bytes，失败时为 None, CompressionResult)
+        """
+        unsupported = {'renditions', 'pixel_index', 'tiled', 'source', 'sink', 'detailed'} & set(options)
+        if unsupported:
+            raise TypeError(f"compress_bytes() does not accept: {', '.join(sorted(unsupported))}")
+
+        ext = (os.path.splitext(input_format)[1] or '.' + input_format.lstrip('.')).lower()
+        if output_format is None:
+            out_ext = output_extension(ext, options)
+        else:
+            out_ext = '.' + output_format.lower().lstrip('.')
+
+        if hasattr(data, 'read') and not (hasattr(data, 'seekable') and data.seekable()):
+            data = data.read()
+
+        sink = BytesIO()
+        # 路径只用于判断输入 / 输出格式，不会被访问
+        result = self.compress_image('input' + ext, 'output' + out_ext, source=data, sink=sink, tiled=False,
+                                     detailed=True, **options)
+        return (sink.getvalue() if result.success else None), result
+
+    def _encode(self, result, img, fmt, **kwargs):
+        """编码到内存并记录耗时，返回 BytesIO (写入位置即数据大小)"""
+        start = time.perf_counter()
+        buf = BytesIO()
+        img.save(buf, format=fmt, **kwargs)
+        result.record_encode(time.perf_counter() - start)
+        return buf
+
+    def _settings(self, result, fmt, stage='final'):
+        """本次压缩的编码强度下，fmt 格式在 stage ('probe' / 'final') 阶段的编码器参数"""
+        return EFFORT_PRESETS[result.effort][fmt][stage]
+
+    def _finish_lossy(self, result, img, save_format, quality, buffer, accept=None):
+        """
+        JPEG / WebP 搜索结束后用 final 参数重新编码选定的质量 (取较小者)
+        :param accept: 可选的检查函数 accept(buffer)，返回 False 时保留搜索结果 (如画质模式下 WebP 的评分)
+        """
+        preset = EFFORT_PRESETS[result.effort][save_format]
+        if preset['final'] == preset['probe']:
+            return buffer
+        best = self._encode(result, img, save_format, quality=quality, **preset['final'])
+        if best.tell() < buffer.tell() and (accept is None or accept(best)):
+            return best
+        return buffer
+
+    def _open_source(self, file_path, source):
+        """压缩的输入: 内存中的数据 (包装为文件对象) 或文件路径"""
+        if source is None:
+            return file_path
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return BytesIO(source)
+        return source
+
+    @contextmanager
+    def _open_output(self, output_path, sink=None):
+        """输出文件对象: sink 本身，或 output_path 的临时文件 (正常结束后原子替换)"""
+        if sink is not None:
+            yield sink
+            return
+        with atomic_output(output_path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                yield f
+
+    def _write(self, result, output_path, buffer, message, sink=None):
+        """写出编码结果并填写最终状态 (通过 memoryview 写出，不复制缓冲)"""
+        with result.stage('write'):
+            with self._open_output(output_path, sink) as f:
+                f.write(buffer.getbuffer())
+        result.success = True
+        result.message = message
+        result.size_kb = buffer.tell() / 1024
+
+    def _compress_still(self, result, file_path, output_path, target_size_kb,
+                        max_width, to_webp, quality, fixed_quality, resample, tiled=None,
+                        source=None, sink=None, smart_search='exact', quality_hints=None, target_ssim=None,
+                        pixel_index=None):
+        """静态图片压缩 (JPEG / PNG / WebP / BMP / TIFF ...)，结果写入 result"""
+        # 打开图片 (只读取文件头)
+        with result.stage('open'):
+            img = Image.open(self._open_source(file_path, source))
+
+        with img:
+            result.input_size = img.size
+
+            new_size = None
+            if max_width and img.width > max_width:
+                new_size = (max_width, int(img.height * max_width / img.width))
+
+            save_format = self._save_format(output_path, to_webp)
+
+            if tiled is None:
+                # 不缩放也不用转换颜色模式时，输出就是整张原图，分条处理没有收益
+                direct_modes = ('RGB',) if save_format == 'JPEG' else ('RGB', 'RGBA')
+                tiled = None if new_size or img.mode not in direct_modes else False
+
+            if tiled is not False and source is None and can_tile(img, file_path, 0 if tiled else TILED_MIN_PIXELS):
+                # 超大的未压缩图片: 分条解码 / 缩放 / 转换，不在内存中展开整张原图
+                img = decode_strips(
+                    img, file_path, new_size,
+                    lambda strip: self._convert_mode(result, strip, save_format),
+                    lambda strip, size, box: self._downscale(strip, size, box=box),
+                    result.stage
+                )
+            else:
+                if new_size and resample == 'fast' and img.format == 'JPEG':
+                    # JPEG 解码时直接按 1/2、1/4、1/8 缩小 (draft 需在 load 之前调用)，只解码需要的分辨率
+                    img.draft(None, new_size)
+
+                with result.stage('decode'):
+                    img.load()
+
+                if pixel_index is not None:
+                    with result.stage('dedup'):
+                        result.pixel_key = pixel_index.key(img, save_format)
+                        result.duplicate_of = pixel_index.lookup(result.pixel_key)
+                    if result.duplicate_of:
+                        # 输出只取决于解码后的像素与参数: 与已完成的图片相同，跳过缩放与质量搜索
+                        result.format = save_format
+                        result.success = True
+                        result.message = f"Duplicate of {os.path.basename(result.duplicate_of['file'])} (pixels)"
+                        return
+
                 # 1. 调整尺寸 (Resizing)
-                if max_width and img.width > max_width:
-                    ratio = max_width / img.width
-                    new_height = int(img.height * ratio)
-                    img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-                
-                # --- 核心逻辑: 针对不同格式的压缩策略 ---
-                
-                # 辅助函数: 获取当前图像数据大小
-                def get_size(img_obj, fmt, **kwargs):
-                    buf = BytesIO()
-                    img_obj.save(buf, format=fmt, **kwargs)
-                    return buf.tell(), buf.getvalue()
-
-                # --- 分支 1: 固定质量模式 ---
-                if fixed_quality:
-                    if save_format == 'PNG':
-                        # PNG 即使是固定质量，如果质量设置较低，也应该尝试减色以减小体积
-                        # 假设 quality < 90 时开始尝试减色 (90-100 视为无损/高质量)
-                        if quality < 90:
-                            # 映射 quality (0-90) 到 colors (2-256)
-                            colors = max(2, int((quality / 90) * 256))
-                            try:
-                                # method=2 (MEDIANCUT) 通常能较好保留透明度
-                                img = img.quantize(colors=colors, method=2)
-                            except:
-                                pass # 如果出错保持原样
-                        
-                        img.save(output_path, format='PNG', optimize=True)
-                        result_msg = f"Fixed Quality (PNG Optimized, Q={quality})"
-                    else:
-                        # JPEG / WebP
-                        img.save(output_path, format=save_format, quality=quality)
-                        result_msg = f"Fixed Quality (Q={quality})"
-                                            
-                    size_kb = os.path.getsize(output_path) / 1024
-                    return True, result_msg, size_kb
-
-                # --- 分支 2: 目标大小模式 (智能压缩) ---
-                target_size_bytes = target_size_kb * 1024
+                # 先缩放再转换颜色模式，避免在全分辨率上做模式转换和透明合成
+                if new_size:
+                    with result.stage('resize'):
+                        img = self._downscale(img, new_size, resample)
+
+                # 2. 转换颜色模式
+                img = self._convert_mode(result, img, save_format)
+
+            result.format = save_format
+            result.output_size = img.size
+            self._encode_still(result, img, output_path, save_format, target_size_kb, quality, fixed_quality,
+                               smart_search, quality_hints, target_ssim, self._source_bytes(file_path, source), sink)
+
+    def _save_format(self, output_path, to_webp=False):
+        """确定保存格式"""
+        out_ext = os.path.splitext(output_path)[1].lower()
+        if to_webp or out_ext == '.webp':
+            return 'WEBP'
+        elif out_ext == '.png':
+            return 'PNG'
+        # Default/Fallback: JPEG (or BMP/TIFF which we treat as RGB)
+        return 'JPEG'
+
+    def _compress_renditions(self, result, file_path, output_path, renditions, target_size_kb, to_webp,
+                             quality, fixed_quality, resample, source=None, sink=None, smart_search='exact',
+                             quality_hints=None, target_ssim=None):
+        """
+        多尺寸输出: 解码一次，按宽度从大到小级联缩放，每个 宽度 x 格式 组合各自编码 (见 renditions.py)
+        组合的编码按 search_workers 并发，各组合的结果记录在 result.renditions 中
+        """
+        from renditions import rendition_path
+
+        if sink is not None:
+            raise ValueError("Renditions require an output path (sink is not supported)")
+
+        with result.stage('open'):
+            img = Image.open(self._open_source(file_path, source))
+
+        with img:
+            result.input_size = img.size
+
+            # 按宽度从大到小排列 (同宽度保持原顺序)，第一个为代表整组的输出。
+            # 不放大: 不小于原图的宽度按原图宽度输出并以实际宽度命名，相同的输出只保留一个
+            # (保留请求宽度最小的一项，即与原图宽度相同时使用该宽度的目标大小)
+            outputs = {}
+            for rendition in sorted(renditions, key=lambda r: -r['width']):
+                rendition = dict(rendition, width=min(rendition['width'], img.width))
+                outputs[rendition_path(output_path, rendition)] = rendition
+            plan = [(rendition, path, self._save_format(path, to_webp and not rendition.get('format')))
+                    for path, rendition in outputs.items()]
+
+            largest = min(plan[0][0]['width'], img.width)
+            if resample == 'fast' and img.format == 'JPEG' and largest < img.width:
+                # 只解码最大一档需要的分辨率
+                img.draft(None, (largest, int(img.height * largest / img.width)))
+
+            with result.stage('decode'):
+                img.load()
+
+            # 1. 级联缩放: 每一档从上一档缩小 (不放大)，同一宽度的多个格式共用
+            levels = {}
+            current = img
+            for rendition, _, _ in plan:
+                width = rendition['width']
+                if width in levels:
+                    continue
+                if width < current.width:
+                    size = (width, max(1, int(current.height * width / current.width)))
+                    with result.stage('resize'):
+                        current = self._downscale(current, size, resample)
+                levels[width] = current
+
+            # 2. 每个宽度按输出格式转换颜色模式 (JPEG 合成白色背景，WebP / PNG 保留透明度)
+            converted = {}
+            for rendition, _, save_format in plan:
+                key = (rendition['width'], save_format == 'JPEG')
+                if key not in converted:
+                    converted[key] = self._convert_mode(result, levels[rendition['width']], save_format)
+            source_bytes = self._source_bytes(file_path, source)
+
+            # 3. 各组合分别编码: 并发时组合之间共享核心，剩余的核心留给组合内的质量搜索
+            workers = min(len(plan), self.search_workers)
+            inner = ImageCompressor(search_workers=max(1, self.search_workers // workers))
+
+            def encode(entry):
+                rendition, path, save_format = entry
+                sub = CompressionResult()
+                sub.effort = result.effort
+                sub.input_size = result.input_size
+                sub.format = save_format
+                image = converted[(rendition['width'], save_format == 'JPEG')]
+                # 同一图片对象不能在多个线程中同时保存
+                image = _shared_image(image) if workers > 1 else image
+                sub.output_size = image.size
+                try:
+                    out_dir = os.path.dirname(path)
+                    if out_dir and not os.path.exists(out_dir):
+                        os.makedirs(out_dir, exist_ok=True)
+                    kb = rendition.get('target_size_kb') or target_size_kb
+                    inner._encode_still(sub, image, path, save_format, kb, quality, fixed_quality, smart_search,
+                                        quality_hints, target_ssim, source_bytes)
+                except Exception as e:
+                    sub.success, sub.message, sub.size_kb = False, str(e), 0
+                return {'width': rendition['width'], 'format': save_format, 'output': path, 'result': sub}
+
+            if workers > 1:
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    result.renditions = list(pool.map(encode, plan))
+            else:
+                result.renditions = [encode(entry) for entry in plan]
+
+        # 汇总: 全部成功才算成功，大小为各输出之和
+        subs = [r['result'] for r in result.renditions]
+        for sub in subs:
+            for stage, seconds in sub.timings.items():
+                result.add_time(stage, seconds)
+            result.attempts += sub.attempts
+            result.encode_times.extend(sub.encode_times)
+        failed = [r for r in result.renditions if not r['result'].success]
+        result.format = plan[0][2]
+        result.output_size = subs[0].output_size
+        result.size_kb = sum(sub.size_kb for sub in subs)
+        result.success = not failed
+        if failed:
+            result.message = f"Rendition {os.path.basename(failed[0]['output'])} failed: {failed[0]['result'].message}"
+        else:
+            result.message = f"Renditions ({len(subs)} outputs, Encodes={result.attempts})"
+
+    def _source_bytes(self, file_path, source):
+        """源文件大小 (字节)，用于质量先验的分组"""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return len(source)
+        if source is not None:
+            position = source.tell()
+            size = source.seek(0, os.SEEK_END)
+            source.seek(position)
+            return size
+        return os.path.getsize(file_path)
+
+    def _encode_still(self, result, img, output_path, save_format, target_size_kb, quality, fixed_quality,
+                      smart_search, quality_hints, target_ssim, source_bytes, sink=None):
+        """
+        对已缩放、转换好颜色模式的图片按模式编码并写出 (固定质量 / 智能 / 画质模式)
+        :param source_bytes: 源文件大小，用于质量先验的分组
+        """
+        # --- 核心逻辑: 针对不同格式的压缩策略 ---
+
+        # --- 分支 1: 固定质量模式 ---
+        if fixed_quality:
+            if save_format == 'PNG':
+                # PNG 即使是固定质量，如果质量设置较低，也应该尝试减色以减小体积
+                # 假设 quality < 90 时开始尝试减色 (90-100 视为无损/高质量)
+                if quality < 90:
+                    # 映射 quality (0-90) 到 colors (2-256)
+                    colors = max(2, int((quality / 90) * 256))
+                    try:
+                        # method=2 (MEDIANCUT) 通常能较好保留透明度
+                        with result.stage('quantize'):
+                            img = img.quantize(colors=colors, method=2)
+                        result.colors = colors
+                    except:
+                        pass # 如果出错保持原样
                 
-                # A. 针对 PNG 的特殊二分/循环逻辑 (因为 quality 参数无效)
-                if save_format == 'PNG':
-                    # 1. 先尝试直接保存 (RGBA, optimize=True)
-                    size, data = get_size(img, 'PNG', optimize=True)
-                    if size <= target_size_bytes:
-                        with open(output_path, 'wb') as f: f.write(data)
-                        return True, "PNG Optimized (Lossless)", size / 1024
-                    
-                    # 2. 如果不行，开始减色 (Quantize) 循环
-                    # 颜色从 256 递减到 8
-                    # 为了效率，我们取几个关键点或者二分，这里用步进尝试
-                    color_steps = [256, 192, 128, 96, 64, 32, 16, 8]
-                    best_data = data # 默认存之前的
-                    best_size = size
-                    
-                    for c in color_steps:
-                        try:
-                            # 注意: quantize 会返回新图片
-                            q_img = img.quantize(colors=c, method=2)
-                            curr_size, curr_data = get_size(q_img, 'PNG', optimize=True)
-                            
-                            if curr_size <= target_size_bytes:
-                                with open(output_path, 'wb') as f: f.write(curr_data)
-                                return True, f"PNG Quantized (Colors={c})", curr_size / 1024
-                            
-                            # 记录最小的那个，以防都达不到目标
-                            if curr_size < best_size:
-                                best_size = curr_size
-                                best_data = curr_data
-                        except:
-                            continue
+                buffer = self._encode(result, img, 'PNG', **self._settings(result, 'PNG'))
+                result_msg = f"Fixed Quality (PNG Optimized, Q={quality})"
+            else:
+                # JPEG / WebP
+                buffer = self._encode(result, img, save_format, quality=quality,
+                                      **self._settings(result, save_format))
+                result_msg = f"Fixed Quality (Q={quality})"
 
-                    # 如果所有尝试都失败，保存最小的那个
-                    with open(output_path, 'wb') as f: f.write(best_data)
-                    return True, f"Warning: Hard limit reached (PNG Min Size)", best_size / 1024
-
-                # B. 针对 JPEG / WEBP 的常规 Quality 二分逻辑
-                else: 
-                    buffer = BytesIO()
-                    min_q = 5
-                    max_q = quality # 使用传入的 quality 作为起始最高质量
-                    
-                    # 第一次尝试
-                    buffer.seek(0); buffer.truncate(0)
-                    img.save(buffer, format=save_format, quality=max_q)
-                    size = buffer.tell()
-                    
-                    if size <= target_size_bytes:
-                        with open(output_path, 'wb') as f:
-                            f.write(buffer.getvalue())
-                        return True, "Success", size / 1024
-                    
-                    # 二分法逼近
-                    final_q = max_q
-                    left = min_q
-                    right = max_q
-                    best_buffer = None
-                    
-                    while left <= right:
-                        mid = (left + right) // 2
-                        buffer.seek(0); buffer.truncate(0)
-                        img.save(buffer, format=save_format, quality=mid)
-                        size = buffer.tell()
-                        
-                        if size <= target_size_bytes:
-                            best_buffer = buffer.getvalue()
-                            final_q = mid
-                            left = mid + 1
-                        else:
-                            right = mid - 1
-                    
-                    if best_buffer:
-                        with open(output_path, 'wb') as f:
-                            f.write(best_buffer)
-                        return True, f"Smart Compressed (Q={final_q})", len(best_buffer) / 1024
-                    else:
-                        # 硬限制无法满足
-                        buffer.seek(0); buffer.truncate(0)
-                        img.save(buffer, format=save_format, quality=min_q)
-                        with open(output_path, 'wb') as f:
-                            f.write(buffer.getvalue())
-                        return True, f"Warning: Hard limit reached (Q={min_q})", buffer.tell() / 1024
+            result.quality = quality
+            self._write(result, output_path, buffer, result_msg, sink)
+            return
 
-        except Exception as e:
-            return False, str(e), 0
+        # --- 分支 2: 目标大小模式 (智能压缩) / 画质模式 (目标 SSIM) ---
+        target_size_bytes = None if target_ssim else target_size_kb * 1024
+        scorer = None
+        if target_ssim:
+            # 延迟导入: NumPy 只在画质模式下加载
+            from perceptual import SsimScorer
+            with result.stage('score'):
+                scorer = SsimScorer(img)
+
+        # A. 针对 PNG 的颜色数搜索 (因为 quality 参数无效)
+        if save_format == 'PNG':
+            if scorer is not None:
+                self._compress_png_perceptual(result, img, output_path, scorer, target_ssim, sink)
+            else:
+                self._compress_png(result, img, output_path, target_size_bytes, sink)
+            return
 
-    def compress_gif(self, file_path, output_path, max_width=None, to_webp=False):
+        # B. 针对 JPEG / WEBP 的 Quality 搜索 (插值预测 + 区间收缩)
+        min_q = 5
+        max_q = quality # 使用传入的 quality 作为起始最高质量
+
+        result.prior_key = quality_prior_key(save_format, img.size, result.input_size, source_bytes)
+        if quality_hints:
+            result.quality_hint = quality_hints.get(result.prior_key)
+
+        if scorer is not None:
+            self._compress_perceptual(result, img, output_path, save_format, scorer, target_ssim,
+                                      min_q, max_q, sink)
+            return
+
+        search, final_q, buffer = self._search_quality(
+            result, img, save_format, target_size_bytes, min_q, max_q, smart_search, result.quality_hint)
+
+        # 编码次数包括 final 参数的重新编码 (与 result.attempts / 批处理结果中的 attempts 一致)
+        encodes = f"Encodes={result.attempts}"
+        if isinstance(search, ProxySearch):
+            result.predicted_quality = search.predicted_quality
+            encodes += f", Predicted={search.predicted_quality}"
+
+        if final_q is None:
+            # 硬限制无法满足
+            result.quality = min_q
+            message = f"Warning: Hard limit reached (Q={min_q}, {encodes})"
+        elif final_q == max_q:
+            result.quality = final_q
+            message = f"Success ({encodes})"
+        else:
+            result.quality = final_q
+            message = f"Smart Compressed (Q={final_q}, {encodes})"
+
+        self._write(result, output_path, buffer, message, sink)
+
+    def _search_quality(self, result, img, save_format, target_size_bytes, min_q, max_q, smart_search, hint=None):
+        """
+        JPEG / WebP 智能模式的质量搜索
+        :param smart_search: 'exact' 全图编码搜索；'fast' 大图先在代理图片上预测 (见 ProxySearch)
+        :param hint: 预测的质量 (同一批相似图片的结果)，作为精确搜索的起点
+        :return: (search, quality, buffer)
+        """
+        probe = self._settings(result, save_format, 'probe')
+        pool = None
+        if self.search_workers > 1:
+            # 单张大图: 每轮并发编码多个质量，缩短等待时间 (编码时 Pillow 释放 GIL)
+            from concurrent.futures import ThreadPoolExecutor
+            pool = ThreadPoolExecutor(max_workers=self.search_workers)
+
+            def encode(q):
+                return self._encode(result, _shared_image(img), save_format, quality=q, **probe)
+        else:
+            def encode(q):
+                return self._encode(result, img, save_format, quality=q, **probe)
+
+        try:
+            if smart_search == 'fast' and img.width * img.height >= PROXY_MIN_PIXELS:
+                with result.stage('proxy'):
+                    proxy, scale = _proxy_image(img)
+
+                def encode_proxy(q):
+                    # 代理编码不计入 encode 耗时与编码次数
+                    with result.stage('proxy'):
+                        buf = BytesIO()
+                        proxy.save(buf, format=save_format, quality=q, **probe)
+                    return buf
+
+                search = ProxySearch(encode, encode_proxy, scale, target_size_bytes, min_q=min_q, max_q=max_q,
+                                     executor=pool, width=self.search_workers)
+            else:
+                search = QualitySearch(encode, target_size_bytes, min_q=min_q, max_q=max_q,
+                                       executor=pool, width=self.search_workers, hint=hint)
+            final_q, buffer = search.run()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        buffer = self._finish_lossy(result, img, save_format, final_q or min_q, buffer)
+        return search, final_q, buffer
+
+    def _scored(self, result, score):
+        """包装评分函数并记录耗时 (并发时在多个线程中调用)"""
+        def measure(candidate):
+            with result.stage('score'):
+                return score(candidate)
+        return measure
+
+    def _compress_perceptual(self, result, img, output_path, save_format, scorer, target_ssim, min_q, max_q, sink=None):
+        """JPEG / WebP 画质模式: SSIM 不低于目标的最低质量 (ScoreSearch)"""
+        probe = self._settings(result, save_format, 'probe')
+        pool = None
+        if self.search_workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            pool = ThreadPoolExecutor(max_workers=self.search_workers)
+
+            def encode(q):
+                return self._encode(result, _shared_image(img), save_format, quality=q, **probe)
+        else:
+            def encode(q):
+                return self._encode(result, img, save_format, quality=q, **probe)
+
+        try:
+            search = ScoreSearch(encode, self._scored(result, scorer.score_buffer), target_ssim,
+                                 min_q=min_q, max_q=max_q, executor=pool, width=self.search_workers,
+                                 hint=result.quality_hint)
+            final_q, buffer = search.run()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        result.quality = max_q if final_q is None else final_q
+        result.ssim = search.scores[result.quality]
+
+        accept = None
+        if save_format == 'WEBP':
+            # WebP 的 method 会改变像素: 重新评分，仍达到目标 (或不低于原评分) 时才使用
+            def accept(candidate):
+                score = self._scored(result, scorer.score_buffer)(candidate)
+                if score < min(target_ssim, result.ssim):
+                    return False
+                result.ssim = score
+                return True
+        buffer = self._finish_lossy(result, img, save_format, result.quality, buffer, accept)
+
+        if final_q is None:
+            # 最高质量仍未达到目标
+            message = f"Warning: Target SSIM not reached (Q={max_q}, SSIM={result.ssim:.4f}, Encodes={result.attempts})"
+        else:
+            message = f"Perceptual Compressed (Q={final_q}, SSIM={result.ssim:.4f}, Encodes={result.attempts})"
+
+        self._write(result, output_path, buffer, message, sink)
+
+    def _convert_mode(self, result, img, save_format):
+        """转换为保存格式可用的颜色模式 (逐像素运算，分条处理时对每一条分别调用)"""
+        if save_format in ('WEBP', 'PNG'):
+            # WebP / PNG 支持 RGBA，保留透明度
+            # 强制将 P 模式转为 RGBA，防止 Resize 或保存过程中透明度丢失变黑
+            if img.mode not in ('RGB', 'RGBA'):
+                with result.stage('convert'):
+                    img = img.convert('RGBA')
+            return img
+
+        # JPEG 不支持透明度，必须处理背景色
+        # 检查是否有透明通道
+        has_alpha = False
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            has_alpha = True
+
+        if has_alpha:
+            with result.stage('flatten'):
+                # 创建白色背景并将原图合成上去，防止透明变黑
+                if img.mode != 'RGBA':
+                    img = img.convert('RGBA')
+
+                background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+                # 使用 alpha_composite 合成 (前提是两个图都是 RGBA)
+                img = Image.alpha_composite(background, img).convert('RGB')
+        elif img.mode != 'RGB':
+            # 如果没有透明通道但不是 RGB (例如 CMYK, L)，直接转 RGB
+            with result.stage('convert'):
+                img = img.convert('RGB')
+        return img
+
+    def _encode_png(self, result, img, target_size_bytes):
+        """
+        以目标大小为准编码 PNG: 先用快速 zlib 级别预编码，只有无法据此判断时才做 optimize 编码
+        :return: (buffer, optimized)。buffer 大小与目标的比较结论与 optimize 编码一致
+        """
+        fast = self._encode(result, img, 'PNG', **self._settings(result, 'PNG', 'probe'))
+        if fast.tell() <= target_size_bytes or fast.tell() * PNG_FAST_RATIO > target_size_bytes:
+            return fast, False
+        return self._encode(result, img, 'PNG', **self._settings(result, 'PNG')), True
+
+    def _finish_png(self, result, img, buffer, optimized):
+        """最终结果补做 final 参数的编码 (取较小者)"""
+        if optimized:
+            return buffer
+        best = self._encode(result, img, 'PNG', **self._settings(result, 'PNG'))
+        return best if best.tell() <= buffer.tell() else buffer
+
+    def _compress_png(self, result, img, output_path, target_size_bytes, sink=None):
+        """PNG 智能模式: 无损 -> 减色 (颜色数 k 分搜索)"""
+        # 1. 先尝试无损保存
+        buffer, optimized = self._encode_png(result, img, target_size_bytes)
+        if buffer.tell() <= target_size_bytes:
+            buffer = self._finish_png(result, img, buffer, optimized)
+            self._write(result, output_path, buffer, "PNG Optimized (Lossless)", sink)
+            return
+
+        # 2. 减色: 只对原图量化一次 (256 色)，更少的颜色数都从 256 色结果继续减色
+        try:
+            # method=2 (FASTOCTREE) 支持 RGBA，能较好保留透明度
+            with result.stage('quantize'):
+                base = img.quantize(colors=256, method=2)
+                used = len(base.getcolors(256))
+        except Exception:
+            # 无法减色时保存无损结果
+            buffer = self._finish_png(result, img, buffer, optimized)
+            self._write(result, output_path, buffer, "Warning: Hard limit reached (PNG Min Size)", sink)
+            return
+
+        # 图片本身颜色少于候选数时，多余的候选结果相同，不必重复尝试
+        steps = [used] + [c for c in PALETTE_STEPS if c < used]
+        optimized_colors = set()
+
+        def candidate(colors):
+            if colors >= used:
+                return base
+            with result.stage('quantize'):
+                return _reduce_palette(base, colors)
+
+        def encode(colors):
+            buf, opt = self._encode_png(result, candidate(colors), target_size_bytes)
+            if opt:
+                optimized_colors.add(colors)
+            return buf
+
+        if self.search_workers > 1:
+            # 延迟导入: 单线程搜索 (批处理工作进程) 无需加载
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=self.search_workers) as pool:
+                search = PaletteSearch(encode, target_size_bytes, steps, executor=pool, width=self.search_workers)
+                colors, buffer = search.run()
+        else:
+            search = PaletteSearch(encode, target_size_bytes, steps)
+            colors, buffer = search.run()
+
+        if colors is None:
+            # 所有颜色数都超出目标，保存体积最小的结果
+            colors = min(search.sizes, key=search.sizes.get)
+            message = "Warning: Hard limit reached (PNG Min Size)"
+        else:
+            message = f"PNG Quantized (Colors={colors})"
+
+        result.colors = colors
+        buffer = self._finish_png(result, candidate(colors), buffer, colors in optimized_colors)
+        self._write(result, output_path, buffer, message, sink)
+
+    def _compress_png_perceptual(self, result, img, output_path, scorer, target_ssim, sink=None):
+        """PNG 画质模式: SSIM 不低于目标的最少颜色数，都达不到时保存无损结果"""
+        try:
+            with result.stage('quantize'):
+                base = img.quantize(colors=256, method=2)
+                used = len(base.getcolors(256))
+        except Exception:
+            base = None
+
+        colors = None
+        if base is not None:
+            # 候选从少到多排列: 颜色越多评分越高
+            steps = [c for c in reversed(PALETTE_STEPS) if c < used] + [used]
+            score = self._scored(result, scorer.score)
+            scores = {}
+
+            def candidate(colors):
+                if colors >= used:
+                    return base
+                with result.stage('quantize'):
+                    return _reduce_palette(base, colors)
+
+            def encode(colors):
+                # 评分直接使用减色后的图片 (PNG 无损，不需要解码)
+                image = candidate(colors)
+                scores[colors] = score(image)
+                return self._encode(result, image, 'PNG', **self._settings(result, 'PNG', 'probe'))
+
+            def accept(colors, buf):
+                return scores[colors] >= target_ssim
+
+            if self.search_workers > 1:
+                from concurrent.futures import ThreadPoolExecutor
+                with ThreadPoolExecutor(max_workers=self.search_workers) as pool:
+                    search = PaletteSearch(encode, None, steps, executor=pool, width=self.search_workers,
+                                           accept=accept)
+                    colors, buffer = search.run()
+            else:
+                colors, buffer = PaletteSearch(encode, None, steps, accept=accept).run()
+
+        if colors is None:
+            # 256 色仍未达到目标 (或无法减色)
+            buffer = self._encode(result, img, 'PNG', **self._settings(result, 'PNG'))
+            result.ssim = 1.0
+            message = "PNG Optimized (Lossless)"
+        else:
+            result.colors = colors
+            result.ssim = scores[colors]
+            buffer = self._finish_png(result, candidate(colors), buffer, False)
+            message = f"PNG Quantized (Colors={colors}, SSIM={result.ssim:.4f})"
+
+        self._write(result, output_path, buffer, message, sink)
+
+    def _downscale(self, img, new_size, resample='exact', box=None):
+        """
+        等比缩放到 new_size (在颜色模式转换之前调用)
+        :param resample: 'exact' 或 'fast' (见 compress_image)
+        :param box: 只缩放原图中的该区域 (分条处理时使用，区域外的相邻像素参与插值)
+        """
+        # P / 1 模式缩放只能使用最近邻，先转为可插值的模式 (保留透明度)
+        if img.mode == 'P':
+            img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+        elif img.mode == '1':
+            img = img.convert('L')
+        elif img.mode not in RESIZE_MODES:
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+
+        if resample == 'fast':
+            # reducing_gap: 先用 reduce 按整数倍快速缩小，只在最后一段使用 LANCZOS
+            return img.resize(new_size, Image.Resampling.LANCZOS, box=box, reducing_gap=FAST_REDUCING_GAP)
+        return img.resize(new_size, Image.Resampling.LANCZOS, box=box)
+
+    def compress_gif(self, file_path, output_path, max_width=None, to_webp=False, effort=DEFAULT_EFFORT):
+        result = CompressionResult()
+        result.effort = effort
+        self._compress_gif(result, file_path, output_path, max_width, to_webp)
+        return result.as_tuple()
+
+    def _compress_gif(self, result, file_path, output_path, max_width=None, to_webp=False,
+                      source=None, sink=None):
+        """
+        动图逐帧流式处理: 解码、缩放、透明度处理、编码交替进行，内存中只保留少量帧，不随帧数增长
+        search_workers > 1 时多帧并行缩放 (解码和写出仍按顺序进行)
+        """
         try:
-            with Image.open(file_path) as img:
-                frames = []
-                # 遍历所有帧
-                for frame in ImageSequence.Iterator(img):
-                    f = frame.copy()
-                    
+            with result.stage('open'):
+                img = Image.open(self._open_source(file_path, source))
+
+            with img:
+                result.input_size = img.size
+                new_size = None
+                if max_width and img.width > max_width:
+                    new_size = (max_width, int(img.height * max_width / img.width))
+                result.output_size = new_size or img.size
+                save_webp = to_webp or output_path.lower().endswith('.webp')
+
+                def decode():
+                    # seek 会复用同一个图片对象，需要拷贝出来再交给后续处理
+                    index = 0
+                    while True:
+                        with result.stage('decode'):
+                            try:
+                                img.seek(index)
+                            except EOFError:
+                                return
+                            frame = img.copy()
+                        yield frame
+                        index += 1
+
+                def process(f):
                     # 1. 调整大小
-                    if max_width and f.width > max_width:
-                        ratio = max_width / f.width
-                        new_height = int(f.height * ratio)
+                    if new_size:
                         # 使用 LANCZOS 可能会产生半透明像素，这对 GIF 是不利的
-                        f = f.resize((max_width, new_height), Image.Resampling.LANCZOS)
-                    
+                        with result.stage('resize'):
+                            f = f.resize(new_size, Image.Resampling.LANCZOS)
+
                     # 2. 处理 GIF 格式的透明度问题 (关键步骤)
                     # GIF只支持全透或全不透。Resize 产生的半透明像素(Alpha 1-254)会被强制转换，通常变成黑色杂边。
-                    if not to_webp: # 如果是转 WebP，保留半透明甚至更好
-                        if f.mode == 'P':
-                            f = f.convert('RGBA')
-                        
-                        if f.mode == 'RGBA':
-                             # 二值化 Alpha 通道：透明度 < 128 设为 0 (全透)，>= 128 设为 255 (不透)
-                             # 这能消除因 Resize 产生的半透明黑边
-                             alpha = f.getchannel('A')
-                             # 这种方式比 point 效率稍低但更直观，point 写法: alpha.point(lambda p: 255 if p > 128 else 0)
-                             threshold = 128
-                             f.putalpha(alpha.point(lambda p: 255 if p > threshold else 0))
-                    
-                    if to_webp:
-                        if f.mode not in ('RGB', 'RGBA'):
-                             f = f.convert('RGBA')
-                    
-                    frames.append(f)
-
-                if not frames:
-                    return False, "No frames found", 0
+                    with result.stage('convert'):
+                        if save_webp:
+                            # 转 WebP 时保留半透明
+                            if f.mode not in ('RGB', 'RGBA'):
+                                f = f.convert('RGBA')
+                        else:
+                            if f.mode == 'P':
+                                f = f.convert('RGBA')
+
+                            if f.mode == 'RGBA':
+                                # 二值化 Alpha 通道：透明度 <= 128 设为 0 (全透)，> 128 设为 255 (不透)
+                                # 这能消除因 Resize 产生的半透明黑边
+                                f.putalpha(f.getchannel('A').point(GIF_ALPHA_LUT))
+                    return f
+
+                frames = ordered_map(process, decode(), self.search_workers)
+
+                # 编码与逐帧处理交替进行，编码耗时 = 总耗时 - 逐帧处理耗时
+                frame_stages = ('decode', 'resize', 'convert')
+                processed = sum(result.timings.get(k, 0) for k in frame_stages)
+                start = time.perf_counter()
 
                 # 保存
-                if to_webp or output_path.lower().endswith('.webp'):
-                    # 保存为 WebP (支持动画, 支持半透明)
-                    frames[0].save(
-                        output_path, 
-                        save_all=True, 
-                        append_images=frames[1:], 
-                        optimize=True,
-                        quality=80, # WebP 动画质量
-                        method=6
-                    )
-                else:
-                    # 保存为 GIF
-                    # disposal=2: 恢复背景色 (防止帧叠加残影)
-                    # transparency=0/255: 通常不需要显式指定，PIL 会自动处理 RGBA->P 的量化
-                    # 但最好将第一帧的 info 复制过去，这有点复杂，通常直接 save 即可
-                    frames[0].save(
-                        output_path, 
-                        save_all=True, 
-                        append_images=frames[1:], 
-                        optimize=True,
-                        disposal=2, # 关键：每帧播放完后恢复背景，防止透明叠加导致后面变乱
-                        loop=img.info.get('loop', 0) # 保留循环次数
-                    )
-                
-                size_kb = os.path.getsize(output_path) / 1024
-                return True, "GIF Optimized", size_kb
+                with self._open_output(output_path, sink) as fp:
+                    begin = fp.tell()
+                    if save_webp:
+                        result.format = 'WEBP'
+                        result.quality = 80
+                        # 保存为 WebP (支持动画, 支持半透明)，编码器逐帧拉取
+                        sequence = FrameSequence(frames, img.n_frames)
+                        sequence.save(
+                            fp, 
+                            format='WEBP',
+                            save_all=True, 
+                            quality=80, # WebP 动画质量
+                            duration=sequence.durations, # 每帧时长
+                            loop=img.info.get('loop', 0), # 保留循环次数
+                            **self._settings(result, 'WEBP_ANIMATION')
+                        )
+                    else:
+                        result.format = 'GIF'
+                        # 保存为 GIF
+                        # disposal=2: 恢复背景色 (防止帧叠加残影)
+                        written = write_gif(
+                            fp, frames,
+                            loop=img.info.get('loop', 0), # 保留循环次数
+                            disposal=2, # 关键：每帧播放完后恢复背景，防止透明叠加导致后面变乱
+                            **self._settings(result, 'GIF')
+                        )
+                        if not written:
+                            # 抛出异常时不会留下输出文件
+                            raise ValueError("No frames found")
+                    size = fp.tell() - begin
+
+                processed = sum(result.timings.get(k, 0) for k in frame_stages) - processed
+                result.record_encode(max(0, time.perf_counter() - start - processed))
+                result.success = True
+                result.message = "GIF Optimized"
+                result.size_kb = size / 1024
 
         except Exception as e:
-            return False, f"GIF Error: {e}", 0
+            result.success, result.message, result.size_kb = False, f"GIF Error: {e}", 0
+
+    def compress_pdf(self, file_path, output_path, target_size_kb=None, max_width=None,
+                     quality=95, fixed_quality=False, max_dpi=PDF_MAX_DPI, resample='exact', effort=DEFAULT_EFFORT):
+        """
+        压缩 PDF。只传入路径时仅做无损整理 (去重 + 压缩流)；
+        指定 target_size_kb / fixed_quality / max_width 时同时重新压缩内嵌图片 (见 _recompress_pdf_images)
+        :param max_dpi: 内嵌图片的最高分辨率，超过时缩小
+        :param effort: 内嵌图片的 JPEG 编码强度 (见 EFFORT_PRESETS)
+        """
+        result = CompressionResult()
+        result.effort = effort
+        self._compress_pdf(result, file_path, output_path, target_size_kb, max_width,
+                           quality, fixed_quality, max_dpi, resample)
+        return result.as_tuple()
 
-    def compress_pdf(self, file_path, output_path):
+    def _compress_pdf(self, result, file_path, output_path, target_size_kb=None, max_width=None,
+                      quality=95, fixed_quality=False, max_dpi=PDF_MAX_DPI, resample='exact',
+                      source=None, sink=None):
         try:
-            doc = fitz.open(file_path)
-            # 使用 garbage=4 (去重+清理) 和 deflate=True (压缩流)
-            doc.save(output_path, garbage=4, deflate=True)
-            doc.close()
+            result.format = 'PDF'
+            with result.stage('open'):
+                doc = self._open_pdf(file_path, source)
+
+            try:
+                replaced = 0
+                if target_size_kb or fixed_quality or max_width:
+                    replaced = self._recompress_pdf_images(
+                        result, doc, file_path, target_size_kb, max_width, quality, fixed_quality, max_dpi, resample,
+                        source
+                    )
+
+                # 使用 garbage=4 (去重+清理) 和 deflate=True (压缩流)
+                with result.stage('write'):
+                    if sink is not None:
+                        begin = sink.tell()
+                        doc.save(sink, garbage=4, deflate=True)
+                        size = sink.tell() - begin
+                    else:
+                        # 文件对象带有 name 时 PyMuPDF 会按文件名另行写入，这里直接传临时文件路径
+                        with atomic_output(output_path) as tmp_path:
+                            doc.save(tmp_path, garbage=4, deflate=True)
+                        size = os.path.getsize(output_path)
+            finally:
+                doc.close()
             
-            size_kb = os.path.getsize(output_path) / 1024
-            return True, "PDF Compressed", size_kb
+            result.success = True
+            result.size_kb = size / 1024
+            if not fixed_quality and target_size_kb and result.size_kb > target_size_kb:
+                result.message = f"Warning: Hard limit reached (PDF, Images={replaced})"
+            elif replaced:
+                result.message = f"PDF Compressed (Images={replaced})"
+            else:
+                result.message = "PDF Compressed"
         except Exception as e:
-            return False, f"PDF Error: {e}", 0
+            result.success, result.message, result.size_kb = False, f"PDF Error: {e}", 0
 
-    def process_queue(self, file_list, output_dir, params, progress_callback=None):
+    def _open_pdf(self, file_path, source=None):
+        fitz = import_pymupdf()
+
+        if source is None:
+            return fitz.open(file_path)
+        if hasattr(source, 'read'):
+            source.seek(0)
+            source = source.read()
+        return fitz.open(stream=source, filetype='pdf')
+
+    def _recompress_pdf_images(self, result, doc, file_path, target_size_kb, max_width,
+                               quality, fixed_quality, max_dpi, resample='exact', source=None):
         """
-        批量处理队列
+        重新压缩 PDF 内嵌图片 (按 xref 去重，多页共用的图片只处理一次)
+        - 按页面上的最大显示尺寸计算实际 DPI，超过 max_dpi 时缩小；宽度同样受 max_width 限制
+        - 智能模式: 目标大小扣除非图片内容后，按像素面积依次分配给各图片 (前面图片剩余的预算留给后面)，
+          各自用 QualitySearch 搜索质量
+        - 非图片内容的体积通过清空候选图片后再保存一次得到 (重新打开文件，不复制整个文档)
+        - 只有新数据比原数据小时才替换。透明蒙版 (SMask) 保持不变
+        图片解码在当前线程逐个进行 (PyMuPDF 文档对象不是线程安全的)，缩放和编码在线程池中并行 (search_workers)
+        :return: 替换的图片数量
         """
-        results = []
-        total = len(file_list)
-        
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-            
-        for i, file_path in enumerate(file_list):
-            filename = os.path.basename(file_path)
-            # 确定输出文件名
-            name, ext = os.path.splitext(filename)
-            if params.get('to_webp'):
-                out_filename = f"{name}.webp"
-            elif ext.lower() == '.png':
-                out_filename = f"{name}.png"
-            elif ext.lower() == '.webp':
-                out_filename = f"{name}.webp"
+        fitz = import_pymupdf()
+
+        # 1. 收集候选图片: xref -> [宽, 高, 最大显示宽度 (pt), 原始数据大小]
+        with result.stage('scan'):
+            images = {}
+            for page in doc:
+                for info in page.get_images(full=True):
+                    xref, width, height, bpc = info[0], info[2], info[3], info[4]
+                    if xref not in images:
+                        # 1 位图 (扫描件常用 CCITT / JBIG2) 与颜色键蒙版不适合转为有损 JPEG
+                        if bpc < 8 or doc.xref_get_key(xref, 'ImageMask')[1] == 'true' \
+                                or doc.xref_get_key(xref, 'Mask')[0] == 'array':
+                            continue
+                        if width * height < PDF_MIN_IMAGE_PIXELS:
+                            continue
+                        # /Length 可能是间接对象 ("5 0 R")，直接取原始数据的长度
+                        raw_size = len(doc.xref_stream_raw(xref))
+                        images[xref] = [width, height, 0, raw_size]
+                    for rect in page.get_image_rects(xref):
+                        images[xref][2] = max(images[xref][2], rect.width)
+
+        if not images:
+            return 0
+
+        # 2. 计算各图片的输出尺寸
+        plans = {}
+        for xref, (width, height, display_width, raw_size) in images.items():
+            new_width = width
+            if display_width > 0:
+                dpi = width * 72 / display_width
+                if dpi > max_dpi:
+                    new_width = width * max_dpi / dpi
+            if max_width and new_width > max_width:
+                new_width = max_width
+            new_width = max(1, int(new_width))
+            new_size = (new_width, max(1, int(height * new_width / width)))
+            plans[xref] = (new_size, raw_size)
+
+        # 3. 智能模式: 分配体积预算 (目标大小 - 非图片内容)
+        if not fixed_quality and target_size_kb:
+            with result.stage('scan'):
+                # 非图片内容 (文字、字体、不处理的图片等) 的实际体积: 清空候选图片后按相同方式保存一次
+                probe = self._open_pdf(file_path, source)
+                try:
+                    for xref in plans:
+                        # 替换后的图片使用 DeviceRGB / DeviceGray，原来的 ICC 等颜色空间对象随之被清理
+                        probe.update_stream(xref, b'', compress=False)
+                        probe.xref_set_key(xref, 'ColorSpace', '/DeviceRGB')
+                    other_bytes = len(probe.tobytes(garbage=4, deflate=True))
+                finally:
+                    probe.close()
+
+            # 剩余预算与剩余面积: 按面积分配，先完成的图片用不完或超出的部分由后面的图片承担
+            budget = {'bytes': target_size_kb * 1024 - other_bytes - PDF_IMAGE_OVERHEAD * len(plans),
+                      'area': sum(size[0] * size[1] for size, _ in plans.values())}
+        else:
+            budget = None
+
+        def decode():
+            for xref, (new_size, raw_size) in plans.items():
+                with result.stage('decode'):
+                    pix = fitz.Pixmap(doc, xref)
+                    if pix.alpha:
+                        pix = fitz.Pixmap(pix, 0) # 透明度由 SMask 单独保存
+                    if pix.n not in (1, 3):
+                        pix = fitz.Pixmap(fitz.csRGB, pix) # CMYK / Lab 等转 RGB
+                    mode = 'L' if pix.n == 1 else 'RGB'
+                    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples, 'raw', mode, pix.stride)
+                    pix = None
+
+                share = None
+                if budget is not None:
+                    area = new_size[0] * new_size[1]
+                    share = max(1, int(budget['bytes'] * area / budget['area']))
+                    budget['bytes'] -= share
+                    budget['area'] -= area
+                yield xref, img, new_size, raw_size, share
+
+        def encode(job):
+            xref, img, new_size, raw_size, share = job
+            if new_size != img.size:
+                with result.stage('resize'):
+                    img = self._downscale(img, new_size, resample)
+
+            if share is None:
+                q = quality
+                buffer = self._encode(result, img, 'JPEG', quality=q, **self._settings(result, 'JPEG'))
             else:
-                out_filename = f"{name}.jpg"
+                probe = self._settings(result, 'JPEG', 'probe')
+                search = QualitySearch(
+                    lambda q: self._encode(result, img, 'JPEG', quality=q, **probe), share, min_q=5, max_q=quality
+                )
+                q, buffer = search.run()
+                q = q or 5
+                buffer = self._finish_lossy(result, img, 'JPEG', q, buffer)
+            return xref, img.size, img.mode, q, buffer, raw_size, share
 
-            output_path = os.path.join(output_dir, out_filename)
-            
-            success, msg, size = self.compress_image(
-                file_path, 
-                output_path, 
-                target_size_kb=params.get('target_size_kb'),
-                max_width=params.get('max_width'),
-                to_webp=params.get('to_webp'),
-                quality=params.get('quality', 95),
-                fixed_quality=params.get('fixed_quality', False)
-            )
-            
-            results.append((filename, success, msg, size))
-            
-            if progress_callback:
-                progress_callback(i + 1, total, filename)
-                
-        return results
+        # 4. 解码 -> (并行) 缩放编码 -> 写回，同时在处理中的图片不超过 search_workers * 2 张
+        replaced = 0
+        qualities = []
+        for xref, size, mode, q, buffer, raw_size, share in ordered_map(encode, decode(), self.search_workers):
+            keep = buffer.tell() >= raw_size
+            if share is not None:
+                # 结算: 退回未用完的预算 (或扣除超出的部分)
+                budget['bytes'] += share - (raw_size if keep else buffer.tell())
+            if keep:
+                continue
+            with result.stage('replace'):
+                doc.update_stream(xref, buffer.getvalue(), compress=False)
+                doc.xref_set_key(xref, 'Filter', '/DCTDecode')
+                doc.xref_set_key(xref, 'Width', str(size[0]))
+                doc.xref_set_key(xref, 'Height', str(size[1]))
+                doc.xref_set_key(xref, 'ColorSpace', '/DeviceGray' if mode == 'L' else '/DeviceRGB')
+                doc.xref_set_key(xref, 'BitsPerComponent', '8')
+                for key in ('DecodeParms', 'Decode'):
+                    doc.xref_set_key(xref, key, 'null')
+            replaced += 1
+            qualities.append(q)
+
+        if qualities:
+            result.quality = min(qualities)
+        return replaced
+
+    def process_queue(self, file_list, output_dir, params, progress_callback=None,
+                      max_workers=None, use_threads=False, cache=None):
+        """
+        兼容旧接口: 批量处理已移到批处理层，新代码请直接使用 batch.process_queue (参数与返回值相同)。
+        压缩器本身不依赖批处理层，这里只在调用时转发
+        """
+        import batch
+        return batch.process_queue(file_list, output_dir, params, progress_callback=progress_callback,
+                                   max_workers=max_workers, use_threads=use_threads, cache=cache)
@@ -0,0 +1,153 @@
+"""
+批处理内的重复文件检测
+
+共享文件夹中常有同一张图片的多个副本 (不同子文件夹、不同文件名)。BatchEngine 开启去重后:
+- 按内容: 读取阶段计算源文件内容的哈希，内容与输出格式都相同的文件只压缩第一个 (leader)，
+  其余文件等 leader 完成后直接复制它的输出
+- 按像素 (可选): 工作进程解码后计算像素哈希，与本批已完成的图片像素相同 (元数据不同的副本) 时，
+  跳过缩放和质量搜索，同样复制已完成的输出。像素索引保存在临时目录中，多个工作进程共享
+输出的复制方式可选 copy (普通复制) / hardlink (硬链接) / reflink (写时复制，Linux Btrfs / XFS 等)，
+不支持时退回普通复制。
+"""
+import os
+import json
+import shutil
+import hashlib
+
+from pipeline import atomic_output
+
+# 去重方式: bytes 按文件内容，pixels 另外按解码后的像素
+DEDUP_MODES = ('bytes', 'pixels')
+
+# 重复文件输出的复制方式
+LINK_METHODS = ('copy', 'hardlink', 'reflink')
+
+# Linux ioctl FICLONE (见 <linux/fs.h>)
+FICLONE = 0x40049409
+
+# 计算像素哈希时每次取出的像素数 (按行分条，不复制整张图片)
+PIXEL_HASH_CHUNK = 1024 * 1024
+
+
+def _reflink(src, dst):
+    import fcntl
+
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+
+
+def link_output(src, dst, method='copy'):
+    """
+    把已完成的输出 src 复制为 dst (原子替换)
+    :param method: copy / hardlink / reflink，后两者失败时 (跨文件系统、不支持等) 退回普通复制
+    :return: 实际使用的方式
+    """
+    if os.path.normpath(src) == os.path.normpath(dst):
+        return method
+    with atomic_output(dst) as tmp_path:
+        if method == 'hardlink':
+            try:
+                os.link(src, tmp_path)
+                return method
+            except OSError:
+                pass
+        elif method == 'reflink':
+            try:
+                _reflink(src, tmp_path)
+                return method
+            except (OSError, ImportError):
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        shutil.copyfile(src, tmp_path)
+    return 'copy'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """计算文件内容的 SHA-256 (分块读取，不解码图片)"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def data_digest(data):
+    """计算内存中数据 (bytes / memoryview) 的 SHA-256"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def pixel_digest(img):
+    """解码后图片的像素哈希 (包括模式、尺寸、调色板与透明色)"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{img.mode}:{img.size}:{img.info.get('transparency')}".encode('utf-8'))
+    if img.mode == 'P':
+        h.update(bytes(img.getpalette('RGBA') or b''))
+    rows = max(1, PIXEL_HASH_CHUNK // max(1, img.width))
+    for y in range(0, img.height, rows):
+        h.update(img.crop((0, y, img.width, min(img.height, y + rows))).tobytes())
+    return h.hexdigest()
+
+
+class PixelIndex:
+    """
+    本批已完成图片的像素索引: 像素哈希 -> leader 的源文件与输出路径
+    每个条目是临时目录中的一个小文件 (写入后原子替换)，进程池的工作进程也能读取。对象本身只保存目录路径
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def key(self, img, save_format):
+        return f"{save_format}-{pixel_digest(img)}"
+
+    def lookup(self, key):
+        """已完成的同像素图片 {'file', 'output'}，没有时返回 None"""
+        try:
+            with open(os.path.join(self.directory, key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def publish(self, key, file_path, output_path):
+        """登记已写出的结果 (在输出写出完成后调用)"""
+        data = json.dumps({'file': file_path, 'output': output_path}, ensure_ascii=False)
+        with atomic_output(os.path.join(self.directory, key)) as tmp_path:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+
+
+class DedupStats:
+    """
+    去重节省的工作量 (只在调用 BatchEngine.run 的线程中更新)
+    - files / pixel_files: 重复文件数，其中按像素判断的文件数
+    - source_bytes: 重复文件的源文件大小之和 (按内容判断的重复文件不再解码)
+    - linked_bytes: 以硬链接 / reflink 复制的输出大小之和 (节省的磁盘空间)
+    - saved_ms: 省去的压缩耗时 (内容相同的文件的压缩耗时减去复制耗时)
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.pixel_files = 0
+        self.source_bytes = 0
+        self.linked_bytes = 0
+        self.saved_ms = 0.0
+
+    def add(self, result, source_bytes, leader_ms):
+        duplicate = result['duplicate']
+        self.files += 1
+        if duplicate['pixels']:
+            self.pixel_files += 1
+        else:
+            self.source_bytes += source_bytes
+        if duplicate['link'] != 'copy':
+            self.linked_bytes += round(result['size_kb'] * 1024)
+        self.saved_ms += max(0.0, leader_ms - result['elapsed_ms'])
+
+    def snapshot(self):
+        return {
+            'files': self.files,
+            'pixel_files': self.pixel_files,
+            'source_bytes': self.source_bytes,
+            'linked_bytes': self.linked_bytes,
+            'saved_ms': round(self.saved_ms, 1),
+        }
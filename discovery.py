@@ -0,0 +1,77 @@
+"""
+流式发现待处理的文件
+
+拖入的文件夹可能包含几十万个目录项 (网络存储上 os.walk 全部走完要几分钟)。
+FileDiscovery 边扫描边产出匹配的文件，直接作为 BatchEngine.run 的输入，第一个文件找到后即可开始压缩。
+"""
+import os
+
+# 支持的文件类型 (GUI / 命令行 / 监视模式共用)
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff', '.jfif', '.gif', '.pdf')
+
+
+class FileDiscovery:
+    """
+    遍历文件 / 文件夹，逐个产出支持的文件 (只能迭代一次)
+    - 使用 os.scandir: 目录项自带文件类型，不需要逐个 stat
+    - 扩展名按预先计算的集合判断
+    - 按路径去重 (增量进行，不需要最后再遍历一遍列表)
+    - 顺序与 os.walk 相同: 先产出文件夹中的文件，再依次进入子文件夹；无法读取的文件夹跳过
+    discovered / finished 可在其它线程中读取，用于显示 "已发现 / 已完成" 进度
+    """
+
+    def __init__(self, paths, extensions=SUPPORTED_EXTENSIONS):
+        """
+        :param paths: 文件或文件夹路径列表
+        :param extensions: 支持的扩展名 (含点)
+        """
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.extensions = frozenset(e.lower() for e in extensions)
+        self.discovered = 0     # 已产出的文件数
+        self.finished = False   # 是否已扫描完成
+        self._seen = set()
+
+    def _match(self, name):
+        return os.path.splitext(name)[1].lower() in self.extensions
+
+    def _new(self, path):
+        """去重并计数，返回是否为新文件"""
+        if path in self._seen:
+            return False
+        self._seen.add(path)
+        self.discovered += 1
+        return True
+
+    def _walk(self, top):
+        stack = [top]
+        while stack:
+            directory = stack.pop()
+            try:
+                it = os.scandir(directory)
+            except OSError:
+                continue
+
+            subdirs = []
+            with it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        # 与 os.walk 默认行为一致: 不进入符号链接指向的文件夹
+                        if not entry.is_symlink():
+                            subdirs.append(entry.path)
+                    elif self._match(entry.name) and self._new(entry.path):
+                        yield entry.path
+            stack.extend(reversed(subdirs))
+
+    def __iter__(self):
+        for p in self.paths:
+            p = os.path.normpath(p)
+            if os.path.isfile(p):
+                if self._match(p) and self._new(p):
+                    yield p
+            elif os.path.isdir(p):
+                yield from self._walk(p)
+        self.finished = True
@@ -0,0 +1,19 @@
+"""
+输出格式规则
+
+源文件扩展名与输出扩展名的对应关系，由批处理 (batch) 的输出路径命名与 ImageCompressor.compress_bytes 共用。
+本模块不依赖其它模块，压缩器与批处理层都可以直接导入。
+"""
+
+
+def output_extension(ext, params):
+    """源文件扩展名 (含点) -> 输出扩展名"""
+    ext = ext.lower()
+    if ext == '.pdf':
+        return '.pdf' # PDF 不转 WebP
+    if params.get('to_webp'):
+        return '.webp'
+    if ext in ('.gif', '.png', '.webp'):
+        return ext
+    # BMP / TIFF / JPEG 等统一输出为 JPG
+    return '.jpg'
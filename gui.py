@@ -1,9 +1,14 @@
 import os
 import threading
+import multiprocessing
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from tkinterdnd2 import DND_FILES, TkinterDnD
 from compressor import ImageCompressor
+from batch import BatchEngine
+from cache import ResultCache
+from discovery import FileDiscovery
+from journal import BatchJournal, default_journal_path
 
 # --- 配置 ---
 FONT_MAIN = ('SimSun', 10)
@@ -12,16 +17,21 @@ FONT_LARGE = ('SimSun', 12, 'bold')
 COLOR_BG = "#f0f0f0"
 COLOR_ACCENT = "#4a90e2"
 
+# 编码强度选项 -> 预设名 (见 compressor.EFFORT_PRESETS)
+EFFORT_LABELS = {"快速": 'fast', "均衡": 'balanced', "最高": 'max'}
+
 class CompressionToolApp(TkinterDnD.Tk):
     def __init__(self):
         super().__init__()
         
         self.title("图片极限压缩工具 v1.0")
-        self.geometry("400x500")
+        self.geometry("400x540")
         self.configure(bg=COLOR_BG)
 
         self.compressor = ImageCompressor()
         self.files_to_process = []
+        self.discovery = FileDiscovery([])
+        self.cached_count = 0
         
         self._init_ui()
         
@@ -76,7 +86,7 @@ class CompressionToolApp(TkinterDnD.Tk):
         self.ctrl_frame.pack(fill='x', padx=10, pady=5)
         
         # 3.2 填充模式选择
-        self.var_mode = tk.StringVar(value="auto") # auto (KB) or fixed (Quality)
+        self.var_mode = tk.StringVar(value="auto") # auto (KB) / fixed (Quality) / ssim (画质)
         
         rb_auto = tk.Radiobutton(mode_frame, text="智能模式 (指定大小)", variable=self.var_mode, value="auto", command=self.update_mode_ui, bg=COLOR_BG, font=FONT_MAIN)
         rb_auto.pack(side='left')
@@ -84,6 +94,9 @@ class CompressionToolApp(TkinterDnD.Tk):
         rb_fixed = tk.Radiobutton(mode_frame, text="固定质量 (指定比例)", variable=self.var_mode, value="fixed", command=self.update_mode_ui, bg=COLOR_BG, font=FONT_MAIN)
         rb_fixed.pack(side='left', padx=10)
 
+        rb_ssim = tk.Radiobutton(mode_frame, text="画质模式 (指定 SSIM)", variable=self.var_mode, value="ssim", command=self.update_mode_ui, bg=COLOR_BG, font=FONT_MAIN)
+        rb_ssim.pack(side='left')
+
         # 3.3 初始化滑块
         self.update_mode_ui()
 
@@ -100,6 +113,12 @@ class CompressionToolApp(TkinterDnD.Tk):
         self.combo_width.pack(side='left', padx=5)
         tk.Label(row2, text="px", font=FONT_MAIN, bg=COLOR_BG).pack(side='left')
 
+        self.var_fast_resize = tk.BooleanVar(value=False)
+        ttk.Checkbutton(row2, text="快速缩放 (大图更快)", variable=self.var_fast_resize).pack(side='left', padx=15)
+
+        self.var_fast_smart = tk.BooleanVar(value=False)
+        ttk.Checkbutton(row2, text="快速智能压缩 (大图预测质量)", variable=self.var_fast_smart).pack(side='left')
+
         # 3.5 格式转换 (WebP)
         row3 = tk.Frame(self.settings_frame, bg=COLOR_BG)
         row3.pack(fill='x', padx=10, pady=5)
@@ -111,6 +130,22 @@ class CompressionToolApp(TkinterDnD.Tk):
         self.var_overwrite = tk.BooleanVar(value=False)
         ttk.Checkbutton(row3, text="覆盖源文件", variable=self.var_overwrite).pack(side='left', padx=15)
 
+        # 3.7 结果缓存 (跳过未变化的文件)
+        row4 = tk.Frame(self.settings_frame, bg=COLOR_BG)
+        row4.pack(fill='x', padx=10, pady=5)
+
+        self.var_cache = tk.BooleanVar(value=False)
+        ttk.Checkbutton(row4, text="跳过未变化的文件 (启用结果缓存)", variable=self.var_cache).pack(side='left')
+        # 断点续传与命令行的 --resume 相同，默认关闭 (每个文件都要写入日志)
+        self.var_resume = tk.BooleanVar(value=False)
+        ttk.Checkbutton(row4, text="断点续传", variable=self.var_resume).pack(side='left', padx=(15, 0))
+
+        # 3.8 编码强度 (速度与体积的取舍)
+        tk.Label(row4, text="编码强度:", font=FONT_MAIN, bg=COLOR_BG).pack(side='left', padx=(15, 0))
+        self.combo_effort = ttk.Combobox(row4, values=list(EFFORT_LABELS), width=6, state='readonly')
+        self.combo_effort.set("均衡")
+        self.combo_effort.pack(side='left', padx=5)
+
         # 4. 底部状态与按钮
         bottom_frame = tk.Frame(self, bg=COLOR_BG, pady=10)
         bottom_frame.pack(fill='x', side='bottom')
@@ -141,6 +176,20 @@ class CompressionToolApp(TkinterDnD.Tk):
             self.lbl_val = tk.Label(self.ctrl_frame, text=f"{self.var_kb.get()} KB", font=FONT_BOLD, bg=COLOR_BG, width=8)
             self.lbl_val.pack(side='left')
             
+        elif mode == "ssim":
+            # SSIM 以千分数表示 (900 -> 0.900)，越高画质越接近原图
+            tk.Label(self.ctrl_frame, text="目标画质 (SSIM):", font=FONT_MAIN, bg=COLOR_BG).pack(side='left')
+
+            if not hasattr(self, 'var_ssim'):
+                self.var_ssim = tk.IntVar(value=980)
+
+            scale = ttk.Scale(self.ctrl_frame, from_=900, to=995, orient='horizontal', variable=self.var_ssim,
+                              command=lambda v: self.lbl_val.config(text=f"{int(float(v)) / 1000:.3f}"))
+            scale.pack(side='left', fill='x', expand=True, padx=10)
+
+            self.lbl_val = tk.Label(self.ctrl_frame, text=f"{self.var_ssim.get() / 1000:.3f}", font=FONT_BOLD, bg=COLOR_BG, width=8)
+            self.lbl_val.pack(side='left')
+
         else: # fixed quality
             tk.Label(self.ctrl_frame, text="压缩质量(比例):", font=FONT_MAIN, bg=COLOR_BG).pack(side='left')
             
@@ -183,45 +232,32 @@ class CompressionToolApp(TkinterDnD.Tk):
             return raw_data.split()
 
     def process_files(self, paths):
-        # 1. 收集所有图片文件
-        self.files_to_process = []
-        # 扩展支持的格式
-        supported = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff', '.jfif', '.gif', '.pdf')
-        
         # 确保 paths 是列表
         if isinstance(paths, str):
             paths = [paths]
 
-        for p in paths:
-            # 移除可能存在的引号和处理 Windows 路径
-            p = p.strip().strip('"').strip("'")
-            if not p:
-                continue
-            
-            p = os.path.normpath(p) # 标准化路径
-            
-            if os.path.isfile(p):
-                if p.lower().endswith(supported):
-                    self.files_to_process.append(p)
-            elif os.path.isdir(p):
-                for root, _, files in os.walk(p):
-                    for f in files:
-                        if f.lower().endswith(supported):
-                            full_path = os.path.normpath(os.path.join(root, f))
-                            self.files_to_process.append(full_path)
-                            
-        # 去重
-        self.files_to_process = list(dict.fromkeys(self.files_to_process))
-                            
-        if not self.files_to_process:
-            messagebox.showwarning("提示", "未找到支持的图片文件！")
-            return
-            
+        # 移除可能存在的引号和处理 Windows 路径
+        paths = [p.strip().strip('"').strip("'") for p in paths]
+        paths = [os.path.normpath(p) for p in paths if p]
+
+        # 边扫描边压缩: 文件夹中的图片一找到就开始处理，不等整个目录树遍历完
+        self.discovery = FileDiscovery(paths)
+        if all(os.path.isfile(p) for p in paths):
+            # 只拖入了文件: 数量已知，先确认
+            self.files_to_process = list(self.discovery)
+            if not self.files_to_process:
+                messagebox.showwarning("提示", "未找到支持的图片文件！")
+                return
+            found = f"找到 {len(self.files_to_process)} 个文件。"
+        else:
+            self.files_to_process = self.discovery
+            found = "将扫描拖入的文件夹，边扫描边压缩其中所有支持的图片。"
+
         msg_dest = "输出目录将在源文件夹下的 '_compressed' 中。"
         if self.var_overwrite.get():
              msg_dest = "⚠️ 注意：将直接覆盖源文件！"
         
-        confirm = messagebox.askyesno("确认", f"找到 {len(self.files_to_process)} 个文件。\n\n是否开始压缩？\n\n{msg_dest}")
+        confirm = messagebox.askyesno("确认", f"{found}\n\n是否开始压缩？\n\n{msg_dest}")
         if confirm:
             self.start_compression_thread()
 
@@ -229,7 +265,7 @@ class CompressionToolApp(TkinterDnD.Tk):
         # 锁定界面
         self.lbl_drop.config(state='disabled', text="🚀 正在处理中，请稍候...")
         self.progress['value'] = 0
-        self.progress['maximum'] = len(self.files_to_process)
+        self.progress['maximum'] = max(1, self.discovery.discovered)
         
         # 获取参数
         mode = self.var_mode.get()
@@ -237,107 +273,83 @@ class CompressionToolApp(TkinterDnD.Tk):
             'target_size_kb': self.var_kb.get() if mode == 'auto' else None,
             'quality': self.var_quality.get() if mode == 'fixed' else 95,
             'fixed_quality': (mode == 'fixed'),
+            'target_ssim': int(self.var_ssim.get()) / 1000 if mode == 'ssim' else None,
             'max_width': int(self.combo_width.get()) if self.var_resize.get() else None,
+            'resample': 'fast' if self.var_fast_resize.get() else 'exact',
+            'smart_search': 'fast' if self.var_fast_smart.get() else 'exact',
             'to_webp': self.var_webp.get(),
-            'overwrite': self.var_overwrite.get()
+            'overwrite': self.var_overwrite.get(),
+            'effort': EFFORT_LABELS[self.combo_effort.get()],
+            'use_cache': self.var_cache.get()
         }
         
         # 开启线程
-        t = threading.Thread(target=self.run_process, args=(params,))
+        t = threading.Thread(target=self.run_process, args=(params, self.var_resume.get()))
         t.start()
         
-    def run_process(self, params):
+    def run_process(self, params, resume=False):
         success_count = 0
-        
-        for i, file_path in enumerate(self.files_to_process):
-            src_dir = os.path.dirname(file_path)
-            out_dir = os.path.join(src_dir, "_compressed")
-            
-            # 回调更新进度
-            self.update_progress(i, len(self.files_to_process), os.path.basename(file_path))
-            
-            try:
-                # 覆盖逻辑判断
-                overwrite = params.get('overwrite', False)
-                if overwrite:
-                    out_dir = src_dir
-                else:
-                    if not os.path.exists(out_dir):
-                        os.makedirs(out_dir)
-                
-                name, ext = os.path.splitext(os.path.basename(file_path))
-                
-                # 保留原始后缀逻辑 (针对 PDF)
-                is_pdf = (ext.lower() == '.pdf')
-                is_gif = (ext.lower() == '.gif')
-                
-                if params['to_webp'] and not is_pdf: # PDF 不转 WebP
-                    out_name = f"{name}.webp"
-                elif is_gif and not params['to_webp']:
-                     out_name = f"{name}.gif"
-                elif is_pdf:
-                     out_name = f"{name}.pdf"
-                elif ext.lower() == '.png':
-                     out_name = f"{name}.png"
-                elif ext.lower() == '.webp':
-                     out_name = f"{name}.webp"
-                else:
-                    out_name = f"{name}.jpg"
-                
-                out_path = os.path.join(out_dir, out_name)
-                
-                # 处理覆盖时的文件占用问题
-                is_same_file = (os.path.normpath(file_path) == os.path.normpath(out_path))
-                temp_path = None
-                
-                if is_same_file:
-                    temp_path = out_path + ".tmp"
-                    target_path = temp_path
-                else:
-                    target_path = out_path
-                
-                ok, msg, size = self.compressor.compress_image(
-                    file_path, target_path, 
-                    target_size_kb=params.get('target_size_kb'),
-                    max_width=params.get('max_width'),
-                    to_webp=params.get('to_webp'),
-                    quality=params.get('quality'),
-                    fixed_quality=params.get('fixed_quality')
-                )
-                
-                if ok:
-                    if is_same_file and temp_path:
-                        # 压缩成功后替换原文件
-                        try:
-                            if os.path.exists(out_path):
-                                os.remove(out_path)
-                            os.rename(temp_path, out_path)
-                        except Exception as e:
-                            print(f"Error replacing file {out_path}: {e}")
-                            msg = f"Error replacing: {e}"
-                            ok = False
-                    
+        self.cached_count = 0
+        cache = ResultCache() if params.get('use_cache') else None
+        # 内容相同的文件只压缩一次，其余复制其输出
+        engine = BatchEngine(cache=cache, dedup='bytes')
+        # 任务日志 (断点续传): 程序崩溃或重启后再次拖入相同的文件 / 文件夹 (相同设置) 时，跳过已完成的文件
+        journal = BatchJournal(default_journal_path(self.discovery.paths, params), params) if resume else None
+
+        try:
+            for result in engine.run(self.files_to_process, params, progress_callback=self.update_progress,
+                                     journal=journal):
+                if result['success']:
                     success_count += 1
-                
-            except Exception as e:
-                print(f"Error processing {file_path}: {e}")
-                
-        self.update_progress(len(self.files_to_process), len(self.files_to_process), "完成")
+                    if result['cached'] or result['resumed']:
+                        self.cached_count += 1
+                else:
+                    print(f"Error processing {result['file']}: {result['message']}")
+            if journal:
+                journal.close(finished=True)
+        finally:
+            if journal:
+                journal.close()
+
+        if cache:
+            print(f"Cache stats: {cache.stats()}")
+        if engine.dedup_stats.files:
+            print(f"Dedup stats: {engine.dedup_stats.snapshot()}")
+
+        total = self.discovery.discovered
+        if total == 0:
+            self.after(0, self._show_not_found)
+            return
+        self.update_progress(total, total, "完成")
         self.completed(success_count)
 
     def update_progress(self, current, total, filename):
         self.after(0, lambda: self._update_ui_progress(current, total, filename))
         
     def _update_ui_progress(self, current, total, filename):
+        discovered = self.discovery.discovered
+        self.progress['maximum'] = max(1, discovered)
         self.progress['value'] = current
-        self.lbl_status.config(text=f"正在处理 ({current}/{total}): {filename}")
+        if total is None and not self.discovery.finished:
+            # 仍在扫描，总数未知
+            self.lbl_status.config(text=f"正在处理 (已完成 {current} / 已发现 {discovered}，扫描中...): {filename}")
+        else:
+            self.lbl_status.config(text=f"正在处理 ({current}/{discovered}): {filename}")
+
+    def _show_not_found(self):
+        self.lbl_drop.config(state='normal', text="👇 请将图片或文件夹拖入此处 👇\n\n(支持 JPG, PNG, WebP, GIF, PDF)")
+        self.lbl_status.config(text="准备就绪")
+        messagebox.showwarning("提示", "未找到支持的图片文件！")
 
     def completed(self, count):
         self.after(0, lambda: self._show_complete(count))
 
     def _show_complete(self, count):
         self.lbl_drop.config(state='normal', text="👇 请将图片或文件夹拖入此处 👇\n\n(支持 JPG, PNG, WebP, GIF, PDF)")
-        self.lbl_status.config(text=f"处理完成！成功压缩 {count} 个文件。")
+        status = f"处理完成！成功压缩 {count} 个文件。"
+        if self.cached_count:
+            status = f"处理完成！成功压缩 {count} 个文件 (其中 {self.cached_count} 个未变化或上次已完成，已跳过)。"
+        self.lbl_status.config(text=status)
         
         msg_dest = "文件已保存至各源文件夹下的 '_compressed' 目录中。"
         if self.var_overwrite.get():
@@ -346,6 +358,8 @@ class CompressionToolApp(TkinterDnD.Tk):
         messagebox.showinfo("完成", f"已完成！\n成功: {count}\n\n{msg_dest}")
 
 if __name__ == "__main__":
+    # 打包为 EXE 后使用进程池需要此调用
+    multiprocessing.freeze_support()
     try:
         app = CompressionToolApp()
         app.mainloop()
@@ -0,0 +1,183 @@
+"""
+批处理任务日志 (断点续传)
+
+几万个文件的批处理中途崩溃或重启后，BatchJournal 记录了哪些文件已经完成:
+- 只追加的 NDJSON 文件: 首行为压缩参数，之后每个文件开始时写一行 begin，完成时写一行 done
+  (状态、输出路径、大小、源文件与输出文件的 (大小, 修改时间))。每行写完即 flush，定期 fsync
+- 重新运行同一批任务时: 输出仍与记录一致的已完成文件直接跳过；开始了但没有完成的文件，
+  删除其残留的临时输出 (*.tmp，写出是否完整无法确认) 后重新压缩
+- 加载时把所有行拼成一个 JSON 数组一次解析 (5 万个文件约 0.5 秒)，最后一行写了一半时忽略
+全部成功后删除日志；有失败的文件时保留，再次运行只重试失败和未完成的文件。
+"""
+import os
+import json
+import glob
+import time
+import hashlib
+
+# 日志的默认目录 (按输入路径与参数区分文件)
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser('~'), '.image_compressor', 'journal')
+
+# 两次 fsync 之间的最长间隔 (秒)。进程崩溃不会丢失已 flush 的记录，断电最多丢失这段时间内的记录
+JOURNAL_SYNC_SECONDS = 5.0
+
+# 不参与比较的参数 (每个任务不同的运行时参数，以及不影响输出的开关如结果缓存)
+VOLATILE_PARAM_KEYS = ('quality_hints', 'use_cache')
+
+
+def _stable_params(params, output_dir=None):
+    """用于比较的参数 (可序列化，键顺序固定)"""
+    stable = {k: v for k, v in params.items() if k not in VOLATILE_PARAM_KEYS}
+    stable['output_dir'] = os.path.abspath(output_dir) if output_dir else None
+    return json.loads(json.dumps(stable, sort_keys=True, default=str))
+
+
+def default_journal_path(paths, params, output_dir=None):
+    """按输入路径 + 参数生成日志路径 (同一批任务重新运行时使用同一个日志)"""
+    key = json.dumps([sorted(os.path.abspath(p) for p in paths), _stable_params(params, output_dir)],
+                     sort_keys=True, ensure_ascii=False)
+    return os.path.join(DEFAULT_JOURNAL_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.ndjson')
+
+
+def _signature(path):
+    """(大小, 修改时间 ns)，文件不存在时返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class BatchJournal:
+    """
+    一批任务的只追加日志 (只在调用 BatchEngine.run 的线程中读写)
+    """
+
+    def __init__(self, path, params, output_dir=None):
+        """
+        :param path: 日志文件路径 (见 default_journal_path)
+        :param params: 压缩参数字典。与日志中记录的参数不同时视为另一批任务，丢弃旧记录
+        :param output_dir: 统一输出目录 (同 BatchEngine.run)
+        """
+        self.path = path
+        self.params = _stable_params(params, output_dir)
+        self.done = {}          # 源文件路径 -> 最后一条 done 记录
+        self.unfinished = {}    # 上次开始了但没有完成的文件: 源文件路径 -> 输出路径
+        self._started = {}      # 本次处理中的文件: 源文件路径 -> 开始时源文件的 (大小, 修改时间)
+        self.failed = 0         # 本次运行失败的文件数
+        self._last_sync = time.monotonic()
+
+        fresh = not self._load()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'w' if fresh else 'a', encoding='utf-8')
+        if fresh:
+            self._append({'type': 'params', 'params': self.params})
+        self._cleanup()
+
+    def _load(self):
+        """读取已有日志，返回是否可以继续 (文件存在且参数相同)"""
+        try:
+            f = open(self.path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            print(f"Journal Error: {e}")
+            return False
+
+        with f:
+            lines = f.read().splitlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return False
+        if header.get('type') != 'params' or header.get('params') != self.params:
+            return False
+
+        try:
+            entries = json.loads('[' + ','.join(lines[1:]) + ']')
+        except ValueError:
+            # 崩溃时写了一半的行: 逐行解析并跳过
+            entries = []
+            for line in lines[1:]:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+
+        for entry in entries:
+            file_path = entry.get('file')
+            if entry.get('type') == 'begin':
+                self.unfinished[file_path] = entry['output']
+            elif entry.get('type') == 'done':
+                self.unfinished.pop(file_path, None)
+                self.done[file_path] = entry
+        return True
+
+    def _cleanup(self):
+        """删除上次未完成的文件残留的临时输出 (原子写出的 *.tmp 与覆盖模式的 .tmp)"""
+        for output_path in self.unfinished.values():
+            for tmp_path in glob.glob(glob.escape(output_path) + '.*tmp'):
+                try:
+                    os.remove(tmp_path)
+                except OSError as e:
+                    print(f"Journal Cleanup Error: {e}")
+
+    def _append(self, entry):
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        now = time.monotonic()
+        if now - self._last_sync >= JOURNAL_SYNC_SECONDS:
+            os.fsync(self._file.fileno())
+            self._last_sync = now
+
+    def completed(self, file_path, output_path):
+        """
+        已完成且输出仍与记录一致时返回该记录，否则返回 None
+        覆盖模式下源文件就是输出，只比较输出；否则源文件变化过也要重新压缩
+        :param output_path: 本次的输出路径，None 表示按记录中的输出路径核对 (如多尺寸输出)
+        """
+        entry = self.done.get(file_path)
+        if not entry or not entry['ok'] or (output_path is not None and entry['output'] != output_path):
+            return None
+        output_path = entry['output']
+        if _signature(output_path) != entry['out_sig']:
+            return None
+        if os.path.normpath(file_path) != os.path.normpath(output_path) and _signature(file_path) != entry['src_sig']:
+            return None
+        return entry
+
+    def begin(self, file_path, output_path):
+        """记录开始处理一个文件 (压缩前的源文件签名在完成时一起写入)"""
+        self._started[file_path] = _signature(file_path)
+        self._append({'type': 'begin', 'file': file_path, 'output': output_path})
+
+    def record(self, result):
+        """记录一个文件的结果 (BatchEngine 产出的结果字典)"""
+        if not result['success']:
+            self.failed += 1
+        self._append({
+            'type': 'done',
+            'file': result['file'],
+            'output': result['output'],
+            'ok': result['success'],
+            'message': result['message'],
+            'size': round(result['size_kb'] * 1024),
+            'src_sig': self._started.pop(result['file'], None),
+            'out_sig': _signature(result['output']) if result['success'] else None,
+        })
+
+    def close(self, finished=False):
+        """
+        关闭日志
+        :param finished: 整批任务已处理完。全部成功时删除日志 (再次运行会重新处理)，否则保留以便只重试失败的文件
+        """
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        if finished and not self.failed:
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                print(f"Journal Error: {e}")
@@ -0,0 +1,103 @@
+"""
+感知质量 (SSIM) 评分
+
+画质模式以 SSIM 作为目标: 寻找与缩放后原图的 SSIM 不低于目标值的最小输出。
+评分在亮度平面上进行，超过 SSIM_MAX_PIXELS 的图片先按 2 的幂倍 BOX 缩小 (相当于按屏幕尺寸观看)，
+JPEG 候选结果解码时即可按 1/2、1/4、1/8 缩小。
+窗口为 8x8、步长 4 (相邻窗口重叠一半): 先用 reshape 求出 4x4 小块的和，每个窗口的和由相邻 2x2 个小块相加得到，
+全部为 NumPy 向量运算，不需要逐像素滑动窗口，评分耗时与一次解码相当。
+参考图的统计量只计算一次，之后每个候选结果只需解码并计算一次。
+"""
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# 评分平面的最大像素数，超过时按 2 的幂倍缩小
+SSIM_MAX_PIXELS = 1024 * 1024
+
+# SSIM 窗口的步长 (窗口边长为其 2 倍)
+SSIM_STEP = 4
+
+# SSIM 的稳定常数 (K1 = 0.01, K2 = 0.03，像素范围 0~255)
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+
+def _luma(img):
+    """亮度平面 (带透明度的图片先合成到白色背景上，与 JPEG 输出的处理方式一致)"""
+    if img.mode == 'P':
+        # 减色结果的透明度保存在 RGBA 调色板中
+        alpha = 'transparency' in img.info or img.palette.mode == 'RGBA'
+        img = img.convert('RGBA' if alpha else 'RGB')
+    if 'A' in img.getbands():
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+    return img.convert('L')
+
+
+def _window_sums(a, step):
+    """a 中所有 2*step 见方、步长 step 的窗口的元素和 (不足一个小块的边缘舍去)"""
+    h, w = a.shape[0] // step * step, a.shape[1] // step * step
+    blocks = a[:h, :w].reshape(h // step, step, w // step, step).sum(axis=(1, 3))
+    return blocks[:-1, :-1] + blocks[1:, :-1] + blocks[:-1, 1:] + blocks[1:, 1:]
+
+
+def _stats(a, step):
+    """窗口均值与方差"""
+    n = 4 * step * step
+    mean = _window_sums(a, step) / n
+    return mean, _window_sums(a * a, step) / n - mean * mean
+
+
+class SsimScorer:
+    """
+    对同一张参考图片的多个候选结果计算 SSIM (可在多个线程中同时调用 score)
+    """
+
+    def __init__(self, reference, max_pixels=SSIM_MAX_PIXELS, step=SSIM_STEP):
+        """
+        :param reference: 参考图片 (缩放、颜色模式转换后、编码前的图片)
+        :param max_pixels: 评分平面的最大像素数
+        :param step: 窗口步长 (窗口边长为 2 * step)
+        """
+        width, height = reference.size
+        self.factor = 1
+        while width * height > max_pixels * self.factor * self.factor:
+            self.factor *= 2
+        # 图片小于窗口时缩小窗口 (至少 1 个窗口)
+        self.step = max(1, min(step, width // self.factor // 2, height // self.factor // 2))
+
+        self.source_size = reference.size
+        self.size = ((width + self.factor - 1) // self.factor, (height + self.factor - 1) // self.factor)
+        self._ref = self._plane(reference)
+        self._mean, self._var = _stats(self._ref, self.step)
+
+    def _plane(self, img):
+        luma = _luma(img)
+        # JPEG 可能已在解码时缩小 (见 score_buffer)，只需再缩小剩余的倍数
+        factor = self.factor * luma.width // self.source_size[0] if luma.width < self.source_size[0] else self.factor
+        if factor > 1:
+            luma = luma.reduce(factor)
+        return np.asarray(luma, dtype=np.float64)
+
+    def score(self, img):
+        """候选图片与参考图片的平均 SSIM (1 表示完全相同)"""
+        b = self._plane(img)
+        mean_b, var_b = _stats(b, self.step)
+        cov = _window_sums(self._ref * b, self.step) / (4 * self.step * self.step) - self._mean * mean_b
+
+        numerator = (2 * self._mean * mean_b + SSIM_C1) * (2 * cov + SSIM_C2)
+        denominator = (self._mean ** 2 + mean_b ** 2 + SSIM_C1) * (self._var + var_b + SSIM_C2)
+        return float(np.mean(numerator / denominator))
+
+    def score_buffer(self, buffer):
+        """解码编码结果 (BytesIO) 后评分"""
+        with Image.open(BytesIO(buffer.getvalue())) as img:
+            if img.format == 'JPEG':
+                # 只解码亮度通道，并在解码时按 1/2、1/4、1/8 缩小 (不超过评分平面的缩小倍数)
+                scale = min(self.factor, 8)
+                img.draft('L', ((self.source_size[0] + scale - 1) // scale, (self.source_size[1] + scale - 1) // scale))
+            img.load()
+            return self.score(img)
@@ -0,0 +1,99 @@
+"""
+批处理的读取 / 写出流水线
+
+网络共享盘上 I/O 等待占总耗时的很大一部分。BatchEngine 把每个文件拆成三个阶段交替进行:
+- 读取: I/O 线程按顺序预读后续文件的内容到内存 (预读数量有限)
+- 压缩: 工作进程 / 线程从内存中的数据解码、编码，结果保存在内存缓冲中
+- 写出: I/O 线程直接从缓冲的 memoryview 写出 (不复制数据)，写入临时文件后原子替换
+各阶段的排队数量由 PipelineStats 记录，用于调整并行数与预读数量。
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+# 默认 I/O 线程数 (读取与写出共用)
+DEFAULT_IO_WORKERS = 4
+
+# 超过该大小的文件不预读，由工作进程直接按路径读取 (如超大 TIFF 需要分条处理)
+PREFETCH_MAX_FILE_BYTES = 64 * 1024 * 1024
+
+# 流水线阶段 (按处理顺序)
+STAGES = ('read', 'ready', 'encode', 'write')
+
+
+@contextmanager
+def atomic_output(path):
+    """
+    原子写出: 产出同目录下的临时文件路径，正常结束后替换为 path，出错时删除临时文件
+    读取方永远不会看到写了一半的输出文件
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_atomic(path, buffer):
+    """
+    把内存缓冲原子写出到文件
+    :param buffer: BytesIO 或 bytes-like，通过 memoryview 写出，不复制数据
+    """
+    view = buffer.getbuffer() if hasattr(buffer, 'getbuffer') else memoryview(buffer)
+    try:
+        with atomic_output(path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(view)
+    finally:
+        view.release()
+
+
+def read_source(file_path, max_bytes=PREFETCH_MAX_FILE_BYTES):
+    """
+    预读文件内容
+    :return: bytes；文件超过 max_bytes 或读取失败时返回 None (由压缩阶段按路径读取并报告错误)
+    """
+    try:
+        if os.path.getsize(file_path) > max_bytes:
+            return None
+        with open(file_path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+class PipelineStats:
+    """
+    各阶段的排队数量 (线程安全)
+    - read: 正在预读的文件
+    - ready: 已读入内存、等待空闲工作进程的文件
+    - encode: 已提交给工作进程 / 线程的文件
+    - write: 等待写出或正在写出的文件
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.depths = {stage: 0 for stage in STAGES}
+        self.max_depths = {stage: 0 for stage in STAGES}
+        self.prefetched_bytes = 0
+
+    def set(self, stage, depth):
+        with self._lock:
+            self.depths[stage] = depth
+            self.max_depths[stage] = max(self.max_depths[stage], depth)
+
+    def add_prefetched(self, size):
+        with self._lock:
+            self.prefetched_bytes += size
+
+    def snapshot(self):
+        """当前与最大排队数量: {'depths': {...}, 'max_depths': {...}, 'prefetched_bytes': n}"""
+        with self._lock:
+            return {
+                'depths': dict(self.depths),
+                'max_depths': dict(self.max_depths),
+                'prefetched_bytes': self.prefetched_bytes,
+            }
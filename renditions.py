@@ -0,0 +1,79 @@
+"""
+多尺寸输出 (响应式图片集)
+
+网页发布需要同一张图片的多个宽度 (如 1920 / 1280 / 800 / 400)，并同时提供 JPEG 与 WebP。
+以前每种组合都要把整批图片重新跑一遍，同一张原图被反复解码。指定 renditions 后 compress_image:
+- 原图只解码一次
+- 各宽度按从大到小级联缩放: 每一档从上一档 (更大的) 结果缩小，而不是每次都从原图缩小
+- 每个宽度只做一次颜色模式转换 (JPEG 与 WebP / PNG 各一份)
+- 每个 宽度 x 格式 组合各自做目标大小搜索，多个组合并发编码
+输出文件名为 <名称>-<宽度>w.<扩展名> (如 photo-800w.webp)，与 srcset 的写法对应。
+原图比指定宽度窄时不放大，按原图宽度输出并命名，多个这样的宽度只输出一个文件。
+GIF / PDF 不适用，仍按普通方式输出一个文件。
+"""
+import os
+
+# 输出格式: 扩展名 -> Pillow 保存格式
+RENDITION_FORMATS = {'.jpg': 'JPEG', '.webp': 'WEBP', '.png': 'PNG'}
+
+# 不做多尺寸输出的输入格式
+SINGLE_OUTPUT_EXTENSIONS = ('.gif', '.pdf')
+
+
+def applies(file_path):
+    """该文件是否按多尺寸输出处理"""
+    return os.path.splitext(file_path)[1].lower() not in SINGLE_OUTPUT_EXTENSIONS
+
+
+def normalize_format(fmt):
+    """'jpg' / '.JPEG' / 'webp' 等 -> 输出扩展名 ('.jpg' / '.webp' / '.png')，None 保持不变"""
+    if fmt is None:
+        return None
+    ext = '.' + fmt.lower().lstrip('.')
+    if ext == '.jpeg':
+        ext = '.jpg'
+    if ext not in RENDITION_FORMATS:
+        raise ValueError(f"Unsupported rendition format: {fmt}")
+    return ext
+
+
+def parse_renditions(widths, formats=None, target_size_kb=None):
+    """
+    命令行参数 -> renditions 列表
+    :param widths: 宽度列表，每项为 "宽度" 或 "宽度:目标KB" (如 "800:120")
+    :param formats: 输出格式列表 (如 ['jpg', 'webp'])，None 表示与普通输出的格式相同
+    :param target_size_kb: 未单独指定目标大小的宽度使用的目标大小
+    :return: [{'width', 'format', 'target_size_kb'}]，按宽度从大到小排列
+    """
+    renditions = []
+    seen = set()
+    for spec in widths:
+        width, _, kb = str(spec).partition(':')
+        width = int(width)
+        if width <= 0:
+            raise ValueError(f"Invalid rendition width: {spec}")
+        kb = int(kb) if kb else target_size_kb
+        for fmt in formats or [None]:
+            ext = normalize_format(fmt)
+            if (width, ext) in seen:
+                continue
+            seen.add((width, ext))
+            renditions.append({'width': width, 'format': ext, 'target_size_kb': kb})
+    return sorted(renditions, key=lambda r: -r['width'])
+
+
+def rendition_path(output_path, rendition):
+    """
+    某个尺寸的输出路径: 普通输出路径加上 -<宽度>w 后缀，扩展名按该尺寸的格式
+    :param output_path: 普通输出路径 (resolve_output_path 的结果，决定目录与默认格式)
+    """
+    stem, ext = os.path.splitext(output_path)
+    return f"{stem}-{rendition['width']}w{rendition.get('format') or ext}"
+
+
+def primary_output(output_path, renditions):
+    """
+    代表整组输出的路径 (请求的最大尺寸)
+    原图比该尺寸窄时实际输出以原图宽度命名 (不放大)，实际路径见压缩结果的 renditions
+    """
+    return rendition_path(output_path, max(renditions, key=lambda r: r['width']))
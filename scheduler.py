@@ -0,0 +1,341 @@
+"""
+按内存预算调度批处理任务
+
+并行处理混合文件夹时，几张超大图片 (如 1 亿像素的 TIFF) 同时解码就可能占满内存、被系统杀掉进程。
+这里在提交任务之前只读取文件头 (Image.open 不调用 load) 估算每个任务的峰值内存，
+只有已提交任务的估算总量不超过预算时才提交新任务；单个任务超出预算时等其它任务全部完成后单独执行。
+待提交的任务按估算内存从大到小排列，大图先开始，避免最后只剩一张大图在慢慢处理。
+"""
+import os
+import heapq
+from io import BytesIO
+
+from PIL import Image
+
+from compressor import RESIZE_MODES, import_pymupdf
+from tiles import can_tile, STRIP_PIXELS, TILED_MIN_PIXELS
+
+# Pillow 内部每像素占用的字节数: 1 / L / P 为 1 字节，I;16 系列为 2 字节，其余 (RGB 也按 4 字节存储) 为 4 字节
+MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'I;16': 2, 'I;16L': 2, 'I;16B': 2, 'I;16N': 2}
+
+# 每个任务的固定开销 (解码器缓冲、编码器状态等)
+JOB_BASE_BYTES = 16 * 1024 * 1024
+
+# 未指定预算时使用物理内存的比例
+DEFAULT_MEMORY_FRACTION = 0.5
+
+# 估算后排队的待提交任务数上限 (在这个窗口内按从大到小排序)
+SCHEDULE_LOOKAHEAD = 256
+
+
+def _mode_bytes(mode):
+    return MODE_BYTES.get(mode, 4)
+
+
+def _score_memory(pixels, params, search_workers):
+    """画质模式的 SSIM 评分: 参考平面 + 每个并发评分的亮度图与 float64 中间数组 (见 perceptual.SsimScorer)"""
+    if not params.get('target_ssim') or params.get('fixed_quality'):
+        return 0
+    from perceptual import SSIM_MAX_PIXELS
+
+    plane = min(pixels, SSIM_MAX_PIXELS)
+    return plane * 8 + search_workers * (pixels + plane * 8 * 4)
+
+
+def _still_memory(img, file_path, out_ext, params, search_workers):
+    """静态图片: 按 _compress_still 的处理步骤估算同时存在的图像副本"""
+    width, height = img.size
+    max_width = params.get('max_width')
+    mode = img.mode
+    has_alpha = mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+    to_png = out_ext == '.png' and not params.get('to_webp')
+
+    tiled = params.get('tiled')
+    if tiled is not False and can_tile(img, file_path, 0 if tiled else TILED_MIN_PIXELS):
+        # 分条处理: 输出图片 + 一条数据的解码 / 缩放 / 转换副本 + 编码缓冲
+        pixels = width * height
+        if max_width and width > max_width:
+            pixels = max_width * max(1, int(height * max_width / width))
+        if to_png:
+            encode = pixels + search_workers * (pixels + pixels * 4 * 3)
+        else:
+            encode = pixels * (1 + search_workers)
+        return pixels * 4 + STRIP_PIXELS * 4 * 5 + encode + _score_memory(pixels, params, search_workers)
+
+    decode_w, decode_h = width, height
+    new_size = None
+    if max_width and width > max_width:
+        new_size = (max_width, max(1, int(height * max_width / width)))
+        if params.get('resample') == 'fast' and img.format == 'JPEG':
+            # draft 解码直接按 1/2、1/4、1/8 缩小
+            scale = 1
+            while scale < 8 and width // (scale * 2) >= max_width:
+                scale *= 2
+            decode_w, decode_h = -(-width // scale), -(-height // scale)
+
+    # 原图在整个压缩过程中都保持打开 (with img)，解码结果一直占用内存
+    decoded = decode_w * decode_h * _mode_bytes(mode)
+    peak = decoded
+    current = 0 # 缩放 / 转换后的当前图片 (与解码结果不是同一份时)
+
+    if new_size:
+        pixels = new_size[0] * new_size[1]
+        # 不可插值的模式先在全分辨率上转换；LANCZOS 分两遍，中间结果为 新宽 x 原高
+        convert = 0
+        if mode not in RESIZE_MODES:
+            convert = decode_w * decode_h * 4
+            mode = 'RGBA' if has_alpha else 'RGB'
+        intermediate = new_size[0] * decode_h * _mode_bytes(mode)
+        current = pixels * _mode_bytes(mode)
+        peak = max(peak, decoded + convert + intermediate + current)
+    else:
+        pixels = decode_w * decode_h
+
+    if params.get('to_webp') or out_ext in ('.png', '.webp'):
+        if mode not in ('RGB', 'RGBA'):
+            peak = max(peak, decoded + current + pixels * 4)
+            current = pixels * 4
+    elif has_alpha:
+        # 透明图转 JPEG: RGBA 副本 + 白色背景 + 合成结果 + RGB 结果
+        peak = max(peak, decoded + current + pixels * 4 * 4)
+        current = pixels * 4
+    elif mode != 'RGB':
+        peak = max(peak, decoded + current + pixels * 4)
+        current = pixels * 4
+
+    # 编码阶段: 搜索过程中保留的编码结果 (最佳 / 兜底 / 当前，并发搜索时每轮 search_workers 份)
+    if to_png:
+        # 256 色量化结果 + 每个并发候选一份减色图片，PNG 缓冲按未压缩大小估算
+        encode = pixels + search_workers * (pixels + pixels * 4 * 3)
+    else:
+        encode = pixels * (1 + search_workers)
+    encode += _score_memory(pixels, params, search_workers)
+    return max(peak, decoded + current + encode)
+
+
+def _renditions_memory(img, params, search_workers):
+    """多尺寸输出: 解码结果 + 各宽度的缩放结果与两种颜色模式的副本 (同时保留到编码结束) + 并发编码的缓冲"""
+    width, height = img.size
+    widths = sorted({min(width, r['width']) for r in params['renditions']}, reverse=True)
+    decoded = width * height * 4
+    levels = sum(w * max(1, int(height * w / width)) for w in widths)
+    largest = widths[0] * max(1, int(height * widths[0] / width))
+    workers = min(len(params['renditions']), search_workers)
+    encode = largest * 4 * workers + _score_memory(largest, params, workers)
+    return decoded + levels * 4 * 2 + encode
+
+
+def _animation_memory(img, params, search_workers):
+    """动图: 逐帧流式处理，同时存在的帧数与并发数有关，不随总帧数增长"""
+    width, height = img.size
+    max_width = params.get('max_width')
+    out_pixels = width * height
+    if max_width and width > max_width:
+        out_pixels = max_width * max(1, int(height * max_width / width))
+
+    # 解码器画布、处理窗口中的帧 (search_workers * 2)、写出时的上一帧与待写出帧
+    window = 2 * search_workers if search_workers > 1 else 1
+    frames = 3 + window
+    memory = (width * height + out_pixels) * 4 * frames
+    if params.get('to_webp'):
+        # WebP 动画编码器保留画布与候选帧
+        memory += out_pixels * 4 * 4
+    return memory
+
+
+def _pdf_memory(file_path, params, search_workers, source=None):
+    """PDF: 文档本身 + 同时解码的内嵌图片 (取最大的一张估算)"""
+    file_size = len(source) if source is not None else os.path.getsize(file_path)
+    # 文档解析与 garbage=4 保存时的对象副本
+    memory = file_size * 3
+    if not (params.get('target_size_kb') or params.get('fixed_quality') or params.get('max_width')):
+        return memory
+
+    fitz = import_pymupdf()
+
+    largest = 0
+    with (fitz.open(stream=source, filetype='pdf') if source is not None else fitz.open(file_path)) as doc:
+        for page in doc:
+            for info in page.get_images(full=True):
+                if info[4] >= 8:
+                    largest = max(largest, info[2] * info[3])
+    # 每张图片: Pixmap + Pillow 图片 + 缩放结果，处理中的图片最多 search_workers * 2 张
+    window = 2 * search_workers if search_workers > 1 else 1
+    return memory + largest * 4 * 3 * window
+
+
+def estimate_memory(file_path, output_path, params, search_workers=1, source=None):
+    """
+    只读取文件头，估算压缩该文件时的峰值内存 (字节)
+    考虑解码结果、颜色模式转换 (RGBA)、透明背景合成、缩放中间结果以及编码缓冲
+    :param output_path: 输出路径 (决定输出格式)
+    :param params: 压缩参数字典
+    :param search_workers: 单个文件内的并发数 (见 BatchEngine)
+    :param source: 已读入内存的文件内容 (bytes，如压缩包成员)，None 表示按路径读取。内存中的数据不能分条处理
+    :return: 估算字节数。文件无法识别时按文件大小估算 (压缩会很快失败)
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    out_ext = os.path.splitext(output_path)[1].lower()
+    if source is not None:
+        params = dict(params, tiled=False)
+
+    try:
+        if ext == '.pdf':
+            memory = _pdf_memory(file_path, params, search_workers, source)
+        else:
+            with Image.open(BytesIO(source) if source is not None else file_path) as img:
+                if ext == '.gif':
+                    memory = _animation_memory(img, params, search_workers)
+                elif params.get('renditions'):
+                    memory = _renditions_memory(img, params, search_workers)
+                else:
+                    memory = _still_memory(img, file_path, out_ext, params, search_workers)
+    except Exception:
+        try:
+            memory = len(source) if source is not None else os.path.getsize(file_path)
+        except OSError:
+            memory = 0
+
+    return JOB_BASE_BYTES + memory
+
+
+def default_memory_budget():
+    """
+    默认内存预算: 物理内存的 DEFAULT_MEMORY_FRACTION
+    :return: 字节数，无法获取物理内存时为 None (不限制)
+    """
+    total = None
+    try:
+        total = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        pass
+
+    if total is None and os.name == 'nt':
+        try:
+            import ctypes
+
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [
+                    ('dwLength', ctypes.c_ulong),
+                    ('dwMemoryLoad', ctypes.c_ulong),
+                    ('ullTotalPhys', ctypes.c_ulonglong),
+                    ('ullAvailPhys', ctypes.c_ulonglong),
+                    ('ullTotalPageFile', ctypes.c_ulonglong),
+                    ('ullAvailPageFile', ctypes.c_ulonglong),
+                    ('ullTotalVirtual', ctypes.c_ulonglong),
+                    ('ullAvailVirtual', ctypes.c_ulonglong),
+                    ('sullAvailExtendedVirtual', ctypes.c_ulonglong),
+                ]
+
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                total = status.ullTotalPhys
+        except Exception:
+            pass
+
+    return int(total * DEFAULT_MEMORY_FRACTION) if total else None
+
+
+class MemoryScheduler:
+    """
+    按内存预算决定下一个提交的任务
+    - 任务估算内存后逐个加入 (add)，最多排队 lookahead 个；排队的任务按从大到小的顺序提交
+    - 不等排满: 只要有任务能提交就立即提交，估算较慢的任务在后台陆续加入
+    - 已提交任务的估算总量加上新任务不超过预算时才提交；没有任务在执行时总是提交 (保证进度)
+    - 最大的任务放不下时，允许较小的任务先填补空闲内存；但被跳过 max_skips 次后不再填补，
+      等内存释放给它 (防止大任务一直等待)。超出预算的任务要等其它任务全部完成后单独执行
+    """
+
+    def __init__(self, budget_bytes, lookahead=SCHEDULE_LOOKAHEAD, max_skips=None):
+        """
+        :param budget_bytes: 内存预算 (字节)
+        :param lookahead: 最多排队的任务数
+        :param max_skips: 最大的任务最多被较小任务插队的次数，None 表示与 lookahead 相同
+        """
+        self.budget = budget_bytes
+        self.lookahead = max(1, lookahead)
+        self.max_skips = lookahead if max_skips is None else max_skips
+        self.in_use = 0     # 已提交任务的估算总量
+        self.running = 0    # 已提交尚未完成的任务数
+        self._heap = []     # (-估算, 序号, 任务)
+        self._seq = 0
+        self._skips = 0
+        self._closed = False
+
+    @property
+    def queued(self):
+        """排队中的任务数"""
+        return len(self._heap)
+
+    @property
+    def full(self):
+        """排队的任务数已达到 lookahead"""
+        return len(self._heap) >= self.lookahead
+
+    def add(self, job, cost):
+        """加入一个已估算内存的任务"""
+        heapq.heappush(self._heap, (-cost, self._seq, job))
+        self._seq += 1
+
+    def close(self):
+        """不再有新任务加入"""
+        self._closed = True
+
+    @property
+    def exhausted(self):
+        """不再有新任务，且所有任务都已提交"""
+        return self._closed and not self._heap
+
+    def fill(self, jobs, estimate):
+        """
+        在当前线程从迭代器逐个取出任务并估算，一旦有任务可以提交就返回 (不等排满)
+        :param jobs: 任务迭代器 (取完后调用 close)
+        :param estimate: 估算函数 estimate(job) -> 字节数
+        :return: 同 next_job
+        """
+        while True:
+            entry = self.next_job()
+            if entry is not None or self._closed or self.full:
+                return entry
+            job = next(jobs, None)
+            if job is None:
+                self.close()
+            else:
+                self.add(job, estimate(job))
+
+    def next_job(self):
+        """
+        取出下一个可以提交的任务
+        :return: (任务, 估算字节数)；没有排队的任务或当前内存不足以提交任何任务时返回 None
+        """
+        if not self._heap:
+            return None
+
+        free = self.budget - self.in_use
+        head_cost = -self._heap[0][0]
+        if self.running == 0 or head_cost <= free:
+            entry = heapq.heappop(self._heap)
+            self._skips = 0
+        elif head_cost > self.budget or self._skips >= self.max_skips:
+            # 等待正在执行的任务释放内存
+            return None
+        else:
+            # 能放下的最大任务插队
+            fits = [e for e in self._heap if -e[0] <= free]
+            if not fits:
+                return None
+            entry = min(fits)
+            self._heap.remove(entry)
+            heapq.heapify(self._heap)
+            self._skips += 1
+
+        cost = -entry[0]
+        self.in_use += cost
+        self.running += 1
+        return entry[2], cost
+
+    def release(self, cost):
+        """任务完成，释放其估算内存"""
+        self.in_use -= cost
+        self.running -= 1
@@ -0,0 +1,515 @@
+import math
+
+# QualityPrior 每个分组保留的最近质量数 (取中位数作为预测)
+PRIOR_HISTORY = 8
+
+# 经验值: 在量化缩放轴上 (见 _scale_axis)，JPEG/WebP 输出体积的对数近似线性，斜率约 0.6
+DEFAULT_LOG_SLOPE = 0.6
+
+# 经验值: 在同一轴上 log(1 - SSIM) 也近似线性，斜率约 -1.0 (画质模式，见 ScoreSearch)
+DEFAULT_SCORE_SLOPE = -1.0
+
+
+def _scale_axis(q):
+    """
+    把 quality 映射到 libjpeg 量化表缩放系数的对数轴 (q<50: 5000/q, 否则 200-2q)。
+    体积的对数在这条轴上比直接对 quality 更接近线性，插值更准。
+    """
+    q = min(max(q, 1), 99)
+    scale = 5000 / q if q < 50 else 200 - 2 * q
+    return -math.log(scale)
+
+
+def _inverse_scale_axis(x):
+    scale = math.exp(-x)
+    if scale > 100:
+        return 5000 / scale
+    return (200 - scale) / 2
+
+
+class QualitySearch:
+    """
+    在 [min_q, max_q] 内寻找体积不超过目标的最大 quality (智能模式)
+
+    利用体积-质量曲线的单调性做插值预测 (对数体积上的局部割线法)，多数图片 3 次左右编码即可命中 (二分约需 7 次)。
+    搜索过程中始终维护区间 (lo 可行, hi 不可行)，直到 hi == lo + 1 才结束，
+    因此在体积随质量单调的前提下，结果与二分得到的 "目标以内的最大质量" 完全一致。
+    插值连续两次收缩不足一半时退回二分，最坏情况仍为 O(log n) 次编码。
+
+    提供 executor 且 width > 1 时每轮同时编码 width 个质量 (单张大图的延迟约为 2~3 次编码):
+    首轮为 max_q 与区间内均匀分布的点；之后围绕插值预测点两侧取点，预测准确时一轮即可把区间收缩到 1；
+    某轮收缩不足一半时改为均匀分布 (k 分搜索)。区间的维护方式不变，结果与逐个搜索相同。
+
+    提供预测质量 hint (如同一批中相似图片的结果) 时从 hint 而不是 max_q 开始: 未确认的一侧以 max_q + 1 / min_q - 1
+    为虚拟端点，之后照常插值收缩 (未命中时按经验斜率外推，区间向该侧放宽)。hint 准确时 2 次编码即可结束。
+    """
+
+    def __init__(self, encode, target_size_bytes, min_q=5, max_q=95, executor=None, width=1, hint=None):
+        """
+        :param encode: 编码函数 encode(quality) -> BytesIO (写入位置即数据大小)，并发时会在多个线程中调用
+        :param target_size_bytes: 目标大小 (字节)
+        :param min_q: 允许的最低质量
+        :param max_q: 允许的最高质量 (首次尝试)
+        :param executor: 并发编码使用的线程池，None 表示逐个编码
+        :param width: 每轮同时尝试的质量数
+        :param hint: 预测的质量，None 表示从 max_q 开始
+        """
+        self.encode = encode
+        self.target = target_size_bytes
+        self.min_q = min_q
+        self.max_q = max(min_q, max_q)
+        self.executor = executor
+        self.width = max(1, width) if executor is not None else 1
+        self.hint = hint
+        self.sizes = {}     # quality -> 编码大小
+        self.attempts = 0   # 实际编码次数
+        self.rounds = 0     # 编码轮数 (逐个搜索时与 attempts 相同)
+
+        self.best_quality = None
+        self.best_buffer = None
+        # 最低质量仍超出目标时使用的结果
+        self._fallback_quality = None
+        self._fallback_buffer = None
+
+    def probe(self, q):
+        """以质量 q 编码一次，记录结果，返回是否满足目标"""
+        self.rounds += 1
+        return self._record(q, self.encode(q))
+
+    def _probe_many(self, qualities):
+        """并发编码一轮，返回 [(quality, 是否满足目标), ...]"""
+        self.rounds += 1
+        buffers = list(self.executor.map(self.encode, qualities))
+        return [(q, self._record(q, buf)) for q, buf in zip(qualities, buffers)]
+
+    def _record(self, q, buf):
+        size = buf.tell()
+        self.attempts += 1
+        self.sizes[q] = size
+
+        if size <= self.target:
+            if self.best_quality is None or q > self.best_quality:
+                self.best_quality = q
+                self.best_buffer = buf
+            return True
+
+        if self._fallback_quality is None or q < self._fallback_quality:
+            self._fallback_quality = q
+            self._fallback_buffer = buf
+        return False
+
+    def _result(self):
+        if self.best_quality is not None:
+            return self.best_quality, self.best_buffer
+        return None, self._fallback_buffer
+
+    def _log_size(self, q):
+        return math.log(max(self.sizes[q], 1))
+
+    def _estimate(self, lo, hi):
+        """预测体积恰好等于目标时的 quality (浮点)"""
+        log_target = math.log(max(self.target, 1))
+
+        # 取体积最接近目标的两个已测点做局部割线 (曲线是凸的，区间端点连线会持续低估)
+        nearest = sorted(self.sizes, key=lambda q: abs(self._log_size(q) - log_target))
+        if len(nearest) >= 2:
+            a, b = nearest[0], nearest[1]
+            xa, xb = _scale_axis(a), _scale_axis(b)
+            slope = (self._log_size(b) - self._log_size(a)) / (xb - xa)
+            if slope > 0:
+                return _inverse_scale_axis(xa + (log_target - self._log_size(a)) / slope)
+            return (lo + hi) / 2
+
+        # 只有一个测量点: 使用经验斜率外推
+        q = nearest[0]
+        return _inverse_scale_axis(_scale_axis(q) - (self._log_size(q) - log_target) / DEFAULT_LOG_SLOPE)
+
+    def _spread(self, lo, hi, k):
+        """区间 (lo, hi) 内均匀分布的 k 个点"""
+        span = hi - lo
+        if span - 1 <= k:
+            return list(range(lo + 1, hi))
+        return [lo + span * (j + 1) // (k + 1) for j in range(k)]
+
+    def _around(self, lo, hi, k):
+        """插值预测点及其两侧相邻的点 (共 k 个，限制在区间 (lo, hi) 内)"""
+        q = min(max(int(math.floor(self._estimate(lo, hi))), lo + 1), hi - 1)
+        points = [q]
+        d = 1
+        while len(points) < min(k, hi - lo - 1):
+            for c in (q + d, q - d):
+                if lo < c < hi and len(points) < k:
+                    points.append(c)
+            d += 1
+        return sorted(points)
+
+    def _run_parallel(self, lo, hi):
+        if hi is None:
+            # 首轮: max_q 与区间内均匀分布的点
+            hi = self.max_q
+            qualities = [self.max_q] + self._spread(lo, hi, self.width - 1)
+        else:
+            qualities = self._around(lo, hi, self.width)
+
+        while True:
+            results = self._probe_many(qualities)
+            width = hi - lo
+            lo = max([lo] + [q for q, ok in results if ok and q < hi])
+            hi = min([hi] + [q for q, ok in results if not ok and q > lo])
+            if lo >= self.max_q or hi - lo <= 1:
+                break
+            # 收缩不足一半说明预测不准，下一轮均匀取点
+            spread = (hi - lo) * 2 > width
+            qualities = self._spread(lo, hi, self.width) if spread else self._around(lo, hi, self.width)
+
+        return self._result()
+
+    def _bracket_hint(self, hint):
+        """尝试预测质量 (并发时同时尝试两侧相邻的质量)，返回 (lo 可行, hi 不可行)。max_q + 1 / min_q - 1 为虚拟端点"""
+        lo, hi = self.min_q - 1, self.max_q + 1
+        if self.width > 1:
+            # 并发: 一轮尝试预测点及两侧的质量
+            points = [hint]
+            d = 1
+            while len(points) < self.width and d <= self.max_q - self.min_q:
+                points += [c for c in (hint + d, hint - d) if self.min_q <= c <= self.max_q]
+                d += 1
+            results = self._probe_many(sorted(points[:self.width]))
+        else:
+            results = [(hint, self.probe(hint))]
+        lo = max([lo] + [q for q, ok in results if ok])
+        hi = min([hi] + [q for q, ok in results if not ok and q > lo])
+        return lo, hi
+
+    def run(self, lo=None, hi=None):
+        """
+        执行搜索
+        :param lo: 已知可行的质量 (已用 probe 编码过)，None 表示 min_q - 1 (虚拟端点)
+        :param hi: 已知不可行的质量 (已用 probe 编码过)，max_q + 1 为虚拟端点 (max_q 未确认)，None 表示先尝试 max_q
+        :return: (quality, buffer)。quality 为 None 表示最低质量仍超出目标，此时 buffer 为最低质量的编码结果
+        """
+        if lo is None and hi is None and self.hint is not None and self.min_q <= self.hint < self.max_q:
+            lo, hi = self._bracket_hint(self.hint)
+
+        # lo: 已知可行 (min_q - 1 为虚拟端点)，hi: 已知不可行
+        lo = self.min_q - 1 if lo is None else lo
+        if hi is not None and hi - lo <= 1:
+            return self._result()
+        if self.width > 1 and self.max_q > lo + 1:
+            return self._run_parallel(lo, hi)
+
+        if hi is None:
+            if lo >= self.max_q or self.probe(self.max_q):
+                return self._result()
+            hi = self.max_q
+        stalls = 0
+
+        while hi - lo > 1:
+            width = hi - lo
+            if stalls >= 2:
+                q = (lo + hi) // 2
+                stalls = 0
+            else:
+                q = int(math.floor(self._estimate(lo, hi)))
+            q = min(max(q, lo + 1), hi - 1)
+
+            if self.probe(q):
+                lo = q
+            else:
+                hi = q
+
+            stalls = stalls + 1 if (hi - lo) * 2 > width else 0
+
+        return self._result()
+
+
+class ScoreSearch(QualitySearch):
+    """
+    在 [min_q, max_q] 内寻找评分 (如 SSIM) 不低于目标的最小 quality (画质模式)
+
+    与 QualitySearch 方向相反: 区间为 (lo 不满足, hi 满足)，min_q - 1 / max_q + 1 为虚拟端点。
+    插值在 log(1 - 评分) 上进行 (在量化缩放轴上近似线性)，起点为预测质量 hint 或区间中点，
+    其余 (插值收缩不足时退回二分 / 均匀取点、并发时每轮尝试 width 个质量) 与 QualitySearch 相同。
+    """
+
+    def __init__(self, encode, score, target_score, min_q=5, max_q=95, executor=None, width=1, hint=None):
+        """
+        :param encode: 编码函数 encode(quality) -> BytesIO，并发时会在多个线程中调用
+        :param score: 评分函数 score(buffer) -> float，越大越好，并发时会在多个线程中调用
+        :param target_score: 目标评分
+        :param min_q / max_q / executor / width / hint: 同 QualitySearch
+        """
+        def measure(q):
+            buf = encode(q)
+            return buf, score(buf)
+
+        super().__init__(measure, None, min_q, max_q, executor, width, hint)
+        self.target_score = target_score
+        self.scores = {}    # quality -> 评分
+
+    def _record(self, q, measured):
+        buf, score = measured
+        self.attempts += 1
+        self.sizes[q] = buf.tell()
+        self.scores[q] = score
+
+        if score >= self.target_score:
+            if self.best_quality is None or q < self.best_quality:
+                self.best_quality = q
+                self.best_buffer = buf
+            return True
+
+        # 最高质量仍未达到目标时使用评分最高的结果
+        if self._fallback_quality is None or score > self.scores[self._fallback_quality]:
+            self._fallback_quality = q
+            self._fallback_buffer = buf
+        return False
+
+    def _log_loss(self, q):
+        return math.log(max(1 - self.scores[q], 1e-9))
+
+    def _estimate(self, lo, hi):
+        """预测评分恰好达到目标的 quality (向上取整，即预测满足目标的最小质量)"""
+        log_target = math.log(max(1 - self.target_score, 1e-9))
+
+        nearest = sorted(self.scores, key=lambda q: abs(self._log_loss(q) - log_target))
+        if len(nearest) >= 2:
+            a, b = nearest[0], nearest[1]
+            xa, xb = _scale_axis(a), _scale_axis(b)
+            slope = (self._log_loss(b) - self._log_loss(a)) / (xb - xa)
+            if slope >= 0:
+                return (lo + hi) / 2
+        else:
+            a, slope = nearest[0], DEFAULT_SCORE_SLOPE
+        return math.ceil(_inverse_scale_axis(_scale_axis(a) + (log_target - self._log_loss(a)) / slope))
+
+    def run(self):
+        """
+        执行搜索
+        :return: (quality, buffer)。quality 为 None 表示最高质量仍未达到目标，此时 buffer 为评分最高的结果
+        """
+        # lo: 已知不满足 (min_q - 1 为虚拟端点)，hi: 已知满足 (max_q + 1 为虚拟端点)
+        lo, hi = self.min_q - 1, self.max_q + 1
+        start = self.hint if self.hint is not None and self.min_q <= self.hint <= self.max_q \
+            else (self.min_q + self.max_q) // 2
+        if self.width > 1:
+            qualities = self._spread(lo, hi, self.width) if self.hint is None else self._near(start, lo, hi)
+        else:
+            qualities = [start]
+        # 逐个搜索时连续 2 次、并发时 1 次收缩不足一半即改为二分 / 均匀取点
+        patience = 2 if self.width == 1 else 1
+        stalls = 0
+
+        while True:
+            results = self._probe_many(qualities) if self.width > 1 else [(qualities[0], self.probe(qualities[0]))]
+            width = hi - lo
+            hi = min([hi] + [q for q, ok in results if ok and q > lo])
+            lo = max([lo] + [q for q, ok in results if not ok and q < hi])
+            if hi - lo <= 1:
+                break
+
+            stalls = stalls + 1 if (hi - lo) * 2 > width else 0
+            if stalls >= patience:
+                stalls = 0
+                qualities = self._spread(lo, hi, self.width)
+            else:
+                qualities = self._around(lo, hi, self.width)
+
+        return self._result()
+
+    def _near(self, q, lo, hi):
+        """q 及其两侧相邻的质量 (共 width 个，限制在区间 (lo, hi) 内)"""
+        points = [q]
+        d = 1
+        while len(points) < min(self.width, hi - lo - 1):
+            points += [c for c in (q + d, q - d) if lo < c < hi][:self.width - len(points)]
+            d += 1
+        return sorted(points)
+
+
+# 快速智能模式: 按代理预测进行的全图编码轮数上限，之后在已确认的区间内退回精确搜索
+PROXY_MAX_ROUNDS = 3
+
+
+class ProxySearch:
+    """
+    快速智能模式: 在代理图片 (原图抽样小块拼成的小图) 上预测质量，全图编码只用于校准和确认
+
+    代理图片与原图的体积比近似为像素比 scale。代理编码很快，直接在代理上用 QualitySearch 找到
+    "代理体积 * 体积比 不超过目标" 的最大质量作为预测，全图编码该质量后用实际体积校准体积比，再预测下一个质量。
+    校准后的预测通常落在目标两侧的相邻质量上，一般 2 次全图编码即可确定结果。
+    PROXY_MAX_ROUNDS 轮后仍未确定则在已确认的区间内退回精确搜索。
+    全图编码全部经由同一个 QualitySearch 记录和维护区间，在体积随质量单调的前提下结果与精确搜索相同。
+    """
+
+    def __init__(self, encode, encode_proxy, scale, target_size_bytes, min_q=5, max_q=95,
+                 executor=None, width=1):
+        """
+        :param encode: 全图编码函数 encode(quality) -> BytesIO
+        :param encode_proxy: 代理图片编码函数 encode_proxy(quality) -> BytesIO
+        :param scale: 原图与代理图片的像素数之比 (初始体积比)
+        :param executor / width: 同 QualitySearch (用于全图编码)
+        """
+        self.full = QualitySearch(encode, target_size_bytes, min_q, max_q, executor, width)
+        self.encode_proxy = encode_proxy
+        self.scale = scale
+        self.target = target_size_bytes
+        self.min_q = min_q
+        self.max_q = self.full.max_q
+        self.proxy_sizes = {}           # quality -> 代理编码大小
+        self.predicted_quality = None   # 首次预测的质量 (未经校准)
+
+    @property
+    def attempts(self):
+        """全图编码次数"""
+        return self.full.attempts
+
+    def _proxy(self, q):
+        if q not in self.proxy_sizes:
+            self.proxy_sizes[q] = self.encode_proxy(q).tell()
+        return _Size(self.proxy_sizes[q])
+
+    def _predict(self, ratio, lo, hi):
+        """代理体积 * ratio 不超过目标的最大质量，限制在区间 (lo, hi) 内"""
+        q, _ = QualitySearch(self._proxy, self.target / ratio, self.min_q, self.max_q).run()
+        q = self.min_q if q is None else q
+        return min(max(q, lo + 1), hi - 1)
+
+    def run(self):
+        """
+        执行搜索
+        :return: 同 QualitySearch.run
+        """
+        full = self.full
+        # hi: 已知不可行的质量，max_q + 1 为虚拟端点 (max_q 本身未确认)
+        lo, hi = self.min_q - 1, self.max_q + 1
+        ratio = self.scale
+
+        for _ in range(PROXY_MAX_ROUNDS):
+            q = self._predict(ratio, lo, hi)
+            if self.predicted_quality is None:
+                self.predicted_quality = q
+
+            if full.width >= 3:
+                # 并发时同一轮确认预测点两侧
+                results = full._probe_many([c for c in (q - 1, q, q + 1) if lo < c < hi])
+            else:
+                results = [(q, full.probe(q))]
+            lo = max([lo] + [c for c, ok in results if ok and c < hi])
+            hi = min([hi] + [c for c, ok in results if not ok and c > lo])
+            if hi - lo <= 1:
+                return full._result()
+
+            # 用实际体积校准体积比 (预测点附近最准)
+            ratio = full.sizes[q] / max(self._proxy(q).tell(), 1)
+
+        return full.run(lo, hi)
+
+
+class QualityPrior:
+    """
+    同一批图片的质量先验: 按分组 (输出格式、尺寸档位、原图每像素比特数档位，见 ImageCompressor.prior_key)
+    记录最近的最终质量，取中位数作为同组下一张图片的预测质量
+    """
+
+    def __init__(self, history=PRIOR_HISTORY):
+        self.history = history
+        self.qualities = {}  # 分组 -> 最近的质量列表
+
+    def observe(self, key, quality):
+        recent = self.qualities.setdefault(key, [])
+        recent.append(quality)
+        del recent[:-self.history]
+
+    def hints(self):
+        """{分组: 预测质量}，可序列化后传给工作进程"""
+        return {key: sorted(recent)[len(recent) // 2] for key, recent in self.qualities.items()}
+
+
+class _Size:
+    """只有大小的编码结果 (代理搜索只关心体积)"""
+
+    def __init__(self, size):
+        self.size = size
+
+    def tell(self):
+        return self.size
+
+
+# PNG 智能模式的候选颜色数 (近似等比递减，256 -> 2)
+PALETTE_STEPS = (256, 192, 128, 96, 64, 48, 32, 24, 16, 12, 8, 6, 4, 2)
+
+
+class PaletteSearch:
+    """
+    在候选颜色数中寻找体积不超过目标的最多颜色数 (PNG 智能模式)
+
+    颜色越少体积越小 (近似单调)，对候选列表做 k 分搜索: 每轮同时尝试 width 个候选，把区间缩小到 1/(width+1)。
+    width=1 时即二分，14 个候选最多 5 次编码 (逐个递减需要 8 次以上)。
+    提供 executor 时同一轮的候选并发编码 (Pillow 编码时会释放 GIL，线程池即可)。
+    提供 accept 时以其代替体积判断 (画质模式: 候选从少到多排列，寻找评分达到目标的最少颜色数)。
+    """
+
+    def __init__(self, encode, target_size_bytes, steps=PALETTE_STEPS, executor=None, width=1, accept=None):
+        """
+        :param encode: 编码函数 encode(colors) -> BytesIO (写入位置即数据大小)，并发时会在多个线程中调用
+        :param target_size_bytes: 目标大小 (字节)
+        :param steps: 候选颜色数，从多到少排列
+        :param executor: 并发编码使用的线程池，None 表示逐个编码
+        :param width: 每轮尝试的候选数
+        :param accept: 可选判断函数 accept(colors, buffer) -> bool，代替 "体积不超过目标"。
+                       需满足: 某个候选满足时，排在其后的候选也都满足
+        """
+        self.encode = encode
+        self.target = target_size_bytes
+        self.accept = accept or (lambda colors, buf: buf.tell() <= self.target)
+        self.steps = tuple(steps)
+        self.executor = executor
+        self.width = max(1, width)
+        self.sizes = {}     # colors -> 编码大小
+        self.attempts = 0   # 尝试的候选数
+
+        self._buffers = {}
+
+    def _probe_many(self, indexes):
+        """编码一轮候选 (按下标)，返回是否满足目标的列表"""
+        colors = [self.steps[i] for i in indexes]
+        if self.executor is not None and len(colors) > 1:
+            buffers = list(self.executor.map(self.encode, colors))
+        else:
+            buffers = [self.encode(c) for c in colors]
+
+        fits = []
+        for c, buf in zip(colors, buffers):
+            self.attempts += 1
+            self.sizes[c] = buf.tell()
+            self._buffers[c] = buf
+            fits.append(self.accept(c, buf))
+        return fits
+
+    def run(self):
+        """
+        执行搜索
+        :return: (colors, buffer)。colors 为 None 表示所有候选都不满足目标，此时 buffer 为体积最小的结果
+        """
+        # 最常见的情况: 第一个候选 (最多颜色) 即满足目标
+        if self._probe_many([0])[0]:
+            return self.steps[0], self._buffers[self.steps[0]]
+
+        # lo: 已知不可行的下标，hi: 已知可行的下标 (len 为虚拟端点)
+        lo, hi = 0, len(self.steps)
+        while hi - lo > 1:
+            span = hi - lo
+            k = min(self.width, span - 1)
+            indexes = sorted({lo + span * (j + 1) // (k + 1) for j in range(k)})
+            for i, ok in zip(indexes, self._probe_many(indexes)):
+                if ok:
+                    hi = i
+                    break
+                lo = i
+
+        if hi < len(self.steps):
+            return self.steps[hi], self._buffers[self.steps[hi]]
+
+        smallest = min(self.sizes, key=self.sizes.get)
+        return None, self._buffers[smallest]
@@ -0,0 +1,399 @@
+"""
+本地 HTTP 压缩服务 (作为上传服务的 sidecar 运行)
+
+请求体为图片内容，响应体为压缩结果，全程在内存中处理 (ImageCompressor.compress_bytes)，不产生临时文件:
+    POST /compress?name=photo.jpg&target_kb=150&max_width=1080&webp=1
+    GET  /stats     已处理请求数、排队情况与延迟分位数 (JSON)
+    GET  /health    存活检查
+
+- 压缩在固定大小的工作池中执行 (默认进程池，--threads 使用线程池)
+- 最多 workers + queue 个请求同时在服务中 (压缩中 + 排队)，超出时立即返回 503 (带 Retry-After)，
+  不读取请求体，调用方据此退避重试，服务本身的内存与延迟不会无限增长
+- /stats 中的延迟为最近 LATENCY_WINDOW 个请求的分位数: latency_ms 为收到请求到写完响应，
+  queue_ms 为等待空闲工作者的时间，compress_ms 为压缩本身的耗时
+
+用法:
+    python -m server --port 8765 --workers 4 --queue 16
+    curl --data-binary @photo.jpg "http://127.0.0.1:8765/compress?name=photo.jpg&target_kb=150" -o out.jpg
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from compressor import EFFORT_PRESETS
+from batch import _init_worker, _get_compressor
+
+DEFAULT_PORT = 8765
+DEFAULT_QUEUE = 16
+
+# 请求体大小上限 (MB)
+DEFAULT_MAX_BODY_MB = 64
+
+# 读取请求头 / 请求体的超时 (秒)，避免慢速连接一直占用线程
+REQUEST_TIMEOUT = 30
+
+# 延迟统计的样本窗口 (最近的请求数) 与报告的分位数
+LATENCY_WINDOW = 1024
+PERCENTILES = (50, 90, 99)
+
+# 服务繁忙时建议的重试间隔 (秒)
+RETRY_AFTER_SECONDS = 1
+
+# 输入的 Content-Type -> 扩展名 (未提供 name 参数时使用)
+CONTENT_TYPES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+    'image/bmp': '.bmp',
+    'image/tiff': '.tiff',
+    'application/pdf': '.pdf',
+}
+
+# 输出格式 -> 响应的 Content-Type
+OUTPUT_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'GIF': 'image/gif',
+    'PDF': 'application/pdf',
+}
+
+
+def compress_request(data, input_format, output_format, options):
+    """
+    工作池中执行的压缩任务
+    :return: (输出内容或 None, CompressionResult.to_dict())
+    """
+    start = time.perf_counter()
+    try:
+        output, result = _get_compressor().compress_bytes(data, input_format, output_format, **options)
+        metrics = result.to_dict()
+    except Exception as e:
+        output, metrics = None, {'success': False, 'message': str(e)}
+    metrics['worker_ms'] = (time.perf_counter() - start) * 1000
+    return output, metrics
+
+
+def percentiles(samples, points=PERCENTILES):
+    """最近邻秩分位数 {'p50': ..., 'max': ...}，没有样本时为 None"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    stats = {f'p{p}': round(ordered[max(0, -(-p * len(ordered) // 100) - 1)], 2) for p in points}
+    stats['max'] = round(ordered[-1], 2)
+    return stats
+
+
+class ServerStats:
+    """请求计数与延迟样本 (多个请求线程同时更新)"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.requests = 0
+        self.ok = 0
+        self.failed = 0
+        self.rejected = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = deque(maxlen=window)
+        self.queue = deque(maxlen=window)
+        self.compress = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def reject(self):
+        with self._lock:
+            self.requests += 1
+            self.rejected += 1
+
+    def record(self, ok, latency_ms, queue_ms, compress_ms, bytes_in, bytes_out):
+        with self._lock:
+            self.requests += 1
+            if ok:
+                self.ok += 1
+            else:
+                self.failed += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.latency.append(latency_ms)
+            self.queue.append(queue_ms)
+            self.compress.append(compress_ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'ok': self.ok,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'latency_ms': percentiles(self.latency),
+                'queue_ms': percentiles(self.queue),
+                'compress_ms': percentiles(self.compress),
+            }
+
+
+def parse_options(query):
+    """
+    查询参数 -> compress_bytes 参数 (与命令行参数对应)
+    :return: (输入格式或 None, 输出格式或 None, 参数字典)
+    :raises ValueError: 参数无效
+    """
+    def get(name, convert=str, default=None):
+        values = query.get(name)
+        return convert(values[-1]) if values else default
+
+    def flag(name):
+        return get(name, str, '0').lower() in ('1', 'true', 'yes', 'on')
+
+    fixed = flag('fixed')
+    target_ssim = get('target_ssim', float)
+    if target_ssim is not None and not 0 < target_ssim < 1:
+        raise ValueError("target_ssim must be between 0 and 1")
+    perceptual = target_ssim is not None and not fixed
+    effort = get('effort', str, 'balanced')
+    if effort not in EFFORT_PRESETS:
+        raise ValueError(f"Unknown effort: {effort}")
+
+    options = {
+        'target_size_kb': None if fixed or perceptual else get('target_kb', int, 150),
+        'target_ssim': target_ssim if perceptual else None,
+        'quality': get('quality', int, 85 if fixed else 95),
+        'fixed_quality': fixed,
+        'max_width': get('max_width', int),
+        'resample': 'fast' if flag('fast_resize') else 'exact',
+        'smart_search': 'fast' if flag('fast_smart') else 'exact',
+        'to_webp': flag('webp'),
+        'effort': effort,
+    }
+    return get('name'), get('format'), options
+
+
+class CompressionService:
+    """
+    压缩工作池 + 准入控制
+    最多 workers 个请求同时压缩，另外最多 queue_size 个请求排队，其余请求由 try_acquire 拒绝
+    """
+
+    def __init__(self, workers=None, queue_size=DEFAULT_QUEUE, use_threads=False):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.queue_size = max(0, queue_size)
+        self.use_threads = use_threads
+        self.stats = ServerStats()
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        if use_threads or self.workers == 1:
+            from concurrent.futures import ThreadPoolExecutor
+            _init_worker()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+
+    def try_acquire(self):
+        """占用一个服务名额，已满时返回 False (调用方返回 503)"""
+        if not self._slots.acquire(blocking=False):
+            return False
+        with self._lock:
+            self._in_flight += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def compress(self, data, input_format, output_format, options):
+        """在工作池中压缩 (阻塞到完成)，返回 (输出内容或 None, 压缩结果字典)"""
+        return self._executor.submit(compress_request, data, input_format, output_format, options).result()
+
+    def snapshot(self):
+        with self._lock:
+            in_flight = self._in_flight
+        stats = self.stats.snapshot()
+        stats.update({
+            'workers': self.workers,
+            'queue_size': self.queue_size,
+            'active': min(in_flight, self.workers),
+            'queued': max(0, in_flight - self.workers),
+        })
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class CompressionHandler(BaseHTTPRequestHandler):
+    server_version = 'ImageCompressor/1.0'
+    protocol_version = 'HTTP/1.1'
+    timeout = REQUEST_TIMEOUT
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        # 访问日志由调用方按需开启 (--verbose)，默认不输出
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, data, headers=None):
+        self._send(status, json.dumps(data, ensure_ascii=False).encode('utf-8'), headers=headers)
+
+    def _error(self, status, message, headers=None):
+        # 出错时不再复用连接 (请求体可能还没有读完)
+        self.close_connection = True
+        self._send_json(status, {'error': message}, dict(headers or {}, Connection='close'))
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/stats':
+            self._send_json(200, self.service.snapshot())
+        elif path == '/health':
+            self._send(200, b'ok', 'text/plain')
+        else:
+            self._error(404, "Not found")
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        if url.path != '/compress':
+            self._error(404, "Not found")
+            return
+
+        try:
+            name, output_format, options = parse_options(parse_qs(url.query))
+        except ValueError as e:
+            self._error(400, f"Invalid parameter: {e}")
+            return
+
+        input_format = name or CONTENT_TYPES.get(self.headers.get('Content-Type', '').split(';')[0].strip())
+        if not input_format:
+            self._error(400, "Unknown input format: pass ?name=<file name> or an image Content-Type")
+            return
+
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self._error(411, "Content-Length required")
+            return
+        # 只接受非负的十进制整数 (int() 还接受 "+1"、"1_000"、空白等)
+        length = length.strip()
+        if not (length.isascii() and length.isdigit()):
+            self._error(400, "Invalid Content-Length")
+            return
+        length = int(length)
+        if length > self.server.max_body:
+            self._error(413, f"Request body exceeds {self.server.max_body // (1024 * 1024)} MB")
+            return
+
+        # 准入控制: 名额已满时不读取请求体，直接拒绝
+        if not self.service.try_acquire():
+            self.service.stats.reject()
+            self._error(503, "Server busy", {'Retry-After': str(RETRY_AFTER_SECONDS)})
+            return
+
+        try:
+            data = self.rfile.read(length)
+            if len(data) < length:
+                self._error(400, "Incomplete request body")
+                return
+            submitted = time.perf_counter()
+            try:
+                output, metrics = self.service.compress(data, input_format, output_format, options)
+            except Exception as e:
+                # 工作进程崩溃等 (如 BrokenProcessPool)
+                self.service.stats.record(False, (time.perf_counter() - start) * 1000, 0, 0, length, 0)
+                self._error(500, f"Worker Error: {e}")
+                return
+            waited_ms = (time.perf_counter() - submitted) * 1000
+        finally:
+            self.service.release()
+
+        compress_ms = metrics.get('worker_ms', 0)
+        ok = output is not None
+        headers = {
+            'X-Compression-Message': metrics['message'].encode('ascii', 'replace').decode('ascii'),
+            'X-Original-Size': str(length),
+        }
+        if metrics.get('quality') is not None:
+            headers['X-Quality'] = str(metrics['quality'])
+        if metrics.get('ssim') is not None:
+            headers['X-SSIM'] = f"{metrics['ssim']:.4f}"
+        if ok:
+            self._send(200, output, OUTPUT_TYPES.get(metrics.get('format'), 'application/octet-stream'), headers)
+        else:
+            self._send_json(422, {'error': metrics['message']}, headers)
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.service.stats.record(ok, latency_ms, max(0.0, waited_ms - compress_ms), compress_ms,
+                                  length, len(output) if ok else 0)
+
+
+class CompressionServer(ThreadingHTTPServer):
+    """每个连接一个线程 (只负责收发)，压缩在 CompressionService 的工作池中执行"""
+    daemon_threads = True
+
+    def __init__(self, address, service, max_body_mb=DEFAULT_MAX_BODY_MB, verbose=False):
+        super().__init__(address, CompressionHandler)
+        self.service = service
+        self.max_body = max_body_mb * 1024 * 1024
+        self.verbose = verbose
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m server', description="本地 HTTP 压缩服务")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址 (默认只监听本机)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"端口 (默认 {DEFAULT_PORT})")
+    parser.add_argument('--workers', type=int, default=None, help="同时压缩的请求数 (默认: CPU 核心数)")
+    parser.add_argument('--queue', type=int, default=DEFAULT_QUEUE,
+                        help=f"工作者都忙时最多排队的请求数，超出时返回 503 (默认 {DEFAULT_QUEUE})")
+    parser.add_argument('--threads', action='store_true', help="使用线程池代替进程池")
+    parser.add_argument('--max-mb', type=int, default=DEFAULT_MAX_BODY_MB,
+                        help=f"请求体大小上限 MB (默认 {DEFAULT_MAX_BODY_MB})")
+    parser.add_argument('--verbose', action='store_true', help="输出访问日志")
+    return parser
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    # 作为 sidecar 运行时由进程管理器发送 SIGTERM: 与 Ctrl+C 相同，等待处理中的请求完成后退出
+    signal.signal(signal.SIGTERM, _terminate)
+    service = CompressionService(args.workers, args.queue, args.threads)
+    server = CompressionServer((args.host, args.port), service, args.max_mb, args.verbose)
+    host, port = server.server_address[:2]
+    sys.stderr.write(json.dumps({'type': 'listening', 'host': host, 'port': port,
+                                 'workers': service.workers, 'queue': service.queue_size}) + '\n')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+        sys.stderr.write(json.dumps(dict(service.snapshot(), type='summary')) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
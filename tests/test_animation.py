@@ -0,0 +1,128 @@
+"""动图流式写出 (write_gif / FrameSequence) 与 Pillow save_all 的逐帧比较"""
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw
+
+from animation import write_gif, FrameSequence, GIF_ALPHA_LUT
+from compressor import ImageCompressor
+
+SIZE = (96, 64)
+
+
+def _frames(transparent, durations=(40, 60, 60, 80, 100)):
+    """色块动画 (颜色少于 256，量化无损)。第 3 帧与第 2 帧相同，用于检查相同帧的合并"""
+    frames = []
+    for i, duration in enumerate(durations):
+        x = 10 * (i if i != 2 else 1)
+        if transparent:
+            f = Image.new('RGBA', SIZE, (0, 0, 0, 0))
+        else:
+            f = Image.new('RGB', SIZE, (240, 240, 230))
+        draw = ImageDraw.Draw(f)
+        draw.rectangle((x, 8, x + 30, 40), fill=(200, 40, 40))
+        draw.ellipse((50, 20 + x // 2, 80, 50 + x // 2), fill=(30, 90, 200))
+        f.info['duration'] = duration
+        frames.append(f)
+    return frames
+
+
+def _decode(data):
+    """逐帧解码: [(RGBA 像素, 时长)], 循环次数"""
+    with Image.open(BytesIO(data)) as img:
+        frames = []
+        for i in range(img.n_frames):
+            img.seek(i)
+            frames.append((img.convert('RGBA'), img.info.get('duration')))
+        return frames, img.info.get('loop')
+
+
+def _visible(img):
+    """只比较可见像素: 全透明像素的颜色无意义"""
+    img = img.copy()
+    alpha = img.getchannel('A')
+    img.paste((0, 0, 0, 0), mask=alpha.point(lambda a: 255 if a == 0 else 0))
+    return img
+
+
+def _assert_same(streamed, baseline):
+    s_frames, s_loop = _decode(streamed)
+    b_frames, b_loop = _decode(baseline)
+    assert s_loop == b_loop
+    assert [d for _, d in s_frames] == [d for _, d in b_frames]
+    for (s, _), (b, _) in zip(s_frames, b_frames):
+        assert _visible(s).tobytes() == _visible(b).tobytes()
+
+
+@pytest.mark.parametrize('transparent', [False, True])
+@pytest.mark.parametrize('loop', [0, 3])
+def test_write_gif_matches_save_all(transparent, loop):
+    frames = _frames(transparent)
+
+    streamed = BytesIO()
+    written = write_gif(streamed, iter(frames), loop=loop, disposal=2)
+
+    baseline = BytesIO()
+    frames[0].save(baseline, format='GIF', save_all=True, append_images=frames[1:],
+                   duration=[f.info['duration'] for f in frames], loop=loop, disposal=2)
+
+    assert written == len(frames) - 1 # 相同的两帧合并
+    _assert_same(streamed.getvalue(), baseline.getvalue())
+
+
+def test_compress_gif_matches_save_all(tmp_path):
+    src = tmp_path / 'anim.gif'
+    frames = _frames(True)
+    frames[0].save(src, save_all=True, append_images=frames[1:],
+                   duration=[f.info['duration'] for f in frames], loop=2, disposal=2)
+
+    out = tmp_path / 'out.gif'
+    result = ImageCompressor().compress_image(str(src), str(out), detailed=True)
+    assert result.success, result.message
+
+    # 基准: 同样的逐帧处理 (RGBA + alpha 二值化)，再由 Pillow 一次性保存
+    with Image.open(src) as img:
+        expected = []
+        for i in range(img.n_frames):
+            img.seek(i)
+            f = img.copy().convert('RGBA')
+            f.putalpha(f.getchannel('A').point(GIF_ALPHA_LUT))
+            expected.append((f, img.info.get('duration')))
+    baseline = BytesIO()
+    expected[0][0].save(baseline, format='GIF', save_all=True, append_images=[f for f, _ in expected[1:]],
+                        duration=[d for _, d in expected], loop=2, disposal=2)
+
+    _assert_same(out.read_bytes(), baseline.getvalue())
+
+
+@pytest.mark.parametrize('transparent', [False, True])
+def test_frame_sequence_webp_matches_save_all(transparent):
+    frames = _frames(transparent)
+    durations = [f.info['duration'] for f in frames]
+
+    streamed = BytesIO()
+    sequence = FrameSequence(iter(f.copy() for f in frames), len(frames))
+    sequence.save(streamed, format='WEBP', save_all=True, duration=sequence.durations, lossless=True, loop=1)
+
+    baseline = BytesIO()
+    frames[0].save(baseline, format='WEBP', save_all=True, append_images=frames[1:], duration=durations,
+                   lossless=True, loop=1)
+
+    _assert_same(streamed.getvalue(), baseline.getvalue())
+
+
+def test_compress_gif_to_webp_keeps_timing(tmp_path):
+    src = tmp_path / 'anim.gif'
+    frames = _frames(True, durations=(40, 70, 90, 120, 150))
+    frames[0].save(src, save_all=True, append_images=frames[1:],
+                   duration=[f.info['duration'] for f in frames], loop=2, disposal=2)
+
+    out = tmp_path / 'out.webp'
+    result = ImageCompressor().compress_image(str(src), str(out), to_webp=True, detailed=True)
+    assert result.success, result.message
+
+    expected_frames, expected_loop = _decode(src.read_bytes())
+    actual_frames, actual_loop = _decode(out.read_bytes())
+    assert actual_loop == expected_loop == 2
+    # 有损编码，只比较帧数与时长
+    assert [d for _, d in actual_frames] == [d for _, d in expected_frames]
@@ -0,0 +1,38 @@
+"""压缩包内的图片"""
+import random
+import zipfile
+from io import BytesIO
+
+import pytest
+
+from batch import BatchEngine
+from benchmarks.corpus import make_photo
+
+
+def _jpeg(size, seed):
+    buf = BytesIO()
+    make_photo(random.Random(seed), size).save(buf, 'JPEG', quality=95)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize('memory_budget_mb', [0, 512])
+def test_member_order_preserved(tmp_path, memory_budget_mb):
+    """先完成的成员不会排到前面: 输出压缩包的成员顺序与输入相同"""
+    source = tmp_path / 'images.zip'
+    with zipfile.ZipFile(source, 'w') as zf:
+        # 第一张图片最大，最后完成
+        zf.writestr('big.jpg', _jpeg((2400, 1600), 0))
+        zf.writestr('docs/', b'')
+        zf.writestr('docs/readme.txt', b'hello')
+        for i in range(6):
+            zf.writestr(f'small_{i}.jpg', _jpeg((200, 150), i + 1))
+            zf.writestr(f'notes_{i}.txt', b'x' * i)
+
+    output = tmp_path / 'out.zip'
+    engine = BatchEngine(max_workers=2, use_threads=True, memory_budget_mb=memory_budget_mb)
+    results = list(engine.run_archive(str(source), str(output), {'target_size_kb': 30}))
+
+    assert len(results) == 7 and all(r['success'] for r in results)
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(output) as out:
+        assert out.namelist() == src.namelist()
+        assert out.read('docs/readme.txt') == b'hello'
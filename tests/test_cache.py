@@ -0,0 +1,23 @@
+"""结果缓存"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import ResultCache
+
+
+def test_concurrent_put_same_key(tmp_path):
+    """同一进程的多个线程同时写入同一个键 (临时文件不能互相覆盖)"""
+    cache = ResultCache(str(tmp_path / 'cache'))
+    output = tmp_path / 'out.jpg'
+    output.write_bytes(os.urandom(256 * 1024))
+
+    def put(_):
+        cache.put('key', str(output), "ok")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(put, range(64)))
+
+    blob = cache._blob_path('key')
+    with open(blob, 'rb') as f:
+        assert f.read() == output.read_bytes()
+    assert not [name for name in os.listdir(os.path.dirname(blob)) if name.endswith('.tmp')]
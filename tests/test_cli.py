@@ -0,0 +1,29 @@
+"""命令行版"""
+import json
+import os
+import random
+import subprocess
+import sys
+
+from benchmarks.corpus import make_photo
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_cli(*args):
+    return subprocess.run([sys.executable, '-m', 'cli', *args], cwd=ROOT,
+                          capture_output=True, text=True, timeout=120)
+
+
+def test_pdf_stdout_is_ndjson(tmp_path):
+    """处理 PDF 时 stdout 只有 NDJSON 记录 (PyMuPDF 的导入提示等不能混入)"""
+    pages = [make_photo(random.Random(i), (600, 800)) for i in range(2)]
+    source = tmp_path / 'document.pdf'
+    pages[0].save(source, save_all=True, append_images=pages[1:], resolution=100, quality=95)
+
+    proc = run_cli(str(source), '--target-kb', '80', '--output-dir', str(tmp_path / 'out'))
+    assert proc.returncode == 0, proc.stderr
+    lines = proc.stdout.splitlines()
+    assert lines
+    records = [json.loads(line) for line in lines]
+    assert [record['status'] for record in records] == ['ok']
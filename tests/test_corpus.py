@@ -0,0 +1,13 @@
+"""基准测试图片集"""
+import random
+
+from benchmarks.corpus import make_animation
+
+
+def _frames(seed):
+    return [frame.tobytes() for frame in make_animation(random.Random(seed), (120, 90), 4)]
+
+
+def test_animation_depends_on_seed():
+    assert _frames('a') == _frames('a')
+    assert _frames('a') != _frames('b')
@@ -0,0 +1,92 @@
+"""重复文件去重"""
+import os
+import random
+import shutil
+
+import pytest
+from PIL.PngImagePlugin import PngInfo
+
+import dedup
+from batch import BatchEngine
+from benchmarks.corpus import make_graphic
+from compressor import ImageCompressor
+from dedup import link_output
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """leader、内容相同的副本、像素相同但元数据不同的副本"""
+    src = tmp_path / 'src'
+    src.mkdir()
+    img = make_graphic(random.Random(0), (400, 300))
+    img.save(src / 'a.png')
+    shutil.copyfile(src / 'a.png', src / 'b_copy.png')
+    info = PngInfo()
+    info.add_text('Comment', 'same pixels, different bytes')
+    img.save(src / 'c_meta.png', pnginfo=info)
+    paths = [str(src / name) for name in ('a.png', 'b_copy.png', 'c_meta.png')]
+    assert open(paths[0], 'rb').read() != open(paths[2], 'rb').read()
+    return paths
+
+
+@pytest.mark.parametrize('link', ['copy', 'hardlink', 'reflink'])
+def test_bytes_and_pixel_duplicates(tmp_path, sources, monkeypatch, link):
+    encodes = []
+    encode_still = ImageCompressor._encode_still
+
+    def counting(self, result, *args, **kwargs):
+        encodes.append(result)
+        return encode_still(self, result, *args, **kwargs)
+
+    monkeypatch.setattr(ImageCompressor, '_encode_still', counting)
+    out_dir = tmp_path / 'out'
+    engine = BatchEngine(max_workers=1, pipeline=False, dedup='pixels', dedup_link=link)
+    results = list(engine.run(sources, {'target_size_kb': 500}, output_dir=str(out_dir)))
+
+    assert all(r['success'] for r in results), [r['message'] for r in results]
+    assert len(encodes) == 1
+    leader, copy, meta = sorted(results, key=lambda r: r['index'])
+    assert leader['duplicate'] is None
+    assert copy['duplicate']['of'] == sources[0] and not copy['duplicate']['pixels']
+    assert meta['duplicate']['of'] == sources[0] and meta['duplicate']['pixels']
+
+    with open(leader['output'], 'rb') as f:
+        data = f.read()
+    for result in (copy, meta):
+        with open(result['output'], 'rb') as f:
+            assert f.read() == data
+        if result['duplicate']['link'] == 'hardlink':
+            assert os.path.samefile(result['output'], leader['output'])
+
+    stats = engine.dedup_stats.snapshot()
+    assert stats['files'] == 2
+    assert stats['pixel_files'] == 1
+    # 只有按内容判断的副本省去了读取与解码
+    assert stats['source_bytes'] == os.path.getsize(sources[1])
+    linked = [r for r in (copy, meta) if r['duplicate']['link'] != 'copy']
+    assert stats['linked_bytes'] == sum(round(r['size_kb'] * 1024) for r in linked)
+
+
+def test_link_fallback_to_copy(tmp_path, monkeypatch):
+    src = tmp_path / 'leader.jpg'
+    src.write_bytes(b'compressed output')
+
+    def unsupported(*args):
+        raise OSError("not supported")
+
+    monkeypatch.setattr(os, 'link', unsupported)
+    monkeypatch.setattr(dedup, '_reflink', unsupported)
+    for method in ('hardlink', 'reflink'):
+        dst = tmp_path / f'{method}.jpg'
+        assert link_output(str(src), str(dst), method) == 'copy'
+        assert dst.read_bytes() == src.read_bytes()
+        assert not os.path.samefile(src, dst)
+    assert sorted(os.listdir(tmp_path)) == ['hardlink.jpg', 'leader.jpg', 'reflink.jpg']
+
+
+def test_hardlink(tmp_path):
+    src = tmp_path / 'leader.jpg'
+    src.write_bytes(b'compressed output')
+    dst = tmp_path / 'copy.jpg'
+    assert link_output(str(src), str(dst), 'hardlink') == 'hardlink'
+    assert os.path.samefile(src, dst)
@@ -0,0 +1,51 @@
+"""编码强度预设"""
+import random
+import re
+
+import pytest
+
+import compressor
+from benchmarks.corpus import make_photo
+from compressor import ImageCompressor
+
+
+@pytest.fixture(scope='module')
+def photos(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('photos')
+    paths = []
+    for i in range(3):
+        path = directory / f'photo_{i:02d}.jpg'
+        make_photo(random.Random(i), (800, 600)).save(path, 'JPEG', quality=95)
+        paths.append(str(path))
+    return paths
+
+
+def _webp_quality(path, output, target_size_kb):
+    result = ImageCompressor().compress_image(
+        path, output, target_size_kb=target_size_kb, to_webp=True, detailed=True)
+    assert result.success, result.message
+    return result.quality
+
+
+@pytest.mark.parametrize('target_size_kb', [20, 40, 60])
+def test_balanced_webp_quality_not_below_default_encoder(photos, tmp_path, monkeypatch, target_size_kb):
+    """balanced 的 WebP 质量不低于加入预设之前 (Pillow 默认 method，不重新编码) 的结果"""
+    output = str(tmp_path / 'out.webp')
+    balanced = [_webp_quality(path, output, target_size_kb) for path in photos]
+
+    monkeypatch.setitem(compressor.EFFORT_PRESETS['balanced'], 'WEBP', {'probe': {}, 'final': {}})
+    default = [_webp_quality(path, output, target_size_kb) for path in photos]
+
+    for got, expected in zip(balanced, default):
+        assert got >= expected
+
+
+@pytest.mark.parametrize('to_webp', [False, True])
+@pytest.mark.parametrize('mode', [{'target_size_kb': 500}, {'target_size_kb': 30}, {'target_ssim': 0.98}])
+def test_reported_encodes_include_final_pass(photos, tmp_path, to_webp, mode):
+    """消息中的 Encodes 与 attempts (NDJSON / 汇总) 是同一个计数，包括 final 参数的重新编码"""
+    result = ImageCompressor().compress_image(photos[0], str(tmp_path / 'out.jpg'), to_webp=to_webp,
+                                              detailed=True, **mode)
+    assert result.success, result.message
+    encodes = int(re.search(r'Encodes=(\d+)', result.message).group(1))
+    assert encodes == result.attempts == result.to_dict()['attempts']
@@ -0,0 +1,36 @@
+"""模块依赖: 底层模块不导入上层模块"""
+import os
+import subprocess
+import sys
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _loaded_after(module, names):
+    """在新的解释器中导入 module，返回 names 中已被加载的模块"""
+    code = f"import sys, {module}; print(','.join(n for n in {names!r} if n in sys.modules))"
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return [n for n in out.stdout.strip().split(',') if n]
+
+
+def test_compressor_does_not_import_batch_layer():
+    assert _loaded_after('compressor', ['batch', 'cache', 'journal']) == []
+
+
+def test_process_queue_compat(tmp_path):
+    from compressor import ImageCompressor
+    src = tmp_path / 'a.bmp'
+    Image.new('RGB', (64, 48), (200, 30, 30)).save(src)
+    out_dir = tmp_path / 'out'
+
+    results = ImageCompressor().process_queue([str(src)], str(out_dir), {'target_size_kb': 50}, max_workers=1,
+                                              use_threads=True)
+    assert [(name, ok) for name, ok, _, _ in results] == [('a.bmp', True)]
+    assert (out_dir / 'a.jpg').exists()
+
+
+def test_batch_does_not_import_sqlite():
+    # 未启用结果缓存时，CLI 启动不应加载 sqlite3
+    assert _loaded_after('batch', ['sqlite3', 'cache']) == []
@@ -0,0 +1,73 @@
+"""任务日志 (断点续传)"""
+import os
+import random
+
+import pytest
+
+import batch
+from batch import BatchEngine
+from benchmarks.corpus import make_photo
+from journal import BatchJournal, default_journal_path
+
+PARAMS = {'target_size_kb': 20, 'use_cache': False}
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(5):
+        path = tmp_path / f'photo_{i}.jpg'
+        make_photo(random.Random(i), (320, 240)).save(path, 'JPEG', quality=95)
+        paths.append(str(path))
+    return paths
+
+
+def _run(files, out_dir, journal):
+    engine = BatchEngine(max_workers=1, pipeline=False)
+    return list(engine.run(files, PARAMS, output_dir=out_dir, journal=journal))
+
+
+def test_resume_skips_finished_and_cleans_temp(tmp_path, files, monkeypatch):
+    out_dir = str(tmp_path / 'out')
+    journal_path = str(tmp_path / 'journal.ndjson')
+    crash_at = 3
+    compress_job = batch.compress_job
+    finished = []
+
+    def crashing(index, file_path, output_path, *args, **kwargs):
+        if index == crash_at:
+            # 写了一半时进程被杀: 留下原子写出的临时文件
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(f"{output_path}.12345.1.tmp", 'wb') as f:
+                f.write(b'partial')
+            raise KeyboardInterrupt
+        result = compress_job(index, file_path, output_path, *args, **kwargs)
+        finished.append(result['output'])
+        return result
+
+    monkeypatch.setattr(batch, 'compress_job', crashing)
+    journal = BatchJournal(journal_path, PARAMS, out_dir)
+    with pytest.raises(KeyboardInterrupt):
+        _run(files, out_dir, journal)
+    journal.close()
+    assert len(finished) == crash_at
+    mtimes = {path: os.stat(path).st_mtime_ns for path in finished}
+
+    monkeypatch.setattr(batch, 'compress_job', compress_job)
+    journal = BatchJournal(journal_path, PARAMS, out_dir)
+    assert not [name for name in os.listdir(out_dir) if name.endswith('.tmp')]
+    results = _run(files, out_dir, journal)
+    journal.close(finished=True)
+
+    assert [r['resumed'] for r in results] == [True] * crash_at + [False] * (len(files) - crash_at)
+    assert all(r['success'] for r in results)
+    # 已完成的输出没有重新写出
+    assert {path: os.stat(path).st_mtime_ns for path in finished} == mtimes
+    assert sorted(os.listdir(out_dir)) == sorted(os.path.basename(f) for f in files)
+    # 全部成功后日志删除
+    assert not os.path.exists(journal_path)
+
+
+def test_cache_switch_keeps_resume_state(files):
+    """结果缓存开关不影响输出，不应视为另一批任务"""
+    assert default_journal_path(files, dict(PARAMS, use_cache=True)) == default_journal_path(files, PARAMS)
@@ -0,0 +1,82 @@
+"""PNG 智能模式的颜色数搜索"""
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image, ImageDraw
+
+from compressor import ImageCompressor
+from search import PALETTE_STEPS, PaletteSearch
+
+
+class _Buffer:
+    def __init__(self, size):
+        self.size = size
+
+    def tell(self):
+        return self.size
+
+
+def _sizes(rng):
+    """颜色越少体积越小 (单调)"""
+    sizes, size = {}, rng.uniform(500, 2000)
+    for colors in reversed(PALETTE_STEPS):
+        size *= rng.uniform(1.0, 1.4)
+        sizes[colors] = int(size)
+    return sizes
+
+
+@pytest.mark.parametrize('width', [1, 2, 3, 4])
+def test_largest_palette_under_target(width):
+    rng = random.Random(width)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for _ in range(200):
+            sizes = _sizes(rng)
+            target = rng.uniform(sizes[2] * 0.8, sizes[256] * 1.1)
+            search = PaletteSearch(lambda c: _Buffer(sizes[c]), target, executor=pool, width=width)
+            colors, buffer = search.run()
+
+            fitting = [c for c in PALETTE_STEPS if sizes[c] <= target]
+            if fitting:
+                assert colors == max(fitting)
+                assert buffer.tell() == sizes[colors]
+            else:
+                assert colors is None and buffer.tell() == sizes[2]
+            if width == 1:
+                # 14 个候选的二分: 第一个候选 + 最多 4 轮
+                assert search.attempts <= 5
+
+
+def _few_colors(path, count, seed):
+    rng = random.Random(seed)
+    palette = [tuple(rng.randrange(256) for _ in range(3)) for _ in range(count)]
+    img = Image.new('RGB', (300, 200), palette[0])
+    draw = ImageDraw.Draw(img)
+    for _ in range(400):
+        x, y = rng.randrange(300), rng.randrange(200)
+        draw.rectangle([x, y, x + rng.randrange(5, 40), y + rng.randrange(5, 30)], fill=rng.choice(palette))
+    pixels = img.load()
+    for _ in range(3000):
+        pixels[rng.randrange(300), rng.randrange(200)] = rng.choice(palette)
+    img.save(path)
+    return path.stat().st_size
+
+
+@pytest.mark.parametrize('count', [5, 40, 150])
+@pytest.mark.parametrize('fraction', [0.3, 0.6, 0.9])
+def test_reported_colors_match_output(tmp_path, count, fraction):
+    """少于 256 色的图片: 消息中的 Colors=N 为输出实际使用的颜色数"""
+    source = tmp_path / 'few.png'
+    size = _few_colors(source, count, count)
+    output = tmp_path / 'out.png'
+    result = ImageCompressor().compress_image(str(source), str(output), target_size_kb=size * fraction / 1024,
+                                              detailed=True)
+    assert result.success, result.message
+    match = re.search(r'Colors=(\d+)', result.message)
+    if match is None:
+        assert 'Lossless' in result.message
+        return
+    with Image.open(output) as img:
+        used = len(img.getcolors(256))
+    assert int(match.group(1)) == result.colors == used <= count
@@ -0,0 +1,46 @@
+"""PDF 内嵌图片的重新压缩"""
+from io import BytesIO
+
+from PIL import Image
+
+from compressor import ImageCompressor
+
+
+def _pdf_with_indirect_length(jpeg):
+    """一页、一张 JPEG 图片的 PDF，图片流的 /Length 为间接对象 (pdfTeX 等的写法)"""
+    content = b"q 400 0 0 400 0 0 cm /Im0 Do Q"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 400 400] "
+        b"/Resources << /XObject << /Im0 4 0 R >> >> /Contents 6 0 R >>",
+        b"<< /Type /XObject /Subtype /Image /Width 800 /Height 800 /ColorSpace /DeviceRGB "
+        b"/BitsPerComponent 8 /Filter /DCTDecode /Length 5 0 R >>\nstream\n" + jpeg + b"\nendstream",
+        str(len(jpeg)).encode(),
+        b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream",
+    ]
+    out = BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def test_indirect_length(tmp_path):
+    buf = BytesIO()
+    Image.effect_noise((800, 800), 64).convert('RGB').save(buf, 'JPEG', quality=95)
+    source = tmp_path / 'indirect.pdf'
+    source.write_bytes(_pdf_with_indirect_length(buf.getvalue()))
+
+    compressor = ImageCompressor()
+    for kwargs in ({'fixed_quality': True, 'quality': 60}, {'target_size_kb': 60}):
+        ok, message, _ = compressor.compress_image(str(source), str(tmp_path / 'out.pdf'), **kwargs)
+        assert ok, message
+        assert message.startswith('PDF Compressed (Images=1)') or 'Hard limit' in message
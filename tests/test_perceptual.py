@@ -0,0 +1,48 @@
+"""SSIM 评分"""
+import random
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from benchmarks.corpus import make_photo
+from perceptual import SsimScorer
+
+QUALITIES = (10, 25, 40, 55, 70, 85, 95)
+
+
+@pytest.fixture(scope='module')
+def photo():
+    return make_photo(random.Random(7), (320, 240))
+
+
+def _jpeg(img, quality):
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    return buffer
+
+
+def test_identical_image_scores_one(photo):
+    scorer = SsimScorer(photo)
+    assert scorer.score(photo) == pytest.approx(1.0, abs=1e-9)
+    assert scorer.score(photo.copy()) == pytest.approx(1.0, abs=1e-9)
+    # 亮度平面相同的其它颜色模式
+    assert scorer.score(photo.convert('L')) == pytest.approx(1.0, abs=1e-3)
+
+
+@pytest.mark.parametrize('max_pixels', [1024 * 1024, 320 * 240 // 4, 320 * 240 // 16])
+def test_score_increases_with_quality(photo, max_pixels):
+    # max_pixels 较小时评分平面缩小 (JPEG 在解码时按 draft 缩小)
+    scorer = SsimScorer(photo, max_pixels=max_pixels)
+    scores = [scorer.score_buffer(_jpeg(photo, q)) for q in QUALITIES]
+    assert scores == sorted(scores), scores
+    assert all(0 < s < 1 for s in scores)
+    assert scores[-1] > 0.95
+
+
+def test_score_buffer_matches_score(photo):
+    scorer = SsimScorer(photo)
+    buffer = _jpeg(photo, 60)
+    with Image.open(BytesIO(buffer.getvalue())) as decoded:
+        decoded.load()
+        assert scorer.score_buffer(buffer) == pytest.approx(scorer.score(decoded), abs=1e-3)
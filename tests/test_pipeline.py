@@ -0,0 +1,59 @@
+"""原子写出"""
+import os
+
+import pytest
+
+from pipeline import atomic_output, write_atomic
+
+
+def _leftovers(directory):
+    return [f for f in os.listdir(directory) if f.endswith('.tmp')]
+
+
+def test_atomic_output_replaces_on_success(tmp_path):
+    target = tmp_path / 'out.jpg'
+    target.write_bytes(b'old')
+    with atomic_output(str(target)) as tmp:
+        assert tmp != str(target) and os.path.dirname(tmp) == str(tmp_path)
+        with open(tmp, 'wb') as f:
+            f.write(b'new')
+        # 写完之前读取方仍看到旧内容
+        assert target.read_bytes() == b'old'
+    assert target.read_bytes() == b'new'
+    assert _leftovers(tmp_path) == []
+
+
+@pytest.mark.parametrize('existing', [True, False])
+@pytest.mark.parametrize('error', [ValueError, KeyboardInterrupt])
+def test_atomic_output_cleans_up_on_error(tmp_path, existing, error):
+    target = tmp_path / 'out.jpg'
+    if existing:
+        target.write_bytes(b'old')
+
+    with pytest.raises(error):
+        with atomic_output(str(target)) as tmp:
+            with open(tmp, 'wb') as f:
+                f.write(b'half written')
+            raise error()
+
+    assert _leftovers(tmp_path) == []
+    if existing:
+        assert target.read_bytes() == b'old'
+    else:
+        assert not target.exists()
+
+
+def test_atomic_output_error_before_write(tmp_path):
+    # 临时文件还未创建时出错
+    target = tmp_path / 'out.jpg'
+    with pytest.raises(OSError):
+        with atomic_output(str(target)):
+            raise OSError("disk full")
+    assert os.listdir(tmp_path) == []
+
+
+def test_write_atomic_memoryview(tmp_path):
+    target = tmp_path / 'out.bin'
+    write_atomic(str(target), memoryview(b'abc123'))
+    assert target.read_bytes() == b'abc123'
+    assert _leftovers(tmp_path) == []
@@ -0,0 +1,38 @@
+"""多尺寸输出"""
+import os
+import random
+
+from batch import BatchEngine
+from benchmarks.corpus import make_photo
+from journal import BatchJournal
+from renditions import parse_renditions
+
+
+def test_widths_above_source_collapse(tmp_path):
+    """不小于原图宽度的尺寸只输出一份，按实际宽度命名"""
+    source = tmp_path / 'photo.jpg'
+    make_photo(random.Random(1), (600, 400)).save(source, 'JPEG', quality=95)
+    params = {'target_size_kb': 40,
+              'renditions': parse_renditions(['1200', '800', '600:30', '300'], ['jpg', 'webp'], 40)}
+    out_dir = tmp_path / 'out'
+    journal_path = str(tmp_path / 'journal.ndjson')
+
+    journal = BatchJournal(journal_path, params, str(out_dir))
+    [result] = BatchEngine(max_workers=1).run([str(source)], params, output_dir=str(out_dir), journal=journal)
+    journal.close()
+
+    assert result['success'], result['message']
+    assert sorted(os.listdir(out_dir)) == ['photo-300w.jpg', 'photo-300w.webp', 'photo-600w.jpg', 'photo-600w.webp']
+    renditions = result['metrics']['renditions']
+    assert [(r['width'], os.path.basename(r['output'])) for r in renditions] == [
+        (600, 'photo-600w.jpg'), (600, 'photo-600w.webp'), (300, 'photo-300w.jpg'), (300, 'photo-300w.webp')]
+    assert all(r['output_size'][0] == r['width'] for r in renditions)
+    # 与原图同宽的一项使用它自己的目标大小
+    assert renditions[0]['size_kb'] <= 30
+    assert result['output'] == str(out_dir / 'photo-600w.jpg')
+
+    # 断点续传按实际输出核对
+    journal = BatchJournal(journal_path, params, str(out_dir))
+    [resumed] = BatchEngine(max_workers=1).run([str(source)], params, output_dir=str(out_dir), journal=journal)
+    journal.close()
+    assert resumed['resumed'] and resumed['output'] == result['output']
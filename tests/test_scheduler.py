@@ -0,0 +1,69 @@
+"""按内存预算调度"""
+import threading
+
+from PIL import Image
+
+import scheduler
+from batch import BatchEngine
+from scheduler import MemoryScheduler
+
+MB = 1024 * 1024
+
+
+def test_fill_submits_before_lookahead_is_full():
+    """有任务可以提交时立即返回，不先把 lookahead 个任务全部估算"""
+    estimated = []
+
+    def estimate(job):
+        estimated.append(job)
+        return MB
+
+    jobs = iter(range(100))
+    sched = MemoryScheduler(64 * MB, lookahead=50)
+    assert sched.fill(jobs, estimate) == (0, MB)
+    assert estimated == [0]
+
+
+def test_fill_largest_first_when_budget_is_full():
+    sizes = {'a': 8, 'b': 2, 'c': 6, 'd': 4}
+    sched = MemoryScheduler(10 * MB, lookahead=4, max_skips=0)
+    jobs = iter(sizes)
+
+    def estimate(job):
+        return sizes[job] * MB
+
+    assert sched.fill(jobs, estimate) == ('a', 8 * MB)
+    assert sched.fill(jobs, estimate) == ('b', 2 * MB)
+    # 内存已满: 排满 lookahead 后等待释放
+    assert sched.fill(jobs, estimate) is None
+    assert sched.queued == 2
+    sched.release(8 * MB)
+    assert sched.fill(jobs, estimate) == ('c', 6 * MB)
+    sched.release(2 * MB)
+    assert sched.fill(jobs, estimate) == ('d', 4 * MB)
+    assert sched.fill(jobs, estimate) is None
+    assert sched.exhausted
+
+
+def test_batch_estimates_in_io_threads(tmp_path, monkeypatch):
+    """流水线模式下在 I/O 线程中估算内存 (主线程只负责提交)"""
+    files = []
+    for i in range(12):
+        path = tmp_path / f'img_{i:02d}.png'
+        Image.new('RGB', (64 + i, 64), (i * 20, 0, 0)).save(path)
+        files.append(str(path))
+
+    threads = set()
+    estimate_memory = scheduler.estimate_memory
+
+    def recording(*args, **kwargs):
+        threads.add(threading.current_thread().name)
+        return estimate_memory(*args, **kwargs)
+
+    monkeypatch.setattr(scheduler, 'estimate_memory', recording)
+    engine = BatchEngine(max_workers=2, use_threads=True, memory_budget_mb=256, dedup=None)
+    results = list(engine.run(files, {'fixed_quality': True, 'quality': 80}, output_dir=str(tmp_path / 'out')))
+
+    assert sorted(r['file'] for r in results) == files
+    assert all(r['success'] for r in results)
+    assert threads and threading.main_thread().name not in threads
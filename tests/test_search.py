@@ -0,0 +1,131 @@
+"""质量搜索: 与二分搜索的结果一致，且编码次数更少"""
+import math
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from search import QualitySearch, _scale_axis
+
+MIN_Q, MAX_Q = 5, 95
+CURVES = 200
+# 二分搜索 [MIN_Q, MAX_Q] (先试 MAX_Q) 的编码次数
+BINARY_ENCODES = 1 + math.ceil(math.log2(MAX_Q - MIN_Q + 1))
+
+
+class _Buffer:
+    def __init__(self, size):
+        self.size = size
+
+    def tell(self):
+        return self.size
+
+
+def _jpeg_curve(rng):
+    """JPEG: 对数体积在量化缩放轴上近似线性，叠加单调的小扰动"""
+    base, slope, drift = rng.uniform(1e4, 1e6), rng.uniform(0.45, 0.85), 1.0
+    sizes = {}
+    for q in range(1, 101):
+        drift *= 1 + rng.uniform(0, 0.01)
+        sizes[q] = int(base * math.exp(slope * (_scale_axis(q) + 5)) * drift)
+    return sizes
+
+
+def _webp_curve(rng):
+    """WebP: 对数体积对 quality 近似线性，有平台段和高质量处的跳变"""
+    base, k, jump = rng.uniform(1e4, 1e6), rng.uniform(0.02, 0.05), rng.choice([80, 90, 95, 100])
+    sizes, last = {}, 0
+    for q in range(1, 101):
+        size = int(base * math.exp(k * q) * (1.3 if q >= jump else 1.0))
+        if rng.random() < 0.2:
+            size = last
+        last = sizes[q] = max(size, last)
+    return sizes
+
+
+def _cases(seed):
+    rng = random.Random(seed)
+    for n in range(CURVES):
+        sizes = (_jpeg_curve if n % 2 else _webp_curve)(rng)
+        # 包括最低质量仍超出目标、最高质量即满足目标的情况
+        target = rng.uniform(sizes[MIN_Q] * 0.8, sizes[MAX_Q] * 1.2)
+        yield sizes, target
+
+
+def _binary(sizes, target):
+    """参考: 二分搜索目标以内的最大质量"""
+    lo, hi, best = MIN_Q, MAX_Q, None
+    while lo <= hi:
+        q = (lo + hi) // 2
+        if sizes[q] <= target:
+            best, lo = q, q + 1
+        else:
+            hi = q - 1
+    return best
+
+
+def _search(sizes, target, **kwargs):
+    search = QualitySearch(lambda q: _Buffer(sizes[q]), target, MIN_Q, MAX_Q, **kwargs)
+    quality, buffer = search.run()
+    return search, quality, buffer
+
+
+@pytest.fixture(scope='module')
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+
+def test_serial_matches_binary_search():
+    attempts = []
+    for sizes, target in _cases(0):
+        search, quality, buffer = _search(sizes, target)
+        assert quality == _binary(sizes, target)
+        if quality is None:
+            assert buffer.tell() == sizes[MIN_Q]
+        attempts.append(search.attempts)
+
+    # 最坏情况: 连续两次收缩不足时退回二分
+    assert max(attempts) <= 2 * BINARY_ENCODES + 1
+    # 插值的目的: 平均编码次数明显少于二分
+    assert sum(attempts) / len(attempts) <= BINARY_ENCODES - 2
+
+
+@pytest.mark.parametrize('width', [2, 3, 4])
+def test_parallel_matches_binary_search(executor, width):
+    rounds = []
+    for sizes, target in _cases(1):
+        search, quality, _ = _search(sizes, target, executor=executor, width=width)
+        assert quality == _binary(sizes, target)
+        rounds.append(search.rounds)
+    # 每轮并发编码 width 个质量，轮数 (即延迟) 少于逐个搜索的编码次数
+    assert max(rounds) <= BINARY_ENCODES
+    assert sum(rounds) / len(rounds) <= 4
+
+
+@pytest.mark.parametrize('width', [1, 3])
+def test_hinted_matches_binary_search(executor, width):
+    rng = random.Random(2)
+    exact = []
+    for sizes, target in _cases(2):
+        expected = _binary(sizes, target)
+        for hint in (rng.randint(MIN_Q, MAX_Q), expected):
+            if hint is None:
+                continue
+            search, quality, _ = _search(sizes, target, hint=hint, executor=executor, width=width)
+            assert quality == expected
+            if hint == expected and width == 1:
+                exact.append(search.attempts)
+    if exact:
+        # 预测准确时通常 2 次编码 (预测点与其上一档) 即可确认
+        assert sum(exact) / len(exact) <= 2.5
+
+
+def test_non_monotonic_result_fits_target():
+    """体积不单调 (如 WebP 的个别质量) 时不保证与二分相同，但结果总在目标以内"""
+    rng = random.Random(3)
+    for sizes, target in _cases(3):
+        sizes = {q: int(size * rng.uniform(0.9, 1.1)) for q, size in sizes.items()}
+        _, quality, buffer = _search(sizes, target)
+        if quality is not None:
+            assert buffer.tell() == sizes[quality] <= target
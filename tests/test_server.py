@@ -0,0 +1,39 @@
+"""本地 HTTP 压缩服务"""
+import json
+import socket
+import threading
+
+import pytest
+
+from server import CompressionServer, CompressionService
+
+
+@pytest.fixture
+def server():
+    service = CompressionService(workers=1, use_threads=True)
+    httpd = CompressionServer(('127.0.0.1', 0), service)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    service.shutdown()
+
+
+def _post(server, length):
+    request = (f"POST /compress?name=a.jpg HTTP/1.1\r\nHost: localhost\r\n"
+               f"Content-Length: {length}\r\n\r\n").encode()
+    with socket.create_connection(server.server_address, timeout=10) as sock:
+        sock.sendall(request)
+        response = b''
+        while chunk := sock.recv(65536):
+            response += chunk
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+@pytest.mark.parametrize('length', ['abc', '-1', '+5', '1_0', ''])
+def test_invalid_content_length(server, length):
+    status, body = _post(server, length)
+    assert status == 400
+    assert body == {'error': "Invalid Content-Length"}
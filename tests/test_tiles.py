@@ -0,0 +1,68 @@
+"""超大图片的分条处理: 与整图处理的差异在 tiles.py 说明的范围内"""
+import random
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import compressor
+import tiles
+from benchmarks.corpus import make_photo
+from compressor import ImageCompressor
+
+
+@pytest.fixture
+def strips(monkeypatch):
+    """用很小的条带强制多条处理，并记录 decode_strips 的调用次数"""
+    monkeypatch.setattr(tiles, 'STRIP_PIXELS', 100_000)
+    calls = []
+    decode_strips = compressor.decode_strips
+
+    def spy(*args, **kwargs):
+        calls.append(args[2])
+        return decode_strips(*args, **kwargs)
+
+    monkeypatch.setattr(compressor, 'decode_strips', spy)
+    return calls
+
+
+def _source(tmp_path, ext, alpha):
+    img = make_photo(random.Random(7), (1200, 900))
+    if alpha:
+        img.putalpha(Image.linear_gradient('L').resize(img.size))
+    path = tmp_path / f'source{ext}'
+    img.save(path)
+    return str(path)
+
+
+def _pixels(source, output, max_width, tiled):
+    # 目标足够大时 PNG 为无损输出，比较的就是编码前的像素
+    result = ImageCompressor().compress_image(source, output, target_size_kb=100_000, max_width=max_width,
+                                              tiled=tiled, detailed=True)
+    assert result.success and 'Lossless' in result.message, result.message
+    with Image.open(output) as img:
+        return np.asarray(img.convert('RGBA')).astype(float)
+
+
+@pytest.mark.parametrize('ext, alpha', [('.bmp', False), ('.tif', False), ('.tif', True)])
+@pytest.mark.parametrize('max_width', [None, 700, 333])
+def test_tiled_matches_whole_image(tmp_path, strips, ext, alpha, max_width):
+    source = _source(tmp_path, ext, alpha)
+    tiled = _pixels(source, str(tmp_path / 'tiled.png'), max_width, True)
+    assert len(strips) == 1
+    whole = _pixels(source, str(tmp_path / 'whole.png'), max_width, False)
+    assert len(strips) == 1
+
+    assert tiled.shape == whole.shape
+    diff = np.abs(tiled - whole)
+    if max_width is None:
+        # 不缩放: 逐像素运算，完全相同
+        assert diff.max() == 0
+        return
+
+    opaque = whole[..., 3] == 255
+    assert diff[..., :3][opaque].max(initial=0) <= 1
+    assert diff[..., 3].max() <= 1
+    # 半透明: 颜色按 alpha 预乘后比较
+    premultiplied = np.abs(tiled[..., :3] * tiled[..., 3:] - whole[..., :3] * whole[..., 3:]) / 255
+    assert premultiplied.max() <= 2
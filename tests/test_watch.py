@@ -0,0 +1,132 @@
+"""监视文件夹: 去抖与输出目录排除"""
+import os
+import threading
+import time
+
+import pytest
+
+from batch import OUTPUT_DIR_NAME
+from watch import FolderWatcher, file_signature
+
+
+class _Engine:
+    """记录每批文件，并把输出写到 _compressed (检查输出不会被当作新文件)"""
+
+    def __init__(self):
+        self.batches = []
+
+    def run(self, files, params, output_dir=None):
+        self.batches.append(list(files))
+        for path in files:
+            out_dir = output_dir or os.path.join(os.path.dirname(path), OUTPUT_DIR_NAME)
+            os.makedirs(out_dir, exist_ok=True)
+            output = os.path.join(out_dir, os.path.basename(path))
+            with open(output, 'wb') as f:
+                f.write(b'out')
+            yield {'file': path, 'output': output, 'success': True}
+
+    def processed(self):
+        return [p for batch in self.batches for p in batch]
+
+
+def _watcher(tmp_path, engine, **kwargs):
+    root = tmp_path / 'in'
+    root.mkdir(exist_ok=True)
+    kwargs.setdefault('settle_seconds', 2.0)
+    return str(root), FolderWatcher([str(root)], {}, engine, ('.jpg',), state_path=str(tmp_path / 'state.json'),
+                                    **kwargs)
+
+
+def test_settle_waits_for_stable_signature(tmp_path):
+    root, w = _watcher(tmp_path, _Engine())
+    path = os.path.join(root, 'a.jpg')
+    with open(path, 'wb') as f:
+        f.write(b'x' * 100)
+
+    w._touch([path], 100.0)
+    assert w._take_settled(101.0) == {}
+
+    # 写入仍在继续 (有事件): 重新计时
+    with open(path, 'ab') as f:
+        f.write(b'x' * 100)
+    w._touch([path], 101.5)
+    assert w._take_settled(102.5) == {}
+
+    # 没有事件但文件又变了 (如网络共享盘): 到期检查时发现签名不同，同样重新计时
+    with open(path, 'ab') as f:
+        f.write(b'x' * 100)
+    assert w._take_settled(103.6) == {}
+    assert w._take_settled(105.0) == {}
+
+    assert w._take_settled(105.7) == {path: file_signature(path)}
+    assert w.pending == {}
+
+
+def test_unchanged_processed_file_is_ignored(tmp_path):
+    root, w = _watcher(tmp_path, _Engine())
+    path = os.path.join(root, 'a.jpg')
+    with open(path, 'wb') as f:
+        f.write(b'x')
+    w.state.mark(path, file_signature(path))
+
+    w._touch([path], 0.0)
+    assert w.pending == {}
+
+
+def test_scan_excludes_output_dirs(tmp_path):
+    out_dir = tmp_path / 'out'
+    root, w = _watcher(tmp_path, _Engine(), output_dir=str(out_dir))
+    for rel in ('a.jpg', 'sub/b.jpg', f'{OUTPUT_DIR_NAME}/a.jpg', f'sub/{OUTPUT_DIR_NAME}/b.jpg', 'c.txt'):
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'x')
+
+    assert sorted(w.scan()) == [os.path.join(root, 'a.jpg'), os.path.join(root, 'sub', 'b.jpg')]
+    assert w.is_excluded(str(out_dir))
+
+
+def _wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.mark.parametrize('use_inotify', [False, None])
+def test_run_processes_each_file_once(tmp_path, use_inotify):
+    engine = _Engine()
+    root, w = _watcher(tmp_path, engine, settle_seconds=0.3, poll_seconds=0.05, use_inotify=use_inotify)
+    existing = os.path.join(root, 'existing.jpg')
+    with open(existing, 'wb') as f:
+        f.write(b'x')
+
+    stop = threading.Event()
+    results = []
+    thread = threading.Thread(target=lambda: results.extend(w.run(stop)), daemon=True)
+    thread.start()
+    try:
+        # 启动前已有的文件立即处理
+        assert _wait_for(lambda: engine.processed() == [existing])
+
+        # 分几次写入的新文件: 写完并稳定后只处理一次
+        path = os.path.join(root, 'new.jpg')
+        with open(path, 'wb') as f:
+            for _ in range(3):
+                f.write(b'x' * 1000)
+                f.flush()
+                time.sleep(0.1)
+        assert _wait_for(lambda: path in engine.processed())
+        time.sleep(0.5)
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert engine.processed() == [existing, path]
+    assert [r['file'] for r in results] == [existing, path]
+    # 输出目录中的文件不被处理，状态索引记录了已处理的文件
+    assert os.path.exists(os.path.join(root, OUTPUT_DIR_NAME, 'new.jpg'))
+    assert w.state.is_current(path, file_signature(path))
@@ -0,0 +1,171 @@
+"""
+超大图片 (扫描件 / 全景图) 的分条处理
+
+普通流程会先把整张图解码到内存，再做颜色转换、透明合成、缩放，期间同时存在多份全尺寸副本。
+对于未压缩存储的格式 (BMP、未压缩 TIFF、PPM 等)，这里通过内存映射按行读取原始数据，
+每次只解码一条 (约 STRIP_PIXELS 像素)，缩放和颜色转换后直接写入输出图片:
+- 内存占用 = 输出图片 + 一条的数据，与原图尺寸无关
+- 缩放使用 resize(box=...)，每条多读 LANCZOS 支撑范围内的相邻行。与整图缩放的差异为浮点取整误差:
+  不透明像素每个通道不超过 1；半透明像素的 alpha 不超过 1，颜色按 alpha 预乘后 (c * a / 255) 不超过 2
+  (Pillow 在预乘后的颜色上缩放，还原时误差放大约 255 / a 倍，接近全透明的像素颜色可能相差较多)
+- 颜色转换与透明合成都是逐像素运算，分条与整图结果完全相同
+Pillow 的编码器需要完整的图片，因此输出图片仍需全部在内存中 (智能模式本身也要对同一张图多次编码)。
+"""
+import os
+import math
+import mmap
+
+from PIL import Image
+
+# 超过该像素数且格式支持时使用分条处理 (约 5000 万像素)
+TILED_MIN_PIXELS = 50_000_000
+
+# 每条解码的像素数
+STRIP_PIXELS = 4 * 1024 * 1024
+
+# LANCZOS 滤波器的支撑半径 (按缩小倍数放大)
+LANCZOS_SUPPORT = 3.0
+
+
+def _raw_stride(mode, rawmode, width):
+    """未给出行跨度时按 rawmode 的位数计算 (不支持的 rawmode 返回 None)"""
+    try:
+        bits = len(Image.new(mode, (8, 1)).tobytes('raw', rawmode))
+    except Exception:
+        return None
+    return (bits * width + 7) // 8
+
+
+def strip_layout(img):
+    """
+    检查图片数据能否按行直接读取
+    :return: [(box, offset, rawmode, stride, orientation), ...]；压缩存储等不支持的情况返回 None
+    """
+    layout = []
+    for tile in img.tile:
+        codec, box, offset, args = tile[0], tile[1], tile[2], tile[3]
+        if codec != 'raw':
+            return None
+        if isinstance(args, str):
+            args = (args, 0, 1)
+        rawmode = args[0]
+        stride = args[1] if len(args) > 1 else 0
+        orientation = args[2] if len(args) > 2 else 1
+        width = box[2] - box[0]
+        if not stride:
+            stride = _raw_stride(img.mode, rawmode, width)
+            if stride is None:
+                return None
+        elif stride < 0:
+            return None
+        layout.append((box, offset, rawmode, stride, orientation))
+    return layout or None
+
+
+def can_tile(img, file_path, min_pixels=TILED_MIN_PIXELS):
+    """是否可以 (且值得) 分条处理: 像素数不少于 min_pixels，且数据未压缩存储"""
+    return (img.width * img.height >= min_pixels
+            and isinstance(file_path, (str, os.PathLike))
+            and strip_layout(img) is not None)
+
+
+class StripReader:
+    """通过内存映射按行读取图片的原始数据"""
+
+    def __init__(self, img, file_path):
+        self.img = img
+        self.layout = strip_layout(img)
+        self._file = open(file_path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _discard(self, start, end):
+        # 已读过的页面不再保留在进程内存中 (文件页可随时回收，但会计入 RSS)。Windows 无 madvise
+        if hasattr(mmap, 'MADV_DONTNEED'):
+            start -= start % mmap.PAGESIZE
+            try:
+                self._map.madvise(mmap.MADV_DONTNEED, start, end - start)
+            except (OSError, ValueError):
+                pass
+
+    def read(self, y0, y1):
+        """解码第 y0 ~ y1 行 (不含 y1)，返回与原图相同模式的图片"""
+        img = self.img
+        strip = Image.new(img.mode, (img.width, y1 - y0))
+        view = memoryview(self._map)
+        try:
+            for (x0, ty0, x1, ty1), offset, rawmode, stride, orientation in self.layout:
+                top, bottom = max(y0, ty0), min(y1, ty1)
+                if top >= bottom:
+                    continue
+                if orientation < 0:
+                    # 自下而上存储 (BMP): 第 r 行位于 (高度 - 1 - r) 处
+                    start = offset + (ty1 - bottom) * stride
+                else:
+                    start = offset + (top - ty0) * stride
+                end = start + (bottom - top) * stride
+                # frombytes 会复制数据，返回的图片不引用内存映射
+                part = Image.frombytes(img.mode, (x1 - x0, bottom - top), view[start:end],
+                                       'raw', rawmode, stride, orientation)
+                strip.paste(part, (x0, top - y0))
+                self._discard(start, end)
+        finally:
+            view.release()
+
+        if img.mode == 'P':
+            strip.putpalette(img.palette)
+        if 'transparency' in img.info:
+            strip.info['transparency'] = img.info['transparency']
+        return strip
+
+
+def decode_strips(img, file_path, new_size, convert, downscale, stage):
+    """
+    分条解码、缩放、颜色转换，拼接为输出图片
+    :param img: 已打开 (未 load) 的图片，需满足 can_tile
+    :param new_size: 输出尺寸，None 表示不缩放
+    :param convert: 颜色转换函数 convert(strip) -> strip (逐像素运算，如转 RGB / 透明合成，结果不能是 P 模式)
+    :param downscale: 缩放函数 downscale(strip, size, box) -> strip
+    :param stage: 计时函数 stage(name) (CompressionResult.stage)
+    :return: 输出图片
+    """
+    width, height = img.size
+    out_width, out_height = new_size or img.size
+    scale = height / out_height
+    # 每条输出的行数，以及缩放时上下需要多读的行数
+    rows = max(1, int(STRIP_PIXELS / width / scale))
+    margin = math.ceil(LANCZOS_SUPPORT * scale) + 1 if new_size else 0
+
+    output = None
+    with StripReader(img, file_path) as reader:
+        for oy0 in range(0, out_height, rows):
+            oy1 = min(out_height, oy0 + rows)
+            # 输出行 oy0 ~ oy1 对应的原图区域 (浮点)，加上滤波器需要的相邻行
+            top, bottom = oy0 * scale, oy1 * scale
+            y0 = max(0, int(top) - margin)
+            y1 = min(height, math.ceil(bottom) + margin)
+
+            with stage('decode'):
+                strip = reader.read(y0, y1)
+            if new_size:
+                with stage('resize'):
+                    strip = downscale(strip, (out_width, oy1 - oy0), (0, top - y0, width, bottom - y0))
+            strip = convert(strip)
+
+            if output is None:
+                output = Image.new(strip.mode, (out_width, out_height))
+            output.paste(strip, (0, oy0))
+    return output
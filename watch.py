@@ -0,0 +1,333 @@
+"""
+监视文件夹 (守护模式)
+
+上传流程会全天往文件夹里放入图片。FolderWatcher 常驻运行，只处理新增或修改过的文件:
+- 变化检测: Linux 上使用 inotify (通过 ctypes 调用，无额外依赖)，其它系统或网络共享盘 (inotify 收不到
+  其它机器的写入) 使用轮询扫描
+- 去抖: 文件大小和修改时间在 settle 秒内保持不变才认为写入完成，避免压缩写了一半的文件
+- 状态索引: 已处理文件的 (大小, 修改时间) 保存在 JSON 文件中，重启后只处理期间变化的文件
+输出目录 (_compressed 或统一输出目录) 本身不会被监视，避免处理自己的输出。
+"""
+import os
+import sys
+import json
+import time
+import struct
+import select
+import hashlib
+
+from batch import OUTPUT_DIR_NAME
+from pipeline import write_atomic
+
+# 状态索引的默认目录 (按监视的文件夹区分文件)
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser('~'), '.image_compressor', 'watch')
+
+# 文件大小和修改时间保持不变多少秒后才处理 (等待写入完成)
+DEFAULT_SETTLE_SECONDS = 2.0
+
+# 轮询扫描的间隔 (秒)
+DEFAULT_POLL_SECONDS = 5.0
+
+# inotify 事件 (见 <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def default_state_path(roots):
+    """按监视的文件夹生成状态索引路径 (同一组文件夹重启后使用同一个索引)"""
+    key = '|'.join(sorted(os.path.abspath(r) for r in roots))
+    return os.path.join(DEFAULT_STATE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16] + '.json')
+
+
+def file_signature(path):
+    """(大小, 修改时间 ns)，文件不存在时返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class WatchState:
+    """
+    已处理文件的持久化索引: 路径 -> 处理时的 (大小, 修改时间 ns)
+    通过临时文件原子替换保存，进程被杀时索引不会损坏 (最多丢失最后一批的记录，重启后重新处理)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.files = {p: tuple(sig) for p, sig in data.get('files', {}).items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Watch State Error: {e}")
+
+    def is_current(self, path, signature):
+        return self.files.get(path) == signature
+
+    def mark(self, path, signature):
+        self.files[path] = tuple(signature)
+
+    def prune(self, existing):
+        """删除已不存在的文件的记录"""
+        self.files = {p: sig for p, sig in self.files.items() if p in existing}
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        data = json.dumps({'version': 1, 'files': self.files}, ensure_ascii=False)
+        write_atomic(self.path, data.encode('utf-8'))
+
+
+class PollingScanner:
+    """轮询扫描: 每隔 interval 秒遍历一次，返回大小或修改时间变化的文件"""
+
+    def __init__(self, watcher, interval=DEFAULT_POLL_SECONDS):
+        self.watcher = watcher
+        self.interval = interval
+        self.known = {}
+        self._next_scan = 0
+
+    def read(self, timeout):
+        """等待最多 timeout 秒，返回变化的文件路径集合"""
+        delay = self._next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(max(0, timeout))
+            return set()
+        time.sleep(max(0, delay))
+        self._next_scan = time.monotonic() + self.interval
+
+        current = self.watcher.scan()
+        changed = {p for p, sig in current.items() if self.known.get(p) != sig}
+        self.known = current
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyScanner:
+    """
+    inotify 监视 (仅 Linux): 为每个子文件夹添加监视，新建的子文件夹自动加入
+    事件队列溢出时退回一次完整扫描
+    """
+
+    def __init__(self, watcher):
+        import ctypes
+
+        self.watcher = watcher
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._ctypes = ctypes
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}  # watch descriptor -> 文件夹路径
+        try:
+            for root in watcher.roots:
+                self._add_tree(root)
+        except Exception:
+            self.close()
+            raise
+
+    def _add_tree(self, top):
+        """监视 top 及其所有子文件夹，返回其中已有的文件 (监视建立之前写入的文件不会产生事件)"""
+        found = set()
+        for root, dirs, files in os.walk(top):
+            dirs[:] = [d for d in dirs if not self.watcher.is_excluded(os.path.join(root, d))]
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                raise OSError(self._ctypes.get_errno(), f"inotify_add_watch failed: {root}")
+            self.dirs[wd] = root
+            found.update(os.path.join(root, f) for f in files if self.watcher.is_supported(f))
+        return found
+
+    def read(self, timeout):
+        """等待最多 timeout 秒，返回有事件的文件路径集合"""
+        readable, _, _ = select.select([self.fd], [], [], max(0, timeout))
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # 事件丢失，重新扫描全部文件
+                changed.update(self.watcher.scan())
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            directory = self.dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and not self.watcher.is_excluded(path):
+                    changed.update(self._add_tree(path))
+            elif self.watcher.is_supported(name):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class FolderWatcher:
+    """
+    监视文件夹并压缩新增 / 修改的图片 (BatchEngine 执行压缩)
+    """
+
+    def __init__(self, roots, params, engine, extensions, output_dir=None, state_path=None,
+                 settle_seconds=DEFAULT_SETTLE_SECONDS, poll_seconds=DEFAULT_POLL_SECONDS, use_inotify=None):
+        """
+        :param roots: 监视的文件夹列表 (包含子文件夹)
+        :param params: 压缩参数字典 (同 BatchEngine.run)
+        :param engine: BatchEngine
+        :param extensions: 处理的文件扩展名 (小写，含点)
+        :param output_dir: 统一输出目录，None 表示源文件夹下的 _compressed
+        :param state_path: 状态索引路径，None 表示按文件夹自动生成 (见 default_state_path)
+        :param settle_seconds: 文件保持不变多少秒后才处理
+        :param poll_seconds: 轮询扫描的间隔
+        :param use_inotify: None 表示可用时使用 inotify，False 表示总是轮询 (网络共享盘)
+        """
+        self.roots = [os.path.normpath(os.path.abspath(r)) for r in roots]
+        self.params = params
+        self.engine = engine
+        self.extensions = tuple(extensions)
+        self.output_dir = os.path.normpath(os.path.abspath(output_dir)) if output_dir else None
+        self.state = WatchState(state_path or default_state_path(self.roots))
+        self.settle = settle_seconds
+        self.poll_seconds = poll_seconds
+        self.use_inotify = use_inotify
+        # 等待写入完成的文件: 路径 -> (签名, 最近一次变化的时间)
+        self.pending = {}
+
+    def is_supported(self, name):
+        return name.lower().endswith(self.extensions)
+
+    def is_excluded(self, directory):
+        """输出目录不监视"""
+        directory = os.path.normpath(directory)
+        if os.path.basename(directory) == OUTPUT_DIR_NAME:
+            return True
+        return self.output_dir is not None and directory == self.output_dir
+
+    def scan(self):
+        """遍历所有监视的文件夹: {路径: 签名}"""
+        found = {}
+        for top in self.roots:
+            for root, dirs, files in os.walk(top):
+                dirs[:] = [d for d in dirs if not self.is_excluded(os.path.join(root, d))]
+                for f in files:
+                    if self.is_supported(f):
+                        path = os.path.join(root, f)
+                        sig = file_signature(path)
+                        if sig is not None:
+                            found[path] = sig
+        return found
+
+    def _create_scanner(self):
+        if self.use_inotify is not False and sys.platform.startswith('linux'):
+            try:
+                return InotifyScanner(self)
+            except Exception as e:
+                # 如监视数量达到 max_user_watches 上限
+                print(f"Inotify Error: {e}, falling back to polling")
+        return PollingScanner(self, self.poll_seconds)
+
+    def _touch(self, paths, now):
+        """记录有变化的文件 (已处理且未变化的文件忽略，如覆盖模式写回的输出)"""
+        for path in paths:
+            sig = file_signature(path)
+            if sig is None:
+                self.pending.pop(path, None)
+            elif not self.state.is_current(path, sig):
+                old = self.pending.get(path)
+                if old is None or old[0] != sig:
+                    self.pending[path] = (sig, now)
+
+    def _take_settled(self, now):
+        """取出已保持 settle 秒不变的文件: {路径: 签名}"""
+        settled = {}
+        for path, (sig, since) in list(self.pending.items()):
+            if now - since < self.settle:
+                continue
+            current = file_signature(path)
+            if current is None:
+                del self.pending[path]
+            elif current != sig:
+                # 仍在写入
+                self.pending[path] = (current, now)
+            else:
+                settled[path] = sig
+                del self.pending[path]
+        return settled
+
+    def run(self, stop=None):
+        """
+        常驻运行，逐个产出压缩结果 (生成器，与 BatchEngine.run 相同)
+        :param stop: 可选 threading.Event，设置后在当前一批处理完后退出
+        """
+        scanner = self._create_scanner()
+        try:
+            # 启动时: 清理已删除文件的记录，处理上次退出后变化的文件
+            existing = self.scan()
+            self.state.prune(existing)
+            self._touch(existing, time.monotonic() - self.settle)
+            if isinstance(scanner, PollingScanner):
+                scanner.known = existing
+                scanner._next_scan = time.monotonic() + self.poll_seconds
+
+            while stop is None or not stop.is_set():
+                now = time.monotonic()
+                settled = self._take_settled(now)
+                if settled:
+                    yield from self._process(settled)
+                    continue
+
+                # 等到下一个文件可能写完，或有新事件
+                wait = self.settle
+                if self.pending:
+                    wait = min(since for _, since in self.pending.values()) + self.settle - now
+                self._touch(scanner.read(min(max(wait, 0.05), self.settle)), time.monotonic())
+        finally:
+            scanner.close()
+
+    def _process(self, settled):
+        files = sorted(settled)
+        for result in self.engine.run(files, self.params, output_dir=self.output_dir):
+            path = result['file']
+            if os.path.normpath(result['output']) == os.path.normpath(path):
+                # 覆盖模式: 记录写回后的文件，避免把自己的输出当作新文件
+                sig = file_signature(path)
+            else:
+                sig = settled[path]
+            # 失败的文件同样记录，文件再次变化时才重试
+            if sig is not None:
+                self.state.mark(path, sig)
+            yield result
+        try:
+            self.state.save()
+        except OSError as e:
+            print(f"Watch State Error: {e}")